@@ -14,17 +14,22 @@ from pylinkchecker.models import Config
 def crawl(url):
     """Crawls a URL and returns a pylinkchecker.crawler.Site instance.
 
+    The pages of the site are indexed by url split (see
+    pylinkchecker.crawler.Site.index_by_url).
+
     :rtype: A pylinkchecker.crawler.Site instance
     """
     config = Config()
     config.parse_api_config([url])
     logger = configure_logger(config)
     crawler = execute_from_config(config, logger)
+    crawler.site.index_by_url()
 
     return crawler.site
 
 
-def crawl_with_options(urls, options_dict=None, logger_builder=None):
+def crawl_with_options(urls, options_dict=None, logger_builder=None,
+        score_func=None):
     """Crawls URLs with provided options and logger.
 
     :param options_dict: Must contain the long name of the command line
@@ -33,6 +38,10 @@ def crawl_with_options(urls, options_dict=None, logger_builder=None):
     :param logger_builder: Function that will be called to instantiate a
             logger. (optional)
 
+    :param score_func: Function that will be called with each
+            pylinkchecker.models.WorkerInput to get its priority. Lower scores
+            are crawled first. (optional)
+
     :rtype: A pylinkchecker.crawler.Site instance
     """
 
@@ -47,6 +56,7 @@ def crawl_with_options(urls, options_dict=None, logger_builder=None):
 
     # TODO In the future, we will pass the logger builder and not the logger
     # to enable the ProcessSiteCrawler to instantiate its own custom logger.
-    crawler = execute_from_config(config, logger)
+    crawler = execute_from_config(config, logger, score_func)
+    crawler.site.index_by_url()
 
     return crawler.site
@@ -0,0 +1,6 @@
+#!/usr/bin/env python
+
+from pylinkchecker import merge
+
+if __name__ == "__main__":
+    merge.execute_from_command_line()
@@ -15,8 +15,12 @@ if sys.version_info[0] < 3:
     import Queue
     unicode = unicode
     get_content_type = lambda m: m.gettype()
+    get_charset = lambda m: m.getparam("charset")
     get_safe_str = lambda s: s.encode("utf-8")
     from StringIO import StringIO
+    import urllib
+    unquote = lambda s: urllib.unquote(s.encode("utf-8")).decode("utf-8",
+            "replace")
 else:
     range = range
     import urllib.parse as urlparse
@@ -26,8 +30,10 @@ else:
     import queue as Queue
     unicode = str
     get_content_type = lambda m: m.get_content_type()
+    get_charset = lambda m: m.get_content_charset()
     get_safe_str = lambda s: s
     from io import StringIO
+    unquote = urlparse.unquote
 
 try:
     from logging import NullHandler
@@ -5,28 +5,132 @@ Contains the crawling logic.
 from __future__ import unicode_literals, absolute_import
 
 import base64
+import gzip
+import hashlib
+import io
+import itertools
 import logging
+import os
+import pickle
+import re
 import sys
+import threading
 import time
 
 from pylinkchecker.bs4 import BeautifulSoup
 
 import pylinkchecker.compat as compat
 from pylinkchecker.compat import (range, HTTPError, get_url_open, unicode,
-        get_content_type, get_url_request)
+        get_content_type, get_url_request, get_charset)
 from pylinkchecker.models import (Config, WorkerInit, Response, PageCrawl,
-        ExceptionStr, Link, SitePage, WorkerInput, TYPE_ATTRIBUTES, HTML_MIME_TYPE,
-        MODE_THREAD, MODE_PROCESS, MODE_GREEN, WHEN_ALWAYS, UTF8Class,
+        ExceptionStr, Link, LinkBlock, RawLink, PageExtract, SitePage,
+        WorkerInput, Validators, TYPE_ATTRIBUTES, HTML_MIME_TYPE,
+        TRUNCATED_SIZE, TRUNCATED_ELEMENTS, TRUNCATED_TIME,
+        MODE_THREAD, MODE_PROCESS, MODE_GREEN, MODE_REMOTE, WHEN_ALWAYS,
+        UTF8Class,
         PageStatus, PageSource, PAGE_QUEUED, PAGE_CRAWLED, VERBOSE_QUIET,
-        VERBOSE_NORMAL, LazyLogParam)
+        SKIPPED_DEPTH, SKIPPED_PAGES, SKIPPED_DURATION, SKIPPED_UNCHANGED,
+        SKIPPED_ERRORS, SKIPPED_ROBOTS,
+        VERBOSE_NORMAL, is_downloadable)
+from pylinkchecker.frontier import (Frontier, SpillingFrontier, HostFrontier,
+        SpillingDict)
+from pylinkchecker.remote import (ShardedQueue, parse_address, send_message,
+        recv_message)
+from pylinkchecker.sampling import Sampler
+from pylinkchecker.sitemap import parse_sitemap
+from pylinkchecker.state import CrawlState, save_checkpoint, load_checkpoint
 from pylinkchecker.reporter import report
 from pylinkchecker.urlutil import (get_clean_url_split, get_absolute_url_split,
-        is_link, SUPPORTED_SCHEMES)
+        is_link, is_fragment_link, SUPPORTED_SCHEMES, absolute_url_cache,
+        URLCache, split_fragment, get_anchor_key, get_canonical_url_split,
+        get_url_id, BloomFilter, get_url_template)
 
 
 WORK_DONE = '__WORK_DONE__'
 
 
+# Number of worker inputs sent to the workers at once for each worker.
+DISPATCH_FACTOR = 2
+
+
+NOT_MODIFIED = 304
+
+
+# Properties of a page stored in the state of incremental crawls.
+INCREMENTAL_STATE_NAMES = ("status", "is_html", "final_url", "etag",
+        "last_modified", "hash", "links", "anchors")
+
+
+# Attributes of the Site saved in a checkpoint (the page statuses are
+# streamed separately).
+CHECKPOINT_ATTRIBUTES = ("pages", "error_pages", "seen_urls", "url_count",
+        "link_blocks", "content_hashes", "duplicate_pages", "truncated_pages",
+        "anchors", "redirects", "fragment_links", "unchecked_fragment_links",
+        "missing_anchors", "skipped_urls", "skipped_sources", "url_templates",
+        "sampler")
+
+
+# Attributes of the Site saved in the result file of a shard.
+SHARD_RESULT_ATTRIBUTES = ("pages", "error_pages", "duplicate_pages",
+        "truncated_pages", "missing_anchors", "skipped_urls",
+        "skipped_sources", "url_templates")
+
+
+# Attributes of the Site that map url ids to SitePage.
+PAGE_MAP_ATTRIBUTES = ("pages", "error_pages", "duplicate_pages",
+        "truncated_pages")
+
+
+# Status of urls found in the Bloom filter of the site.
+CRAWLED_STATUS = PageStatus(PAGE_CRAWLED, None, None)
+
+
+UTF8_ENCODING = "utf-8"
+
+
+# Only the beginning of a document is searched for a meta charset, like
+# browsers do.
+META_CHARSET_SIZE = 1024
+
+META_CHARSET = re.compile(
+        br"""<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)""", re.I)
+
+
+# Number of parsed pages kept by each worker to skip pages with the same
+# content.
+EXTRACT_CACHE_SIZE = 1000
+
+
+# Seconds (in addition to --max-parse-time) after which a page sent to the
+# parse pool is reported as an error, e.g., if the process parsing it died.
+PARSE_TIMEOUT = 60
+
+
+# Seconds between two checks of the pages sent to the parse pool.
+PARSE_WATCH_INTERVAL = 1
+
+
+# Seconds needed to parse an element until the parse cost is measured. It is
+# pessimistic so the first large pages are not parsed without a limit.
+DEFAULT_ELEMENT_PARSE_TIME = 0.0001
+
+
+START_TAG = re.compile(r"<[a-zA-Z]")
+
+START_TAG_BYTES = re.compile(br"<[a-zA-Z]")
+
+
+# Elements that usually contain the links shared by the pages of a site.
+BLOCK_TAGS = ('header', 'footer', 'nav', 'aside')
+
+BLOCK_CONTAINER_TAGS = ('div', 'ul', 'ol', 'section', 'table')
+
+BLOCK_NAME = re.compile(r"header|footer|nav|menu", re.I)
+
+# Links that are resolved the same way on all pages of a host.
+HOST_RELATIVE_URL = re.compile(r"^(/|[a-zA-Z][a-zA-Z0-9+.-]*:)")
+
+
 def get_logger(propagate=False):
     """Returns a logger."""
     root_logger = logging.getLogger()
@@ -50,50 +154,473 @@ def get_logger(propagate=False):
 class SiteCrawler(object):
     """Main crawler/orchestrator"""
 
-    def __init__(self, config, logger):
+    def __init__(self, config, logger, score_func=None):
         self.config = config
         self.start_url_splits = []
         for start_url in config.start_urls:
-            self.start_url_splits.append(get_clean_url_split(start_url))
+            self.start_url_splits.append(config.get_canonical_url_split(
+                get_clean_url_split(start_url)))
         self.workers = []
         self.input_queue = self.build_queue(config)
         self.output_queue = self.build_queue(config)
+        self.score_func = score_func
+        self.frontier = self.build_frontier(config)
         self.logger = logger
         self.site = Site(self.start_url_splits, config, self.logger)
+        self.state = self.build_state(config)
+
+        self.sitemap_lastmods = {}
+        """Map of url split:lastmod of the urls found in the sitemaps"""
+
+        self.in_flight_inputs = {}
+        """Map of url split:WorkerInput sent to the workers"""
 
     def build_logger(self):
         return self.logger
 
     def crawl(self):
+        try:
+            return self._crawl()
+        finally:
+            # The temporary files are removed even if the crawl fails.
+            self.frontier.close()
+            self.site.close()
+
+    def _crawl(self):
+        self.parse_pool = self.build_parse_pool(self.config)
         worker_init = WorkerInit(self.config.worker_config,
-            self.input_queue, self.output_queue, self.build_logger())
+            self.input_queue, self.output_queue, self.build_logger(),
+            self.parse_pool)
         self.workers = self.get_workers(self.config, worker_init)
 
-        queue_size = len(self.start_url_splits)
-        for start_url_split in self.start_url_splits:
-            self.input_queue.put(WorkerInput(start_url_split, True), False)
+        start = time.time()
+
+        if not self.resume():
+            if self.config.options.changed:
+                self.add_changed_urls(self.config.options.changed)
+            else:
+                for start_url_split in self.start_url_splits:
+                    self.frontier.put(WorkerInput(start_url_split, True, 0))
+
+                for sitemap_url in self.config.options.sitemaps:
+                    self.add_sitemap_urls(sitemap_url)
+
+        # Only a few worker inputs are sent to the workers at once so that
+        # the most important urls found in the meantime are crawled first.
+        max_in_flight = self.config.worker_size * DISPATCH_FACTOR
+        in_flight = self.dispatch(0, max_in_flight)
 
         self.start_workers(self.workers, self.input_queue, self.output_queue)
 
         self.start_progress()
 
-        while True:
-            page_crawl = self.output_queue.get()
-            queue_size -= 1
-            new_worker_inputs = self.process_page_crawl(page_crawl)
+        checkpoint_time = time.time()
+
+        # The site and the frontier are only consistent (and can be saved in
+        # a checkpoint) while the crawler waits for the workers: the page
+        # crawls received and not processed yet are still in flight.
+        is_consistent = True
+
+        try:
+            while True:
+                for page_crawl in self.wait_page_crawls(in_flight):
+                    is_consistent = False
+                    in_flight -= 1
+                    self.in_flight_inputs.pop(page_crawl.original_url_split,
+                            None)
+                    self.frontier.done(page_crawl.original_url_split)
+                    new_worker_inputs = self.process_page_crawl(page_crawl)
+
+                    # We only process new pages if run_once is False
+                    # (default)
+                    for worker_input in new_worker_inputs:
+                        self.frontier.put(worker_input)
+
+                    self.progress(page_crawl, len(self.site.pages),
+                            in_flight + len(self.frontier))
+                    is_consistent = True
+
+                is_consistent = False
+                if self.config.options.max_duration is not None and\
+                        time.time() - start > self.config.options.max_duration:
+                    # Crawl budget exceeded: we only wait for the urls being
+                    # crawled.
+                    self.skip_frontier(SKIPPED_DURATION)
+
+                if self.config.options.max_errors is not None and\
+                        (in_flight > 0 or len(self.frontier)) and\
+                        self.site.get_error_count() >=\
+                        self.config.options.max_errors:
+                    # Fail fast: the urls not crawled yet are skipped and the
+                    # urls being crawled are ignored.
+                    self.skip_frontier(SKIPPED_ERRORS)
+                    self.skip_in_flight(SKIPPED_ERRORS)
+                    self.site.stopped = True
+                    break
+
+                options = self.config.options
+                if options.checkpoint and time.time() - checkpoint_time >\
+                        options.checkpoint_interval:
+                    self.save_checkpoint()
+                    checkpoint_time = time.time()
+
+                in_flight = self.dispatch(in_flight, max_in_flight)
+
+                if in_flight <= 0 and not len(self.frontier):
+                    break
+                is_consistent = True
+        except KeyboardInterrupt:
+            if self.config.options.checkpoint and is_consistent:
+                self.save_checkpoint()
+            elif self.config.options.checkpoint:
+                self.logger.warning("Interrupted while processing a page: "
+                        "the previous checkpoint is kept.")
+            # The urls not taken by the workers yet are not crawled.
+            self.clear_input_queue()
+            self.stop_workers(self.workers, self.input_queue,
+                    self.output_queue)
+            raise
+
+        self.stop_workers(self.workers, self.input_queue, self.output_queue)
+        if self.config.options.check_anchors:
+            self.site.check_anchors()
+        if self.state:
+            self.save_state()
+        if self.config.robots:
+            self.config.robots.save()
+        if self.config.options.checkpoint and\
+                os.path.exists(self.config.options.checkpoint):
+            # The crawl is complete: the next crawl starts over.
+            os.remove(self.config.options.checkpoint)
+        if self.config.options.shard_file:
+            self.save_shard_file(time.time() - start)
+        self.stop_progress()
+        return self.site
+
+    def resume(self):
+        """Restores the site and the frontier from the checkpoint if
+        --resume is set. The urls that were being crawled are crawled again.
+
+        Returns True if the crawl was resumed.
+        """
+        if not self.config.options.resume:
+            return False
+        # The page statuses and the frontier are streamed from the file.
+        page_statuses = new_page_statuses(self.config.options)
+
+        def restore_page_status(item):
+            page_statuses[item[0]] = item[1]
+
+        data = load_checkpoint(self.config.options.checkpoint, {
+            "page_statuses": restore_page_status,
+            "frontier": self.frontier.put})
+        if data is None:
+            self.logger.warning("No checkpoint found, starting a new crawl.")
+            return False
+
+        self.site.restore_checkpoint(data["site"], page_statuses)
+        self.sitemap_lastmods = data["sitemap_lastmods"]
+        return True
+
+    def save_checkpoint(self):
+        """Saves the site, the frontier and the urls being crawled. The urls
+        being crawled are saved first in the frontier."""
+        frontier_inputs = itertools.chain(self.in_flight_inputs.values(),
+                self.frontier.snapshot())
+        save_checkpoint(self.config.options.checkpoint, {
+            "site": self.site.get_checkpoint(),
+            "sitemap_lastmods": self.sitemap_lastmods,
+        }, [("page_statuses", self.site.page_statuses.items()),
+            ("frontier", frontier_inputs)])
+
+    def save_shard_file(self, total_time):
+        """Saves the results of the urls of the shard to be merged with the
+        results of the other shards."""
+        save_checkpoint(self.config.options.shard_file, {
+            "shard": self.config.shard,
+            "start_urls": [url_split.geturl() for url_split in
+                    self.start_url_splits],
+            "total_time": total_time,
+            "site": self.site.get_shard_result(),
+        })
+
+    def wait_page_crawls(self, in_flight):
+        """Waits for the workers and returns a sequence of PageCrawl.
+
+        Returns early (and maybe an empty sequence) when a url of the
+        frontier that had to wait (e.g., Crawl-delay) can be crawled.
+        """
+        wait_time = self.frontier.get_wait_time()
+        if in_flight <= 0:
+            # Nothing is being crawled: wait for the first available url.
+            time.sleep(wait_time or 0)
+            return []
+
+        try:
+            return get_page_crawls(self.output_queue.get(True, wait_time))
+        except compat.Queue.Empty:
+            return []
+
+    def add_sitemap_urls(self, sitemap_url):
+        """Adds the urls of a sitemap (and of the sitemaps of a sitemap
+        index) to the frontier.
+
+        Urls whose lastmod did not change since the previous crawl are not
+        crawled.
+        """
+        sitemap_urls = [sitemap_url]
+        seen_sitemap_urls = set()
+        while sitemap_urls:
+            sitemap_url = sitemap_urls.pop()
+            if sitemap_url in seen_sitemap_urls:
+                continue
+            seen_sitemap_urls.add(sitemap_url)
+
+            sitemap_url_split = get_clean_url_split(sitemap_url)
+            for entry in self.read_sitemap(sitemap_url_split):
+                if entry.is_index:
+                    sitemap_urls.append(get_absolute_url_split(entry.url,
+                            sitemap_url_split).geturl())
+                else:
+                    self.add_sitemap_url(get_absolute_url_split(entry.url,
+                            sitemap_url_split), entry.lastmod)
+
+    def read_sitemap(self, sitemap_url_split):
+        """Returns a sequence of SitemapEntry."""
+        # We do this here to allow patching by gevent
+        import socket
+        response = open_url(get_url_open(), get_url_request(),
+                sitemap_url_split.geturl(), self.config.options.timeout,
+                socket.timeout,
+                user_agent=self.config.options.user_agent)
+        if response.exception:
+            self.logger.warning("Cannot open sitemap %s: %s",
+                    sitemap_url_split.geturl(), response.exception)
+            return []
+
+        content = response.content
+        if sitemap_url_split.path.endswith(".gz"):
+            content = gzip.GzipFile(fileobj=io.BytesIO(content.read()))
+
+        try:
+            # The entries are read before the response is closed.
+            return list(parse_sitemap(content))
+        except Exception as exc:
+            self.logger.warning("Cannot parse sitemap %s: %s",
+                    sitemap_url_split.geturl(), exc)
+            return []
+        finally:
+            response.content.close()
+
+    def add_sitemap_url(self, url_split, lastmod):
+        url_split = self.config.get_canonical_url_split(split_fragment(
+                url_split)[0])
+        if url_split.scheme not in SUPPORTED_SCHEMES or\
+                not self.config.should_download(url_split):
+            return
+
+        if lastmod:
+            self.sitemap_lastmods[url_split] = lastmod
+            if self.state and lastmod == self.state.get(url_split.geturl(),
+                    "lastmod"):
+                self.site.add_unchanged_url(url_split)
+                return
+
+        worker_input = self.site.add_seed_url(url_split)
+        if worker_input:
+            self.frontier.put(worker_input)
+
+    def add_changed_urls(self, path):
+        """Adds the changed urls and the pages linking to them to the
+        frontier.
 
-            # We only process new pages if run_once is False (default)
-            for worker_input in new_worker_inputs:
-                queue_size += 1
-                self.input_queue.put(worker_input, False)
+        :param path: The path of a file with one url per line or - for stdin.
+        """
+        referrers = self.state.get_referrers()
+        if not referrers:
+            self.logger.warning("No links found in the state file %s. Run a "
+                    "crawl with --incremental first.", self.state.path)
+
+        for url in read_changed_urls(path):
+            url_split = self.config.get_canonical_url_split(split_fragment(
+                    get_clean_url_split(url))[0])
+            url_splits = [url_split]
+            for referrer in referrers.get(url_split.geturl(), []):
+                url_splits.append(get_clean_url_split(referrer))
+
+            for url_split in url_splits:
+                if url_split.scheme not in SUPPORTED_SCHEMES or\
+                        not self.config.should_download(url_split):
+                    continue
+                worker_input = self.site.add_seed_url(url_split)
+                if worker_input:
+                    self.frontier.put(worker_input)
+
+    def build_state(self, config):
+        """Returns the CrawlState of the previous crawls or None."""
+        if not config.options.state:
+            return None
+        state = CrawlState(config.options.state)
+        state.load()
+        return state
+
+    def save_state(self):
+        """Stores the lastmod of the sitemap urls. A page that failed or
+        that links to a broken url is crawled again by the next crawl, even if
+        its lastmod did not change."""
+        error_origins = self.site.get_error_origins()
+        for (url_split, lastmod) in self.sitemap_lastmods.items():
+            page = self.site.get_page(url_split)
+            if not page:
+                # Skipped: the previous lastmod is kept.
+                continue
+            elif not page.is_ok or page.url_split in error_origins:
+                # The page will be crawled again.
+                lastmod = None
+            self.state.set(url_split.geturl(), "lastmod", lastmod)
+        self.state.save()
+
+    def skip_frontier(self, reason):
+        """Removes all worker inputs from the frontier and marks their urls
+        as skipped."""
+        for worker_input in self.frontier.drain():
+            self.site.skip_url(worker_input.url_split, reason)
+
+    def skip_in_flight(self, reason):
+        """Removes the worker inputs not taken by the workers yet and marks
+        the urls sent to the workers as skipped."""
+        self.clear_input_queue()
+        for url_split in self.in_flight_inputs:
+            self.site.skip_url(url_split, reason)
+        self.in_flight_inputs = {}
+
+    def clear_input_queue(self):
+        clear_queue(self.input_queue)
+
+    def dispatch(self, in_flight, max_in_flight):
+        """Sends worker inputs from the frontier to the workers. Returns the
+        number of worker inputs sent and not processed yet.
+
+        :param max_in_flight: Maximum number of batches sent and not
+                processed yet.
+        """
+        batch_size = self.get_batch_size()
+        while in_flight < max_in_flight * batch_size:
+            batch = self.get_batch(batch_size)
+            if not batch:
+                # The frontier is empty or no host is available.
+                break
+            for worker_input in batch:
+                self.in_flight_inputs[worker_input.url_split] = worker_input
+
+            if batch_size == 1:
+                self.input_queue.put(batch[0], False)
+            else:
+                self.input_queue.put(batch, False)
+            in_flight += len(batch)
+        return in_flight
+
+    def get_batch(self, batch_size):
+        """Returns a list of at most batch_size worker inputs from the
+        frontier."""
+        batch = []
+        while len(batch) < batch_size:
+            try:
+                worker_input = self.frontier.get()
+            except IndexError:
+                break
+            if self.config.robots and\
+                    not self.config.robots.is_allowed(worker_input.url_split):
+                # The rules are known: the host was ready.
+                self.frontier.done(worker_input.url_split)
+                self.site.skip_url(worker_input.url_split, SKIPPED_ROBOTS)
+                continue
+            if self.config.options.incremental:
+                worker_input = self.add_validators(worker_input)
+            batch.append(worker_input)
+        return batch
+
+    def add_validators(self, worker_input):
+        """Returns the worker input with the Validators of the previous
+        crawl."""
+        page_state = self.state.pages.get(worker_input.url_split.geturl())
+        if not page_state or "status" not in page_state:
+            return worker_input
+        return worker_input._replace(validators=Validators(
+                page_state.get("etag"), page_state.get("last_modified"),
+                page_state.get("hash")))
+
+    def get_stored_page_crawl(self, page_crawl):
+        """Returns the page crawl of a page that did not change since the
+        previous crawl with the links stored by the previous crawl."""
+        page_state = self.state.pages.get(
+                page_crawl.original_url_split.geturl())
+        if not page_state or "status" not in page_state:
+            return page_crawl
 
-            self.progress(page_crawl, len(self.site.pages), queue_size)
+        links = []
+        for (link_type, url, source_str, fragment) in page_state["links"]:
+            url_split = get_clean_url_split(url)
+            if not is_downloadable(url_split, self.config.worker_config):
+                # The options changed since the previous crawl.
+                continue
+            links.append(Link(type=link_type, url_split=url_split,
+                    original_url_split=page_crawl.original_url_split,
+                    source_str=source_str, fragment=fragment))
+
+        anchors = page_state.get("anchors")
+        if anchors is not None:
+            anchors = frozenset(anchors)
+
+        return page_crawl._replace(
+                final_url_split=get_clean_url_split(page_state["final_url"]),
+                status=page_state["status"], links=links,
+                is_html=page_state["is_html"], link_blocks=[], block_ids=[],
+                content_hash=page_state.get("hash"), anchors=anchors,
+                validators=Validators(page_state.get("etag"),
+                page_state.get("last_modified"), page_state.get("hash")))
+
+    def store_page_crawl(self, page_crawl):
+        """Stores the validators and the links of a page for the next
+        crawls."""
+        url = page_crawl.original_url_split.geturl()
+        if not page_crawl.validators or page_crawl.truncated or\
+                not page_crawl.status or page_crawl.status >= 400:
+            # The page will be crawled again.
+            for name in INCREMENTAL_STATE_NAMES:
+                self.state.set(url, name, None)
+            return
 
-            if queue_size <= 0:
-                self.stop_workers(self.workers, self.input_queue,
-                        self.output_queue)
-                self.stop_progress()
-                return self.site
+        links = []
+        for link in self.site.get_page_links(page_crawl):
+            links.append([link.type, link.url_split.geturl(), link.source_str,
+                    link.fragment])
+        anchors = page_crawl.anchors
+        if anchors is not None:
+            anchors = sorted(anchors)
+        final_url_split = page_crawl.final_url_split or\
+                page_crawl.original_url_split
+
+        values = {"status": page_crawl.status, "is_html": page_crawl.is_html,
+                "final_url": final_url_split.geturl(),
+                "etag": page_crawl.validators.etag,
+                "last_modified": page_crawl.validators.last_modified,
+                "hash": page_crawl.validators.content_hash, "links": links,
+                "anchors": anchors}
+        for name in INCREMENTAL_STATE_NAMES:
+            self.state.set(url, name, values[name])
+
+    def get_batch_size(self):
+        """Returns the number of worker inputs to send at once to a worker.
+
+        Large batches are sent when many urls are waiting and small batches
+        at the end of the crawl so that all workers keep working.
+        """
+        max_batch_size = self.config.options.batch_size
+        if max_batch_size <= 1:
+            return 1
+        return max(1, min(max_batch_size,
+                len(self.frontier) // self.config.worker_size))
 
     def start_progress(self):
         if self.config.options.progress:
@@ -127,6 +654,28 @@ class SiteCrawler(object):
         """Returns an object implementing the Queue interface."""
         raise NotImplementedError()
 
+    def build_frontier(self, config):
+        """Returns the Frontier that orders the urls to crawl."""
+        if config.options.frontier_memory:
+            return SpillingFrontier(config.options.frontier_memory,
+                    self.score_func, config.options.frontier_dir)
+        elif config.options.max_host_workers or config.host_weights or\
+                config.robots:
+            delay_func = None
+            ready_func = None
+            if config.robots:
+                delay_func = config.robots.get_crawl_delay
+                ready_func = config.robots.is_ready
+            return HostFrontier(self.score_func,
+                    config.options.max_host_workers, config.host_weights,
+                    delay_func, ready_func)
+        return Frontier(self.score_func)
+
+    def build_parse_pool(self, config):
+        """Returns a ParsePool shared by the workers or None if the workers
+        parse the pages themselves."""
+        return None
+
     def get_workers(self, config, worker_init):
         """Returns a sequence of workers of the desired type."""
         raise NotImplementedError()
@@ -140,9 +689,20 @@ class SiteCrawler(object):
         for worker in workers:
             input_queue.put(WORK_DONE)
 
+        if self.parse_pool:
+            self.parse_pool.close()
+
     def process_page_crawl(self, page_crawl):
         """Returns a sequence of SplitResult to crawl."""
-        return self.site.add_crawled_page(page_crawl)
+        incremental = self.config.options.incremental
+        if incremental and page_crawl.not_modified:
+            page_crawl = self.get_stored_page_crawl(page_crawl)
+
+        worker_inputs = self.site.add_crawled_page(page_crawl)
+
+        if incremental:
+            self.store_page_crawl(page_crawl)
+        return worker_inputs
 
 
 class ThreadSiteCrawler(SiteCrawler):
@@ -151,6 +711,11 @@ class ThreadSiteCrawler(SiteCrawler):
     def build_queue(self, config):
         return compat.Queue.Queue()
 
+    def build_parse_pool(self, config):
+        if not config.parse_worker_size:
+            return None
+        return ParsePool(config.parse_worker_size, config.parse_queue_size)
+
     def get_workers(self, config, worker_init):
         from threading import Thread
         workers = []
@@ -222,6 +787,373 @@ class GreenSiteCrawler(SiteCrawler):
             worker.start()
 
 
+class RemoteSiteCrawler(SiteCrawler):
+    """Site Crawler (coordinator) with remote workers connected over TCP.
+
+    Each remote worker owns the hosts of its shard and crawls their urls with
+    its own thread workers.
+    """
+
+    def __init__(self, config, *args, **kwargs):
+        super(RemoteSiteCrawler, self).__init__(config, *args, **kwargs)
+        import socket
+        self.remote_worker_size = config.options.remote_workers
+        self.shard_queues = [compat.Queue.Queue() for _ in
+                range(self.remote_worker_size)]
+        self.input_queue = ShardedQueue(self.shard_queues)
+        self.key = get_remote_key(config)
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(parse_address(config.options.listen))
+        self.server.listen(self.remote_worker_size)
+        self.address = self.server.getsockname()
+        """(host, port) the remote workers connect to"""
+
+    def build_queue(self, config):
+        return compat.Queue.Queue()
+
+    def get_workers(self, config, worker_init):
+        """Returns a connection to each remote worker. Blocks until all the
+        remote workers are connected.
+
+        Each remote worker replies with its number of threads (its own
+        --workers): the worker size of the crawl is their sum.
+        """
+        self.logger.info("Waiting for %s remote workers on %s:%s",
+                self.remote_worker_size, self.address[0], self.address[1])
+        workers = []
+        for shard_queue in self.shard_queues:
+            (sock, address) = self.server.accept()
+            self.logger.info("Remote worker connected from %s", address)
+            workers.append(RemoteConnection(sock, shard_queue,
+                    self.output_queue, self.key, self.logger))
+
+        worker_size = 0
+        for worker in workers:
+            send_message(worker.sock, worker_init.worker_config, self.key)
+            worker_size += recv_message(worker.sock, self.key)
+        config.worker_size = worker_size
+        return workers
+
+    def start_workers(self, workers, input_queue, output_queue):
+        for worker in workers:
+            worker.start()
+
+    def clear_input_queue(self):
+        for shard_queue in self.shard_queues:
+            clear_queue(shard_queue)
+
+    def stop_workers(self, workers, input_queue, output_queue):
+        for shard_queue in self.shard_queues:
+            shard_queue.put(WORK_DONE)
+        self.server.close()
+
+
+class RemoteConnection(object):
+    """Connection of the coordinator to a remote worker.
+
+    A thread sends the worker inputs of the shard queue and another thread
+    puts the page crawls received in the output queue. If the connection is
+    lost, the urls sent and not crawled are reported as errors.
+    """
+
+    def __init__(self, sock, input_queue, output_queue, key=None,
+            logger=None):
+        self.sock = sock
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.key = key
+        self.logger = logger or get_logger()
+        self.lost = False
+
+        self.pending = {}
+        """Map of url split:WorkerInput sent and not crawled yet"""
+
+        self._lock = threading.Lock()
+
+    def start(self):
+        for target in (self.send_forever, self.receive_forever):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+    def send_forever(self):
+        while True:
+            item = self.input_queue.get()
+            if item == WORK_DONE:
+                self._send(item)
+                return
+
+            worker_inputs = item if isinstance(item, list) else [item]
+            with self._lock:
+                lost = self.lost
+                for worker_input in worker_inputs:
+                    self.pending[worker_input.url_split] = worker_input
+
+            if lost or not self._send(item):
+                self.fail_pending()
+
+    def receive_forever(self):
+        while True:
+            try:
+                output = recv_message(self.sock, self.key)
+            except EOFError:
+                break
+            except Exception as exc:
+                self.logger.error("Remote worker error: %s", exc)
+                break
+
+            with self._lock:
+                for page_crawl in get_page_crawls(output):
+                    self.pending.pop(page_crawl.original_url_split, None)
+            self.output_queue.put(output)
+
+        with self._lock:
+            self.lost = True
+        self.fail_pending()
+        self.sock.close()
+
+    def fail_pending(self):
+        """Reports the pending urls as errors."""
+        with self._lock:
+            if not self.lost:
+                return
+            worker_inputs = list(self.pending.values())
+            self.pending.clear()
+
+        for worker_input in worker_inputs:
+            self.output_queue.put(get_error_page_crawl(worker_input.url_split,
+                    ExceptionStr("RemoteWorkerError",
+                    "Connection to the remote worker lost")))
+
+    def _send(self, item):
+        try:
+            send_message(self.sock, item, self.key)
+            return True
+        except Exception as exc:
+            self.logger.error("Cannot send to remote worker: %s", exc)
+            with self._lock:
+                self.lost = True
+            return False
+
+
+def get_remote_key(config):
+    """Returns the key (bytes) that signs the messages."""
+    return config.options.remote_key.encode("utf-8")
+
+
+def run_remote_worker(config, logger=None):
+    """Connects to a coordinator and crawls the urls it sends with
+    config.worker_size thread workers until the crawl is complete."""
+    import socket
+    key = get_remote_key(config)
+    sock = socket.create_connection(parse_address(
+            config.options.remote_worker))
+    try:
+        worker_config = recv_message(sock, key)
+        worker_size = config.worker_size
+        send_message(sock, worker_size, key)
+        input_queue = compat.Queue.Queue()
+        output_queue = compat.Queue.Queue()
+        worker_init = WorkerInit(worker_config, input_queue, output_queue,
+                logger, None)
+        workers = []
+        for _ in range(worker_size):
+            worker = threading.Thread(target=crawl_page,
+                    kwargs={'worker_init': worker_init})
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        receiver = threading.Thread(target=receive_remote_inputs,
+                args=(sock, key, input_queue, output_queue, workers, logger))
+        receiver.daemon = True
+        receiver.start()
+
+        while True:
+            output = output_queue.get()
+            if output == WORK_DONE:
+                break
+            send_message(sock, output, key)
+    finally:
+        sock.close()
+
+
+def receive_remote_inputs(sock, key, input_queue, output_queue, workers,
+        logger=None):
+    """Puts the worker inputs sent by the coordinator in the input queue until
+    the crawl is complete or the connection fails. The workers are then
+    stopped and WORK_DONE is always put in the output queue."""
+    try:
+        while True:
+            worker_input = recv_message(sock, key)
+            if worker_input == WORK_DONE:
+                break
+            input_queue.put(worker_input)
+    except EOFError:
+        pass
+    except Exception as exc:
+        (logger or get_logger()).error("Cannot receive from the "
+                "coordinator: %s", exc)
+    finally:
+        for worker in workers:
+            input_queue.put(WORK_DONE)
+        for worker in workers:
+            worker.join()
+        output_queue.put(WORK_DONE)
+
+
+def get_conditional_headers(validators):
+    """Returns the headers of a conditional request (e.g., If-None-Match)
+    from the Validators of the previous crawl."""
+    headers = []
+    if validators and validators.etag:
+        headers.append(("If-None-Match", validators.etag))
+    if validators and validators.last_modified:
+        headers.append(("If-Modified-Since", validators.last_modified))
+    return headers
+
+
+def get_error_page_crawl(url_split, exception):
+    """Returns the PageCrawl of a url that could not be crawled."""
+    return PageCrawl(original_url_split=url_split, final_url_split=None,
+            status=None, is_timeout=False, is_redirect=False, links=[],
+            exception=exception, is_html=False, link_blocks=[], block_ids=[],
+            content_hash=None, truncated=None, anchors=None)
+
+
+class ParseCost(object):
+    """Average time needed to parse an element. Used to estimate how many
+    elements can be parsed within a time budget."""
+
+    def __init__(self):
+        self.elements = 0
+        self.seconds = 0.0
+        # Thread workers of the same process share the parse cost.
+        self._lock = threading.Lock()
+
+    def add(self, elements, seconds):
+        with self._lock:
+            self.elements += elements
+            self.seconds += seconds
+
+    def get_max_elements(self, max_seconds):
+        """Returns the number of elements that can be parsed in max_seconds
+        or None if max_seconds is not set."""
+        if not max_seconds:
+            return None
+        with self._lock:
+            if not self.elements or not self.seconds:
+                return int(max_seconds / DEFAULT_ELEMENT_PARSE_TIME)
+            return int(max_seconds * self.elements / self.seconds)
+
+
+parse_cost = ParseCost()
+"""Parse cost of the current process"""
+
+
+class ParsePool(object):
+    """Pool of processes that parse the pages fetched by thread workers.
+
+    Parsing holds the GIL so it is done in other processes while the threads
+    keep fetching pages. At most queue_size pages can wait for (or be in)
+    the pool: the workers block when the queue is full.
+    """
+
+    def __init__(self, size, queue_size):
+        import multiprocessing
+        self.pool = multiprocessing.Pool(size)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.closed = False
+
+        self.jobs = []
+        """ParseJob sent to the pool and maybe not parsed yet"""
+
+        self._lock = threading.Lock()
+
+        watcher = threading.Thread(target=self.watch_forever)
+        watcher.daemon = True
+        watcher.start()
+
+    def parse(self, content, charset, worker_config, callback):
+        """Parses a page with parse_html and calls callback with a tuple of
+        (PageExtract, ExceptionStr) in another thread.
+
+        callback is always called once: with an ExceptionStr if the pool
+        failed or if the page was not parsed in time.
+        """
+        self.slots.acquire()
+        timeout = PARSE_TIMEOUT + (worker_config.max_parse_time or 0)
+        job = ParseJob(callback, self.slots, time.time() + timeout)
+
+        try:
+            # Pickled here because Python 2 pools silently drop the tasks
+            # that cannot be pickled.
+            data = pickle.dumps((content, charset, worker_config), 2)
+            self.pool.apply_async(parse_html_job, (data,), callback=job.done)
+        except Exception as exc:
+            job.slots.release()
+            job.fail(exc)
+            return
+
+        with self._lock:
+            self.jobs.append(job)
+
+    def watch_forever(self):
+        """Fails the pages that were not parsed in time. Their slots are
+        only released once the pool is done with them."""
+        while not self.closed:
+            time.sleep(PARSE_WATCH_INTERVAL)
+            now = time.time()
+            with self._lock:
+                expired = [job for job in self.jobs if not job.reported and
+                        job.deadline < now]
+                self.jobs = [job for job in self.jobs if not job.reported and
+                        job.deadline >= now]
+            for job in expired:
+                job.report((None, ExceptionStr("ParseTimeout",
+                        "The page was not parsed in time")))
+
+    def close(self):
+        self.closed = True
+        self.pool.close()
+        self.pool.join()
+
+
+class ParseJob(object):
+    """A page sent to the parse pool. The first result (parsed page or
+    error) is given to the callback. The slot of the page is released when
+    the pool returns the page."""
+
+    def __init__(self, callback, slots, deadline):
+        self.callback = callback
+        self.slots = slots
+        self.deadline = deadline
+        self.reported = False
+        self._lock = threading.Lock()
+
+    def done(self, data):
+        """Called by the pool with the pickled result of parse_html_job."""
+        self.slots.release()
+        try:
+            result = pickle.loads(data)
+        except Exception as exc:
+            self.fail(exc)
+        else:
+            self.report(result)
+
+    def report(self, result):
+        with self._lock:
+            if self.reported:
+                return
+            self.reported = True
+        self.callback(result)
+
+    def fail(self, exc):
+        self.report((None, ExceptionStr(unicode(type(exc)), unicode(exc))))
+
+
 class PageCrawler(object):
     """Worker that parses a page and extracts links"""
 
@@ -229,6 +1161,7 @@ class PageCrawler(object):
         self.worker_config = worker_init.worker_config
         self.input_queue = worker_init.input_queue
         self.output_queue = worker_init.output_queue
+        self.parse_pool = worker_init.parse_pool
         self.urlopen = get_url_open()
         self.request_class = get_url_request()
         self.logger = worker_init.logger
@@ -242,6 +1175,12 @@ class PageCrawler(object):
 
         self.auth_header = None
 
+        self.sent_block_ids = set()
+        """Ids of the link blocks already sent by this worker"""
+
+        self.page_extracts = URLCache(EXTRACT_CACHE_SIZE)
+        """Cache of content hash:PageExtract"""
+
         if self.worker_config.username and self.worker_config.password:
             base64string = unicode(base64.encodestring(
                     '{0}:{1}'.format(self.worker_config.username,
@@ -256,10 +1195,39 @@ class PageCrawler(object):
 
             if worker_input == WORK_DONE:
                 # No more work! Pfew!
+                self.logger.debug("URL cache: %s hits, %s misses (%.0f%%)",
+                        absolute_url_cache.hits, absolute_url_cache.misses,
+                        absolute_url_cache.hit_rate * 100.0)
                 return
+            elif isinstance(worker_input, list):
+                # A batch of worker inputs: a batch of page crawls is sent
+                # back.
+                page_crawls = []
+                for single_worker_input in worker_input:
+                    page_crawl = self._crawl_page(single_worker_input)
+                    if page_crawl:
+                        page_crawls.append(page_crawl)
+                if page_crawls:
+                    self.put_output(page_crawls)
             else:
                 page_crawl = self._crawl_page(worker_input)
-                self.output_queue.put(page_crawl)
+                if page_crawl:
+                    # Otherwise, the page is sent once it is parsed.
+                    self.put_output(page_crawl)
+
+    def put_output(self, output):
+        """Sends a page crawl (or a list) to the orchestrator.
+
+        The link blocks are only marked as sent once the page crawls that
+        carry them are in the output queue: a page crawl that only refers to
+        a block can never reach the orchestrator before the block. A block
+        may be sent twice (e.g., by the parse pool thread), which is
+        harmless.
+        """
+        self.output_queue.put(output)
+        for page_crawl in get_page_crawls(output):
+            for link_block in page_crawl.link_blocks:
+                self.sent_block_ids.add(link_block.block_id)
 
     def _crawl_page(self, worker_input):
         page_crawl = None
@@ -268,23 +1236,38 @@ class PageCrawler(object):
         try:
             response = open_url(self.urlopen, self.request_class,
                     url_split_to_crawl.geturl(), self.worker_config.timeout,
-                    self.timeout_exception, self.auth_header)
-
-            if response.exception:
+                    self.timeout_exception, self.auth_header,
+                    get_conditional_headers(worker_input.validators),
+                    self.worker_config.user_agent)
+
+            if response.status == NOT_MODIFIED and worker_input.validators:
+                # The orchestrator reuses the links of the previous crawl.
+                page_crawl = PageCrawl(
+                        original_url_split=url_split_to_crawl,
+                        final_url_split=None, status=response.status,
+                        is_timeout=False, is_redirect=False, links=[],
+                        exception=None, is_html=False, link_blocks=[],
+                        block_ids=[], content_hash=None, truncated=None,
+                        anchors=None, not_modified=True)
+            elif response.exception:
                 if response.status:
                     # This is a http error. Good.
                     page_crawl = PageCrawl(
                             original_url_split=url_split_to_crawl,
                             final_url_split=None, status=response.status,
                             is_timeout=False, is_redirect=False, links=[],
-                            exception=None, is_html=False)
+                            exception=None, is_html=False, link_blocks=[],
+                            block_ids=[], content_hash=None, truncated=None,
+                            anchors=None)
                 elif response.is_timeout:
                     # This is a timeout. No need to wrap the exception
                     page_crawl = PageCrawl(
                             original_url_split=url_split_to_crawl,
                             final_url_split=None, status=None,
                             is_timeout=True, is_redirect=False, links=[],
-                            exception=None, is_html=False)
+                            exception=None, is_html=False, link_blocks=[],
+                            block_ids=[], content_hash=None, truncated=None,
+                            anchors=None)
                 else:
                     # Something bad happened when opening the url
                     exception = ExceptionStr(unicode(type(response.exception)),
@@ -293,20 +1276,67 @@ class PageCrawler(object):
                             original_url_split=url_split_to_crawl,
                             final_url_split=None, status=None,
                             is_timeout=False, is_redirect=False, links=[],
-                            exception=exception, is_html=False)
+                            exception=exception, is_html=False,
+                            link_blocks=[], block_ids=[],
+                            content_hash=None, truncated=None, anchors=None)
             else:
-                final_url_split = get_clean_url_split(response.final_url)
+                final_url_split = self.get_canonical_url_split(
+                        get_clean_url_split(response.final_url))
 
                 mime_type = get_content_type(response.content.info())
                 links = []
+                link_blocks = []
+                block_ids = []
+                content_hash = None
+                truncated = None
+                anchors = None
+                not_modified = False
+                info = response.content.info()
 
                 is_html = mime_type == HTML_MIME_TYPE
 
                 if is_html and worker_input.should_crawl:
-                    html_soup = BeautifulSoup(response.content,
-                            self.worker_config.parser)
-                    links = self.get_links(html_soup, final_url_split)
+                    (content, truncated) = read_content(response.content,
+                            self.worker_config.max_page_size)
+                    content_hash = hashlib.md5(content).hexdigest()
+                    validators = Validators(info.get("ETag"),
+                            info.get("Last-Modified"), content_hash)
+
+                    # Pages with the same content (e.g., with a session id)
+                    # are only parsed once.
+                    page_extract = self.page_extracts.get(content_hash)
+                    if worker_input.validators and content_hash ==\
+                            worker_input.validators.content_hash:
+                        # The server ignored the conditional request but the
+                        # page did not change.
+                        not_modified = True
+                    elif page_extract is None and self.parse_pool:
+                        self._parse_later(content,
+                                get_charset(response.content.info()),
+                                PageCrawl(original_url_split=url_split_to_crawl,
+                                final_url_split=final_url_split,
+                                status=response.status, is_timeout=False,
+                                is_redirect=response.is_redirect, links=[],
+                                exception=None, is_html=is_html,
+                                link_blocks=[], block_ids=[],
+                                content_hash=content_hash,
+                                truncated=truncated, anchors=None,
+                                validators=validators))
+                        return None
+                    elif page_extract is None:
+                        page_extract = parse_html(content,
+                                get_charset(response.content.info()),
+                                self.worker_config)
+                        self.page_extracts.put(content_hash, page_extract)
+
+                    if not not_modified:
+                        (links, link_blocks, block_ids) = self.resolve_links(
+                                page_extract, final_url_split)
+                        truncated = truncated or page_extract.truncated
+                        anchors = page_extract.anchors
                 else:
+                    validators = Validators(info.get("ETag"),
+                            info.get("Last-Modified"), None)
                     self.logger.debug("Won't crawl %s. MIME Type: %s. Should crawl: %s",
                             final_url_split, mime_type,
                             worker_input.should_crawl)
@@ -314,67 +1344,128 @@ class PageCrawler(object):
                 page_crawl = PageCrawl(original_url_split=url_split_to_crawl,
                     final_url_split=final_url_split, status=response.status,
                     is_timeout=False, is_redirect=response.is_redirect,
-                    links=links, exception=None, is_html=is_html)
+                    links=links, exception=None, is_html=is_html,
+                    link_blocks=link_blocks, block_ids=block_ids,
+                    content_hash=content_hash, truncated=truncated,
+                    anchors=anchors, validators=validators,
+                    not_modified=not_modified)
         except Exception as exc:
             exception = ExceptionStr(unicode(type(exc)), unicode(exc))
             page_crawl = PageCrawl(original_url_split=url_split_to_crawl,
                     final_url_split=None, status=None,
                     is_timeout=False, is_redirect=False, links=[],
-                    exception=exception, is_html=False)
+                    exception=exception, is_html=False, link_blocks=[],
+                    block_ids=[], content_hash=None, truncated=None,
+                    anchors=None)
             self.logger.exception("Exception occurred while crawling a page.")
 
         return page_crawl
 
-    def get_links(self, html_soup, original_url_split):
-        """Get Link for desired types (e.g., a, link, img, script)
-
-        :param html_soup: The page parsed by BeautifulSoup
+    def _parse_later(self, content, charset, page_crawl):
+        """Sends a page to the parse pool. The page crawl is completed with
+        its links and sent to the output queue once the page is parsed."""
+
+        def on_parsed(result):
+            (page_extract, exception) = result
+            try:
+                if exception:
+                    raise Exception("{0}: {1}".format(exception.type_name,
+                            exception.message))
+                self.page_extracts.put(page_crawl.content_hash, page_extract)
+                (links, link_blocks, block_ids) = self.resolve_links(
+                        page_extract, page_crawl.final_url_split)
+                completed_page_crawl = page_crawl._replace(links=links,
+                        link_blocks=link_blocks, block_ids=block_ids,
+                        truncated=page_crawl.truncated or
+                        page_extract.truncated, anchors=page_extract.anchors)
+            except Exception as exc:
+                exception = ExceptionStr(unicode(type(exc)), unicode(exc))
+                completed_page_crawl = PageCrawl(
+                        original_url_split=page_crawl.original_url_split,
+                        final_url_split=None, status=None, is_timeout=False,
+                        is_redirect=False, links=[], exception=exception,
+                        is_html=False, link_blocks=[], block_ids=[],
+                        content_hash=None, truncated=None, anchors=None)
+                self.logger.exception("Exception occurred while parsing a "
+                        "page.")
+            self.put_output(completed_page_crawl)
+
+        self.parse_pool.parse(content, charset, self.worker_config, on_parsed)
+
+    def resolve_links(self, page_extract, original_url_split):
+        """Resolves the links extracted from a page.
+
+        If link blocks are enabled, the links of a block are only sent the
+        first time this worker sees the block: the orchestrator remembers the
+        links of each block.
+
+        :param page_extract: The PageExtract of the page.
         :param original_url_split: The URL of the page used to resolve relative
                 links.
-        :rtype: A sequence of Link objects
+        :rtype: A tuple of (sequence of Link, sequence of new LinkBlock,
+                sequence of block ids found on the page).
         """
-
         # This is a weird html tag that defines the base URL of a page.
         base_url_split = original_url_split
-
-        bases = html_soup.find_all('base')
-        if bases:
-            base = bases[0]
-            if 'href' in base.attrs:
-                base_url_split = get_clean_url_split(base['href'])
-
-        links = []
-        for element_type in self.worker_config.types:
-            if element_type not in TYPE_ATTRIBUTES:
-                raise Exception("Unknown element type: {0}".
-                        format(element_type))
-            attribute = TYPE_ATTRIBUTES[element_type]
-            element_links = html_soup.find_all(element_type)
-            links.extend(self._get_links(element_links, attribute,
-                    base_url_split, original_url_split))
-        return links
-
-    def _get_links(self, elements, attribute, base_url_split,
-        original_url_split):
+        if page_extract.base_url:
+            base_url_split = get_clean_url_split(page_extract.base_url)
+
+        link_blocks = []
+        block_ids = []
+        for raw_links in page_extract.raw_blocks:
+            block_id = get_block_id(base_url_split, raw_links)
+            block_ids.append(block_id)
+            if block_id not in self.sent_block_ids:
+                # Marked as sent by put_output.
+                links = self._get_links(raw_links, base_url_split,
+                        original_url_split)
+                link_blocks.append(LinkBlock(block_id, links))
+
+        links = self._get_links(page_extract.raw_links, base_url_split,
+                original_url_split)
+
+        return (links, link_blocks, block_ids)
+
+    def get_canonical_url_split(self, url_split):
+        return get_canonical_url_split(url_split,
+                self.worker_config.sort_query,
+                self.worker_config.strip_tracking_params)
+
+    def _get_links(self, raw_links, base_url_split, original_url_split):
+        """Returns the links that the site must download. Links are filtered
+        (hosts, ignored prefixes) and deduplicated here so the site only
+        checks if they were seen before."""
         links = []
-        for element in elements:
-            if attribute in element.attrs:
-                url = element[attribute]
+        seen_links = set()
+        for raw_link in raw_links:
+            if is_fragment_link(raw_link.url):
+                # An anchor of the page itself, whatever its base url.
+                abs_url_split = get_absolute_url_split(raw_link.url,
+                        original_url_split)
+            else:
+                abs_url_split = get_absolute_url_split(raw_link.url,
+                        base_url_split)
 
-                if not self.worker_config.strict_mode:
-                    url = url.strip()
+            if abs_url_split.scheme not in SUPPORTED_SCHEMES:
+                continue
 
-                if not is_link(url):
-                    continue
-                abs_url_split = get_absolute_url_split(url, base_url_split)
+            (abs_url_split, fragment) = split_fragment(abs_url_split)
+            if not self.worker_config.check_anchors:
+                fragment = None
+            abs_url_split = self.get_canonical_url_split(abs_url_split)
 
-                if abs_url_split.scheme not in SUPPORTED_SCHEMES:
-                    continue
+            # The same url can be linked as a page and as a resource (e.g.,
+            # <a> and <img>): the sampling strata depend on the type.
+            link_key = (abs_url_split, fragment, raw_link.type)
+            if link_key in seen_links or\
+                    not is_downloadable(abs_url_split, self.worker_config):
+                continue
+            seen_links.add(link_key)
 
-                link = Link(type=unicode(element.name), url_split=abs_url_split,
-                    original_url_split=original_url_split,
-                    source_str=unicode(element))
-                links.append(link)
+            link = Link(type=raw_link.type, url_split=abs_url_split,
+                original_url_split=original_url_split,
+                source_str=raw_link.source_str, fragment=fragment)
+            links.append(link)
 
         return links
 
@@ -389,40 +1480,263 @@ class Site(UTF8Class):
     def __init__(self, start_url_splits, config, logger=None):
         self.start_url_splits = start_url_splits
 
+        self.indexed_by_url = False
+        """True if the maps of pages are indexed by url split instead of url
+        id (see index_by_url)"""
+
         self.pages = {}
-        """Map of url:SitePage"""
+        """Map of url id:SitePage"""
 
         self.error_pages = {}
-        """Map of url:SitePage with is_ok=False"""
+        """Map of url id:SitePage with is_ok=False"""
+
+        self.page_statuses = new_page_statuses(config.options)
+        """Map of url id:PageStatus (PAGE_QUEUED, PAGE_CRAWLED). With a Bloom
+        filter, crawled urls are removed from this map. With
+        --frontier-memory, most statuses are stored in a temporary file."""
+
+        self.seen_urls = None
+        """BloomFilter of the ids of the queued and crawled urls"""
+        if config.options.bloom_filter_size:
+            self.seen_urls = BloomFilter(config.options.bloom_filter_size)
+
+        self.url_count = 0
+        """Number of urls queued so far"""
+
+        self.link_blocks = {}
+        """Map of block id:sequence of Link sent by the workers"""
+
+        self.content_hashes = {}
+        """Map of content hash:url of the first page with this content"""
+
+        self.duplicate_pages = {}
+        """Map of url id:SitePage with the same content as another page"""
+
+        self.truncated_pages = {}
+        """Map of url id:SitePage that were only partially parsed"""
+
+        self.anchors = {}
+        """Map of url id:frozenset of anchor keys of crawled HTML pages"""
 
-        self.page_statuses = {}
-        """Map of url:PageStatus (PAGE_QUEUED, PAGE_CRAWLED)"""
+        self.redirects = {}
+        """Map of original url id:final url id of redirected pages"""
+
+        self.fragment_links = {}
+        """Map of (url, fragment):list of PageSource"""
+
+        self.unchecked_fragment_links = {}
+        """Map of url id:set of (url, fragment) of the fragment links not
+        checked yet"""
+
+        self.missing_anchors = {}
+        """Map of (url, fragment):list of PageSource for anchors that do not
+        exist"""
+
+        self.stopped = False
+        """True if the crawl stopped before the end because --max-errors was
+        reached"""
+
+        self.skipped_urls = {}
+        """Map of url:reason (e.g., SKIPPED_DEPTH) of urls that were not
+        crawled because the crawl budget was exceeded"""
+
+        self.skipped_sources = {}
+        """Map of url:list of PageSource of the skipped urls"""
+
+        self.url_templates = {}
+        """Map of url template:[number of pages crawled, number of pages only
+        downloaded because --max-per-template was exceeded]"""
+
+        self.sampler = None
+        """Sampler that selects the urls to check in sampling mode"""
+        if config.options.sample_rate:
+            self.sampler = Sampler(config.options.sample_rate,
+                    config.options.sample_min, config.options.sample_seed)
 
         self.config = config
 
         self.logger = logger
 
-        for start_url_split in self.start_url_splits:
-            self.page_statuses[start_url_split] = PageStatus(PAGE_QUEUED, [])
+        if not config.options.changed:
+            # The seeds of an impact crawl are queued with add_seed_url.
+            for start_url_split in self.start_url_splits:
+                self.queue_url(get_url_id(start_url_split),
+                        PageStatus(PAGE_QUEUED, [], 0))
 
     @property
     def is_ok(self):
-        """Returns True if there is no error page."""
-        return len(self.error_pages) == 0
+        """Returns True if there is no error page and no missing anchor."""
+        return len(self.error_pages) == 0 and len(self.missing_anchors) == 0
+
+    def get_checkpoint(self):
+        """Returns a dict of the attributes saved in a checkpoint."""
+        data = {}
+        for name in CHECKPOINT_ATTRIBUTES:
+            data[name] = getattr(self, name)
+        return data
+
+    def restore_checkpoint(self, data, page_statuses):
+        self.close()
+        for name in CHECKPOINT_ATTRIBUTES:
+            setattr(self, name, data[name])
+        self.page_statuses = page_statuses
+
+    def close(self):
+        """Removes the temporary file of the page statuses, if any."""
+        if isinstance(self.page_statuses, SpillingDict):
+            self.page_statuses.close()
+
+    def get_shard_result(self):
+        data = {}
+        for name in SHARD_RESULT_ATTRIBUTES:
+            data[name] = getattr(self, name)
+        # Urls are skipped before their shard is known.
+        data["skipped_urls"] = dict((url_split, reason) for
+                (url_split, reason) in self.skipped_urls.items() if
+                self.is_in_shard(url_split))
+        data["skipped_sources"] = dict((url_split, sources) for
+                (url_split, sources) in self.skipped_sources.items() if
+                url_split in data["skipped_urls"])
+        data["stopped"] = self.stopped
+        return data
+
+    def add_shard_result(self, data):
+        """Adds the results of a shard. The urls of the shards are disjoint
+        but urls of several shards can redirect to the same page: the sources
+        of this page are merged."""
+        for (url_id, page) in data["pages"].items():
+            if url_id in self.pages:
+                self.pages[url_id].add_sources(page.sources)
+            else:
+                self.pages[url_id] = page
+        for name in ("error_pages", "duplicate_pages", "truncated_pages"):
+            pages = getattr(self, name)
+            for url_id in data[name]:
+                pages.setdefault(url_id, self.pages[url_id])
+
+        for (key, sources) in data["missing_anchors"].items():
+            self.missing_anchors.setdefault(key, []).extend(sources)
+        self.skipped_urls.update(data["skipped_urls"])
+        self.skipped_sources.update(data["skipped_sources"])
+        for (template, counts) in data["url_templates"].items():
+            total_counts = self.url_templates.setdefault(template, [0, 0])
+            total_counts[0] += counts[0]
+            total_counts[1] += counts[1]
+        self.stopped = self.stopped or data["stopped"]
+
+    def is_in_shard(self, url_split):
+        """Returns True if the url must be checked and reported by this crawl
+        (always True without --shard)."""
+        if not self.config.shard:
+            return True
+        (index, count) = self.config.shard
+        return get_url_id(url_split) % count == index - 1
+
+    def get_error_origins(self):
+        """Returns the set of the urls of the pages that link to a broken url
+        or to a missing anchor."""
+        origins = set()
+        for page in self.error_pages.values():
+            for source in page.sources:
+                origins.add(source.origin)
+        for sources in self.missing_anchors.values():
+            for source in sources:
+                origins.add(source.origin)
+        return origins
+
+    def get_page(self, url_split):
+        """Returns the SitePage of a url or None if it was not crawled."""
+        if self.indexed_by_url:
+            return self.pages.get(url_split)
+        return self.pages.get(get_url_id(url_split))
+
+    def index_by_url(self):
+        """Indexes the pages of a finished crawl by url split, like the other
+        maps of the site and the sites of previous versions."""
+        if self.indexed_by_url:
+            return
+        for name in PAGE_MAP_ATTRIBUTES:
+            setattr(self, name, dict((page.url_split, page) for page in
+                    getattr(self, name).values()))
+        self.indexed_by_url = True
+
+    def add_seed_url(self, url_split):
+        """Adds a url that was not found in a page (e.g., in a sitemap).
+        Returns a WorkerInput or None if the url was already seen or must be
+        skipped."""
+        url_id = get_url_id(url_split)
+        if url_id in self.page_statuses or (self.seen_urls is not None and
+                url_id in self.seen_urls):
+            return None
+
+        skip_reason = self.get_skip_reason(0)
+        if skip_reason:
+            self.add_skipped_url(url_split, skip_reason, [])
+            return None
+
+        self.queue_url(url_id, PageStatus(PAGE_QUEUED,
+                self.remove_skipped_url(url_split), 0))
+        return WorkerInput(url_split, self.should_crawl(url_split, 0), 0)
+
+    def should_crawl(self, url_split, depth):
+        """Returns True if the links of the page must be crawled. Only the
+        first pages of each url template are crawled if --max-per-template is
+        set: the other pages are only downloaded."""
+        should_crawl = self.config.should_crawl(url_split, depth)
+        max_per_template = self.config.options.max_per_template
+        if should_crawl and max_per_template:
+            counts = self.url_templates.setdefault(
+                    get_url_template(url_split), [0, 0])
+            if counts[0] >= max_per_template:
+                counts[1] += 1
+                return False
+            counts[0] += 1
+        return should_crawl
+
+    def add_unchanged_url(self, url_split):
+        """Marks a url as not changed since the previous crawl: it is not
+        crawled even if a page links to it."""
+        url_id = get_url_id(url_split)
+        if url_id in self.page_statuses:
+            # Already queued (e.g., start url).
+            return
+        self.queue_url(url_id, PageStatus(PAGE_CRAWLED, None, 0))
+        self.add_skipped_url(url_split, SKIPPED_UNCHANGED, [])
+
+    def mark_seen(self, url_id, depth):
+        """Marks a url as seen without crawling it."""
+        if self.seen_urls is not None:
+            self.seen_urls.add(url_id)
+        else:
+            self.page_statuses[url_id] = PageStatus(PAGE_CRAWLED, None, depth)
+
+    def queue_url(self, url_id, page_status):
+        self.page_statuses[url_id] = page_status
+        self.url_count += 1
+        if self.seen_urls is not None:
+            self.seen_urls.add(url_id)
 
     def add_crawled_page(self, page_crawl):
         """Adds a crawled page. Returns a list of url split to crawl"""
-        if not page_crawl.original_url_split in self.page_statuses:
+        for link_block in page_crawl.link_blocks:
+            self.link_blocks[link_block.block_id] = link_block.links
+
+        original_url_id = get_url_id(page_crawl.original_url_split)
+        if not original_url_id in self.page_statuses:
             self.logger.warning("Original URL not seen before!")
             return []
 
-        status = self.page_statuses[page_crawl.original_url_split]
+        status = self.page_statuses[original_url_id]
 
         # Mark it as crawled
-        self.page_statuses[page_crawl.original_url_split] = PageStatus(
-                PAGE_CRAWLED, None)
+        if self.seen_urls is not None:
+            # The Bloom filter remembers that the url was seen.
+            del self.page_statuses[original_url_id]
+        else:
+            self.page_statuses[original_url_id] = PageStatus(
+                    PAGE_CRAWLED, None, status.depth)
 
-        if page_crawl.original_url_split in self.pages:
+        if original_url_id in self.pages:
             self.logger.warning("Original URL already crawled! Concurrency issue!")
             return []
 
@@ -430,11 +1744,17 @@ class Site(UTF8Class):
         if not final_url_split:
             # Happens on 404/500/timeout/error
             final_url_split = page_crawl.original_url_split
+        final_url_id = get_url_id(final_url_split)
+
+        if not self.is_in_shard(page_crawl.original_url_split):
+            # Only crawled to find the links: another shard reports it.
+            return self.process_shard_links(page_crawl, status.depth,
+                    original_url_id, final_url_id)
 
-        if final_url_split in self.pages:
+        if final_url_id in self.pages:
             # This means that we already processed this final page.
             # It's a redirect. Just add a source
-            site_page = self.pages[final_url_split]
+            site_page = self.pages[final_url_id]
             site_page.add_sources(status.sources)
         else:
             # We never crawled this page before
@@ -443,62 +1763,495 @@ class Site(UTF8Class):
                     page_crawl.is_timeout, page_crawl.exception,
                     page_crawl.is_html, is_local)
             site_page.add_sources(status.sources)
-            self.pages[final_url_split] = site_page
+            site_page.truncated = page_crawl.truncated
+            self.pages[final_url_id] = site_page
+
+            if site_page.truncated:
+                self.truncated_pages[final_url_id] = site_page
+            elif page_crawl.anchors is not None:
+                # The anchors of a truncated page may be incomplete.
+                self.anchors[final_url_id] = page_crawl.anchors
+
+            if page_crawl.content_hash:
+                canonical_url_split = self.content_hashes.setdefault(
+                        page_crawl.content_hash, final_url_split)
+                if canonical_url_split != final_url_split:
+                    site_page.duplicate_of = canonical_url_split
+                    self.duplicate_pages[final_url_id] = site_page
 
             if not site_page.is_ok:
-                self.error_pages[final_url_split] = site_page
-
-        return self.process_links(page_crawl)
-
-    def process_links(self, page_crawl):
+                self.error_pages[final_url_id] = site_page
+
+        if self.sampler:
+            self.sampler.add_result(original_url_id, site_page.is_ok)
+
+        if self.config.options.check_anchors:
+            self.check_crawled_anchors(original_url_id, final_url_id)
+
+        return self.process_links(page_crawl, status.depth)
+
+    def process_shard_links(self, page_crawl, depth, original_url_id,
+            final_url_id):
+        """Keeps what the pages of this shard need from a page of another
+        shard (anchors, content hash) and returns its links to crawl."""
+        if page_crawl.anchors is not None and not page_crawl.truncated:
+            self.anchors[final_url_id] = page_crawl.anchors
+        if self.config.options.check_anchors:
+            self.check_crawled_anchors(original_url_id, final_url_id)
+        if page_crawl.content_hash:
+            self.content_hashes.setdefault(page_crawl.content_hash,
+                    page_crawl.final_url_split or
+                    page_crawl.original_url_split)
+        return self.process_links(page_crawl, depth)
+
+    def process_links(self, page_crawl, depth=0):
+        """Returns a list of WorkerInput for the links never seen before.
+
+        The workers already filtered and deduplicated the links of the page:
+        only the urls seen before are checked here (robots.txt is checked when
+        the urls are sent to the workers).
+
+        :param page_crawl: The crawled page.
+        :param depth: The number of links followed from a start url to reach
+                the crawled page.
+        """
         links_to_process = []
 
         source_url_split = page_crawl.original_url_split
         if page_crawl.final_url_split:
             source_url_split = page_crawl.final_url_split
 
-        for link in page_crawl.links:
+        for link in self.get_page_links(page_crawl):
             url_split = link.url_split
-            if not self.config.should_download(url_split):
-                self.logger.debug("Won't download %s. Is local? %s",
-                        url_split,
-                        LazyLogParam(lambda : self.config.is_local(url_split)))
-                continue
-
-            page_status = self.page_statuses.get(url_split, None)
+            url_id = get_url_id(url_split)
+            page_status = self.page_statuses.get(url_id, None)
+            if not page_status and self.seen_urls is not None and\
+                    url_id in self.seen_urls:
+                # Already crawled (or a false positive of the Bloom filter).
+                page_status = CRAWLED_STATUS
             page_source = PageSource(source_url_split, link.source_str)
 
+            if link.fragment and self.is_in_shard(url_split):
+                fragment_key = (url_split, link.fragment)
+                if fragment_key not in self.fragment_links:
+                    self.unchecked_fragment_links.setdefault(url_id,
+                            set()).add(fragment_key)
+                self.fragment_links.setdefault(fragment_key, []).append(
+                        page_source)
+                # The page may already be crawled.
+                self.check_page_anchors(url_id)
+
             if not page_status:
                 # We never encountered this url before
-                self.page_statuses[url_split] = PageStatus(PAGE_QUEUED,
-                        [page_source])
+                skip_reason = self.get_skip_reason(depth + 1)
+                if skip_reason:
+                    self.add_skipped_url(url_split, skip_reason,
+                            [page_source])
+                    continue
+
+                if self.sampler and not self.sampler.sample(url_id,
+                        url_split, link.type):
+                    # Not in the sample: the url is never checked.
+                    self.mark_seen(url_id, depth + 1)
+                    continue
+
+                if not self.config.should_crawl(url_split, depth + 1) and\
+                        not self.is_in_shard(url_split):
+                    # Only downloaded by the shard that owns the url.
+                    self.mark_seen(url_id, depth + 1)
+                    continue
+
+                # The url may have been skipped when found deeper.
+                sources = self.remove_skipped_url(url_split)
+                sources.append(page_source)
+                self.queue_url(url_id, PageStatus(PAGE_QUEUED, sources,
+                        depth + 1))
                 links_to_process.append(
-                        WorkerInput(url_split, self.config.should_crawl(url_split)))
+                        WorkerInput(url_split,
+                        self.should_crawl(url_split, depth + 1),
+                        depth + 1))
             elif page_status.status == PAGE_CRAWLED:
                 # Already crawled. Add source
-                if url_split in self.pages:
-                    self.pages[url_split].add_sources([page_source])
+                if url_id in self.pages:
+                    self.pages[url_id].add_sources([page_source])
+                elif url_split in self.skipped_urls:
+                    # Not crawled (e.g., unchanged)
+                    self.skipped_sources[url_split].append(page_source)
                 else:
                     # TODO the final url is different. need a way to link it...
                     pass
             elif page_status.status == PAGE_QUEUED:
                 # Already queued for crawling. Add source.
                 page_status.sources.append(page_source)
+                # The status may have been read from disk.
+                self.page_statuses[url_id] = page_status
 
         return links_to_process
 
+    def get_skip_reason(self, depth):
+        """Returns the reason why a new url at this depth must not be crawled
+        or None if the crawl budget allows it."""
+        options = self.config.options
+        if options.max_depth is not None and depth > options.max_depth:
+            return SKIPPED_DEPTH
+        if options.max_pages is not None and\
+                self.url_count >= options.max_pages:
+            return SKIPPED_PAGES
+        return None
+
+    def skip_url(self, url_split, reason):
+        """Marks a queued url as skipped."""
+        sources = []
+        page_status = self.page_statuses.pop(get_url_id(url_split), None)
+        if page_status:
+            self.url_count -= 1
+            sources = page_status.sources or []
+        self.add_skipped_url(url_split, reason, sources)
+
+    def add_skipped_url(self, url_split, reason, sources):
+        """Records a url that is not crawled and the pages linking to it."""
+        self.skipped_urls.setdefault(url_split, reason)
+        self.skipped_sources.setdefault(url_split, []).extend(sources)
+
+    def remove_skipped_url(self, url_split):
+        """Forgets a skipped url that is queued after all (e.g., found at a
+        smaller depth). Returns the sources found while it was skipped."""
+        self.skipped_urls.pop(url_split, None)
+        return self.skipped_sources.pop(url_split, [])
+
+    def check_crawled_anchors(self, original_url_id, final_url_id):
+        """Checks the fragment links to a page that was just crawled."""
+        if final_url_id != original_url_id:
+            self.redirects[original_url_id] = final_url_id
+            self.check_page_anchors(final_url_id)
+        self.check_page_anchors(original_url_id)
+
+    def check_anchors(self):
+        """Finds the links to anchors that do not exist in the crawled pages.
+
+        Only the anchors of HTML pages that were crawled can be checked. The
+        fragment links are usually checked when their page is crawled (see
+        check_page_anchors).
+        """
+        for url_id in list(self.unchecked_fragment_links):
+            self.check_page_anchors(url_id)
+
+    def check_page_anchors(self, url_id):
+        """Checks the fragment links to a page once it was crawled. Each
+        fragment link is checked once."""
+        if url_id not in self.unchecked_fragment_links:
+            return
+        final_url_id = self.redirects.get(url_id, url_id)
+        anchors = self.anchors.get(final_url_id)
+        if anchors is None and final_url_id not in self.pages:
+            # Not crawled yet.
+            return
+
+        fragment_keys = self.unchecked_fragment_links.pop(url_id)
+        if anchors is None:
+            # Crawled but not an HTML page.
+            return
+        for fragment_key in fragment_keys:
+            fragment = fragment_key[1]
+            # #top is always valid (see HTML specification)
+            if get_anchor_key(fragment) not in anchors and\
+                    fragment.lower() != "top":
+                self.missing_anchors[fragment_key] =\
+                        self.fragment_links[fragment_key]
+
+    def get_error_count(self):
+        """Returns the number of broken urls and missing anchors found so
+        far."""
+        return len(self.error_pages) + len(self.missing_anchors)
+
+    def get_page_links(self, page_crawl):
+        """Returns the links of a page and of its link blocks."""
+        links = list(page_crawl.links)
+        for block_id in page_crawl.block_ids:
+            if block_id in self.link_blocks:
+                links.extend(self.link_blocks[block_id])
+            else:
+                self.logger.warning("Link block %s was never received",
+                        block_id)
+        return links
+
     def __unicode__(self):
         return "Site for {0}".format(self.start_url_splits)
 
 
+def new_page_statuses(options):
+    """Returns an empty map of url id:PageStatus, stored in a temporary file
+    if --frontier-memory is set."""
+    if options.frontier_memory:
+        return SpillingDict(options.frontier_memory, options.frontier_dir)
+    return {}
+
+
+def clear_queue(queue):
+    """Removes all the items of a queue."""
+    try:
+        while True:
+            queue.get(False)
+    except compat.Queue.Empty:
+        pass
+
+
+def read_changed_urls(path):
+    """Returns the list of urls of a file (one url per line) or of stdin if
+    path is -."""
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with io.open(path, "r", encoding="utf-8") as changed_file:
+            lines = changed_file.readlines()
+
+    urls = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if line and not line.startswith("#"):
+            urls.append(line)
+    return urls
+
+
+def get_page_crawls(output):
+    """Returns a sequence of PageCrawl from a worker output (a PageCrawl or a
+    batch of PageCrawl)."""
+    if isinstance(output, list):
+        return output
+    return [output]
+
+
 def crawl_page(worker_init):
     """Safe redirection to the page crawler"""
     page_crawler = PageCrawler(worker_init)
     page_crawler.crawl_page_forever()
 
 
+def parse_html(content, charset, worker_config):
+    """Parses an HTML page and extracts its links.
+
+    If the page has more elements than allowed by the worker config, only
+    the beginning of the page is parsed. The time budget is enforced the same
+    way: the number of elements that can be parsed in time is estimated from
+    the pages previously parsed by this process (or from
+    DEFAULT_ELEMENT_PARSE_TIME).
+
+    :param content: The bytes of the page.
+    :param charset: The charset of the Content-Type header (optional).
+    :param worker_config: The WorkerConfig used to extract links.
+    :rtype: A PageExtract
+    """
+    start = time.time()
+    truncated = None
+    markup = get_unicode_markup(content, charset)
+
+    max_elements = worker_config.max_elements
+    max_parse_time = worker_config.max_parse_time
+    time_max_elements = parse_cost.get_max_elements(max_parse_time)
+    if time_max_elements is not None and (max_elements is None or
+            time_max_elements < max_elements):
+        max_elements = time_max_elements
+        reason = TRUNCATED_TIME
+    else:
+        reason = TRUNCATED_ELEMENTS
+
+    element_count = None
+    if max_elements is not None or max_parse_time:
+        (markup, element_count, is_truncated) = truncate_markup(markup,
+                max_elements)
+        if is_truncated:
+            truncated = reason
+
+    html_soup = BeautifulSoup(markup, worker_config.parser)
+    if element_count:
+        parse_cost.add(element_count, time.time() - start)
+
+    page_extract = extract_links(html_soup, worker_config)
+
+    # A page parsed completely is not flagged, even if it took longer than
+    # max_parse_time: all its links were found.
+    return page_extract._replace(truncated=truncated)
+
+
+def truncate_markup(markup, max_elements=None):
+    """Truncates a document before its (max_elements + 1)th start tag.
+
+    :param markup: The document, as a unicode string or as bytes.
+    :param max_elements: The maximum number of elements or None to only
+            count the elements.
+    :rtype: A tuple of (markup, number of elements counted, True if the
+            markup was truncated)
+    """
+    if isinstance(markup, unicode):
+        pattern = START_TAG
+    else:
+        pattern = START_TAG_BYTES
+
+    count = 0
+    for match in pattern.finditer(markup):
+        if max_elements is not None and count >= max_elements:
+            return (markup[:match.start()], count, True)
+        count += 1
+
+    return (markup, count, False)
+
+
+def read_content(content, max_size=None):
+    """Reads a response up to max_size bytes.
+
+    :rtype: A tuple of (bytes, TRUNCATED_SIZE or None)
+    """
+    if not max_size:
+        return (content.read(), None)
+
+    data = content.read(max_size + 1)
+    if len(data) > max_size:
+        return (data[:max_size], TRUNCATED_SIZE)
+
+    return (data, None)
+
+
+def parse_html_job(data):
+    """Calls parse_html with the pickled arguments and returns a pickled
+    tuple of (PageExtract, ExceptionStr) instead of raising an exception, so
+    the pool always returns a result. Executed by the ParsePool."""
+    try:
+        (content, charset, worker_config) = pickle.loads(data)
+        return pickle.dumps((parse_html(content, charset, worker_config),
+            None), 2)
+    except Exception as exc:
+        return pickle.dumps((None, ExceptionStr(unicode(type(exc)),
+            unicode(exc))), 2)
+
+
+def extract_links(html_soup, worker_config):
+    """Extracts the links of the desired types (e.g., a, link, img, script)
+    without resolving them.
+
+    :param html_soup: The page parsed by BeautifulSoup. Link blocks are
+            removed from the tree.
+    :param worker_config: The WorkerConfig used to extract links.
+    :rtype: A PageExtract
+    """
+    base_url = None
+    bases = html_soup.find_all('base')
+    if bases:
+        base = bases[0]
+        if 'href' in base.attrs:
+            base_url = base['href']
+
+    anchors = None
+    if worker_config.check_anchors:
+        anchors = get_anchors(html_soup)
+
+    raw_blocks = []
+    if worker_config.link_blocks:
+        for block in find_blocks(html_soup):
+            raw_links = _extract_raw_links(block, worker_config)
+            if raw_links and all(HOST_RELATIVE_URL.match(raw_link.url) for
+                    raw_link in raw_links):
+                raw_blocks.append(raw_links)
+                block.extract()
+            # Otherwise, the links of this block depend on the page URL. They
+            # are processed with the other links of the page.
+
+    raw_links = _extract_raw_links(html_soup, worker_config)
+
+    return PageExtract(base_url, raw_links, raw_blocks, None, anchors)
+
+
+def get_anchors(html_soup):
+    """Returns a frozenset of the keys of the ids and anchor names of a
+    page."""
+    keys = set()
+    for element in html_soup.find_all(id=True):
+        keys.add(get_anchor_key(element['id']))
+    for element in html_soup.find_all('a', attrs={'name': True}):
+        keys.add(get_anchor_key(element['name']))
+    return frozenset(keys)
+
+
+def _extract_raw_links(html_soup, worker_config):
+    raw_links = []
+    for element_type in worker_config.types:
+        if element_type not in TYPE_ATTRIBUTES:
+            raise Exception("Unknown element type: {0}".
+                    format(element_type))
+        attribute = TYPE_ATTRIBUTES[element_type]
+
+        for element in html_soup.find_all(element_type):
+            if attribute not in element.attrs:
+                continue
+
+            url = element[attribute]
+
+            if not worker_config.strict_mode:
+                url = url.strip()
+
+            if not is_link(url) and not (worker_config.check_anchors and
+                    is_fragment_link(url)):
+                continue
+
+            raw_links.append(RawLink(unicode(element.name), url,
+                    unicode(element)))
+
+    return raw_links
+
+
+def find_blocks(html_soup):
+    """Returns the outermost elements that look like a header, a footer or a
+    menu."""
+    blocks = []
+    block_object_ids = set()
+    for element in html_soup.find_all(is_block):
+        is_nested = False
+        for parent in element.parents:
+            if id(parent) in block_object_ids:
+                is_nested = True
+                break
+        if not is_nested:
+            blocks.append(element)
+            block_object_ids.add(id(element))
+    return blocks
+
+
+def is_block(element):
+    """Returns True if the element probably contains links shared by many
+    pages of a site."""
+    if element.name in BLOCK_TAGS:
+        return True
+
+    if element.name in BLOCK_CONTAINER_TAGS:
+        names = element.get('class') or []
+        if not isinstance(names, list):
+            names = [names]
+        names = names + [element.get('id') or '']
+        for name in names:
+            if BLOCK_NAME.search(name):
+                return True
+
+    return False
+
+
+def get_block_id(base_url_split, raw_links):
+    """Returns an id that only depends on the links of a block and on the host
+    used to resolve them.
+
+    :param base_url_split: The base URL used to resolve the links.
+    :param raw_links: A sequence of RawLink.
+    :rtype: A string
+    """
+    parts = [base_url_split.scheme, base_url_split.netloc]
+    for raw_link in raw_links:
+        parts.append("{0} {1}".format(raw_link.type, raw_link.url))
+
+    return hashlib.md5("\n".join(parts).encode("utf-8")).hexdigest()
+
+
 def open_url(open_func, request_class, url, timeout, timeout_exception,
-        auth_header=None):
+        auth_header=None, headers=None, user_agent=None):
     """Opens a URL and returns a Response object.
 
     All parameters are required to be able to use a patched version of the
@@ -511,12 +2264,18 @@ def open_url(open_func, request_class, url, timeout, timeout_exception,
     :param timeout_exception: the exception thrown by open_func if a timeout
             occurs
     :param auth_header: authentication header
+    :param headers: sequence of (name, value) of other headers
+    :param user_agent: User-Agent header (default: the one of open_func)
     :rtype: A Response object
     """
     try:
         request = request_class(url)
+        if user_agent:
+            request.add_header("User-Agent", user_agent)
         if auth_header:
             request.add_header(auth_header[0], auth_header[1])
+        for (name, value) in headers or []:
+            request.add_header(name, value)
         output_value = open_func(request, timeout=timeout)
         final_url = output_value.geturl()
         code = output_value.getcode()
@@ -540,6 +2299,50 @@ def open_url(open_func, request_class, url, timeout, timeout_exception,
     return response
 
 
+def get_unicode_markup(content, http_charset=None):
+    """Decodes an HTML document without sniffing its encoding when possible.
+
+    The charset sent in the Content-Type header is tried first, then UTF-8
+    (which also covers ASCII), and then the charset declared in a meta tag.
+    If none of these work, the raw bytes are returned so that BeautifulSoup
+    can detect the encoding (slow).
+
+    :param content: The bytes of the document.
+    :param http_charset: The charset of the Content-Type header (optional).
+    :rtype: A unicode string or the original bytes if the encoding is unknown.
+    """
+    decoded = _decode(content, http_charset)
+    if decoded is not None:
+        return decoded
+
+    decoded = _decode(content, UTF8_ENCODING)
+    if decoded is not None:
+        return decoded
+
+    match = META_CHARSET.search(content[:META_CHARSET_SIZE])
+    if match:
+        decoded = _decode(content, match.group(1).decode("ascii"))
+        if decoded is not None:
+            return decoded
+
+    return content
+
+
+def _decode(content, encoding):
+    """Returns the decoded content or None if the encoding is wrong."""
+    if not encoding:
+        return None
+
+    if encoding.lower().replace("_", "-") in ("utf-8", "utf8"):
+        # Strips the byte order mark if there is one.
+        encoding = "utf-8-sig"
+
+    try:
+        return content.decode(encoding)
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
 def execute_from_command_line():
     """Runs the crawler and retrieves the configuration from the command line."""
     try:
@@ -548,6 +2351,10 @@ def execute_from_command_line():
         config.parse_cli_config()
 
         logger = configure_logger(config)
+        if config.options.remote_worker:
+            run_remote_worker(config, logger)
+            return
+
         crawler = execute_from_config(config, logger)
 
         stop = time.time()
@@ -576,17 +2383,23 @@ def configure_logger(config):
     return logger
 
 
-def execute_from_config(config, logger):
-    """Executes a crawler given a config and logger."""
+def execute_from_config(config, logger, score_func=None):
+    """Executes a crawler given a config and logger.
+
+    :param score_func: Function that returns the priority of a WorkerInput.
+            Lower scores are crawled first. (optional)
+    """
     if not config.start_urls:
         raise Exception("At least one starting URL must be supplied.")
 
     if config.options.mode == MODE_THREAD:
-        crawler = ThreadSiteCrawler(config, logger)
+        crawler = ThreadSiteCrawler(config, logger, score_func)
     elif config.options.mode == MODE_PROCESS:
-        crawler = ProcessSiteCrawler(config, logger)
+        crawler = ProcessSiteCrawler(config, logger, score_func)
     elif config.options.mode == MODE_GREEN:
-        crawler = GreenSiteCrawler(config, logger)
+        crawler = GreenSiteCrawler(config, logger, score_func)
+    elif config.options.mode == MODE_REMOTE:
+        crawler = RemoteSiteCrawler(config, logger, score_func)
 
     if not crawler:
         raise Exception("Invalid crawling mode supplied.")
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the frontier: the URLs waiting to be sent to the workers.
+"""
+from __future__ import unicode_literals, absolute_import
+
+from collections import deque
+import heapq
+import itertools
+import os
+import pickle
+import sqlite3
+import tempfile
+import time
+
+
+# Seconds between two checks of a host that is not ready.
+READY_POLL_TIME = 0.05
+
+
+# Maps the url ids (unsigned 64-bit integers) to SQLite signed integers.
+DB_KEY_OFFSET = 2 ** 63
+
+
+def default_score(worker_input):
+    """Returns the priority of a worker input. Lower scores are crawled first.
+
+    Pages that can be crawled (and that can reveal new links) are crawled
+    before resources, and shallow pages before deep pages.
+    """
+    if worker_input.should_crawl:
+        crawl_score = 0
+    else:
+        crawl_score = 1
+    return (crawl_score, worker_input.depth)
+
+
+class Frontier(object):
+    """Priority queue of WorkerInput.
+
+    Worker inputs with the same score are returned in the order they were
+    added (FIFO).
+    """
+
+    def __init__(self, score_func=None):
+        if not score_func:
+            score_func = default_score
+        self.score_func = score_func
+        self._heap = []
+        self._counter = itertools.count()
+
+    def put(self, worker_input):
+        heapq.heappush(self._heap, (self.score_func(worker_input),
+                next(self._counter), worker_input))
+
+    def get(self):
+        """Returns the worker input with the lowest score. Raises IndexError
+        if the frontier is empty."""
+        return heapq.heappop(self._heap)[2]
+
+    def done(self, url_split):
+        """Notifies the frontier that a url sent to the workers was
+        crawled."""
+        pass
+
+    def get_wait_time(self):
+        """Returns the number of seconds before a worker input that cannot be
+        crawled yet (e.g., Crawl-delay) becomes available or None."""
+        return None
+
+    def drain(self):
+        """Removes and yields all the worker inputs."""
+        while len(self):
+            yield self.get()
+
+    def snapshot(self):
+        """Yields all the worker inputs in the order they would be returned,
+        without removing them."""
+        for entry in self._iter_entries():
+            yield entry[2]
+
+    def _iter_entries(self):
+        return iter(sorted(self._heap))
+
+    def close(self):
+        """Releases the resources used by the frontier."""
+        pass
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class SpillingFrontier(Frontier):
+    """Frontier that keeps at most max_memory_size worker inputs in memory.
+
+    When the watermark is exceeded, the half of the worker inputs with the
+    highest scores is written to a temporary SQLite database as a sorted run.
+    Only the first entry of each run is kept in memory: runs are merged with
+    the in-memory heap when worker inputs are requested, so the priority (and
+    FIFO) order is preserved.
+    """
+
+    def __init__(self, max_memory_size, score_func=None, directory=None):
+        super(SpillingFrontier, self).__init__(score_func)
+        self.max_memory_size = max(max_memory_size, 2)
+        (fd, self.path) = tempfile.mkstemp(prefix="pylinkchecker-",
+                suffix=".db", dir=directory)
+        os.close(fd)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("CREATE TABLE entries (run INTEGER, "
+                "position INTEGER, data BLOB, PRIMARY KEY (run, position))")
+
+        self._run_heads = []
+        """Heap of (score, count, run, position, worker input)"""
+
+        self._run_count = 0
+        self._disk_size = 0
+
+    def put(self, worker_input):
+        super(SpillingFrontier, self).put(worker_input)
+        if len(self._heap) > self.max_memory_size:
+            self._spill()
+
+    def get(self):
+        if self._run_heads and (not self._heap or
+                self._run_heads[0][:2] < self._heap[0][:2]):
+            (_, _, run, position, worker_input) = heapq.heappop(
+                    self._run_heads)
+            # Committed with the next run.
+            self.connection.execute("DELETE FROM entries WHERE run = ? AND "
+                    "position = ?", (run, position))
+            self._disk_size -= 1
+            self._load_run_head(run, position + 1)
+            return worker_input
+
+        return super(SpillingFrontier, self).get()
+
+    def close(self):
+        self.connection.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _spill(self):
+        entries = sorted(self._heap)
+        keep_size = self.max_memory_size // 2
+
+        # A sorted list is a valid heap.
+        self._heap = entries[:keep_size]
+        spilled_entries = entries[keep_size:]
+
+        run = self._run_count
+        self._run_count += 1
+        self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?)",
+                ((run, position, sqlite3.Binary(pickle.dumps(entry, 2))) for
+                (position, entry) in enumerate(spilled_entries)))
+        self.connection.commit()
+        self._disk_size += len(spilled_entries)
+        self._load_run_head(run, 0)
+
+    def _iter_entries(self):
+        run_iterators = [self._iter_run(run, position) for
+                (_, _, run, position, _) in self._run_heads]
+        return heapq.merge(super(SpillingFrontier, self)._iter_entries(),
+                *run_iterators)
+
+    def _iter_run(self, run, position):
+        cursor = self.connection.execute("SELECT data FROM entries WHERE "
+                "run = ? AND position >= ? ORDER BY position", (run, position))
+        for (data,) in cursor:
+            yield pickle.loads(bytes(data))
+
+    def _load_run_head(self, run, position):
+        row = self.connection.execute("SELECT data FROM entries WHERE "
+                "run = ? AND position = ?", (run, position)).fetchone()
+        if row:
+            (score, count, worker_input) = pickle.loads(bytes(row[0]))
+            heapq.heappush(self._run_heads, (score, count, run, position,
+                    worker_input))
+
+    def __len__(self):
+        return len(self._heap) + self._disk_size
+
+
+class SpillingDict(object):
+    """Map of url id:value that keeps at most max_memory_size values in
+    memory.
+
+    When the watermark is exceeded, the oldest half of the values is written
+    to a temporary SQLite database, created the first time it is needed.
+    Values read from the database are copies: a modified value must be set
+    again.
+    """
+
+    def __init__(self, max_memory_size, directory=None):
+        self.max_memory_size = max(max_memory_size, 2)
+        self.directory = directory
+        self.path = None
+        self.connection = None
+        self._items = {}
+        self._disk_size = 0
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *args):
+        try:
+            value = self[key]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        del self[key]
+        return value
+
+    def items(self):
+        for item in list(self._items.items()):
+            yield item
+        if self._disk_size:
+            for (key, data) in self.connection.execute(
+                    "SELECT key, data FROM items"):
+                yield (key + DB_KEY_OFFSET, pickle.loads(bytes(data)))
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _load(self, key):
+        if not self._disk_size:
+            return None
+        return self.connection.execute("SELECT data FROM items WHERE "
+                "key = ?", (key - DB_KEY_OFFSET,)).fetchone()
+
+    def _delete(self, key):
+        if not self._disk_size:
+            return False
+        cursor = self.connection.execute("DELETE FROM items WHERE key = ?",
+                (key - DB_KEY_OFFSET,))
+        if cursor.rowcount > 0:
+            self._disk_size -= 1
+            return True
+        return False
+
+    def _spill(self):
+        if self.connection is None:
+            (fd, self.path) = tempfile.mkstemp(prefix="pylinkchecker-",
+                    suffix=".db", dir=self.directory)
+            os.close(fd)
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute("CREATE TABLE items "
+                    "(key INTEGER PRIMARY KEY, data BLOB)")
+
+        # A key is either in memory or on disk, never both.
+        keys = list(itertools.islice(self._items,
+                len(self._items) - self.max_memory_size // 2))
+        self.connection.executemany("INSERT INTO items VALUES (?, ?)",
+                ((key - DB_KEY_OFFSET, sqlite3.Binary(pickle.dumps(
+                self._items.pop(key), 2))) for key in keys))
+        self.connection.commit()
+        self._disk_size += len(keys)
+
+    def __getitem__(self, key):
+        if key in self._items:
+            return self._items[key]
+        row = self._load(key)
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(bytes(row[0]))
+
+    def __setitem__(self, key, value):
+        if key not in self._items:
+            self._delete(key)
+        self._items[key] = value
+        if len(self._items) > self.max_memory_size:
+            self._spill()
+
+    def __delitem__(self, key):
+        if key in self._items:
+            del self._items[key]
+        elif not self._delete(key):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._items or self._load(key) is not None
+
+    def __len__(self):
+        return len(self._items) + self._disk_size
+
+
+class HostFrontier(Frontier):
+    """Frontier with one priority queue per host.
+
+    Hosts take turns (round-robin): a host with a weight of N gives up to N
+    worker inputs each turn (default: 1). If max_in_flight is set, a host is
+    skipped while max_in_flight of its urls are being crawled, so a slow host
+    does not take all the workers. If delay_func returns a number of seconds
+    for a url (e.g., Crawl-delay of robots.txt), the next url of this host is
+    only returned after this delay. If ready_func returns False for a url of
+    a host (e.g., robots.txt not fetched yet), the host waits.
+
+    get raises IndexError if no host can give a worker input, even if the
+    frontier is not empty.
+    """
+
+    def __init__(self, score_func=None, max_in_flight=None, weights=None,
+            delay_func=None, ready_func=None):
+        super(HostFrontier, self).__init__(score_func)
+        self.max_in_flight = max_in_flight
+        self.weights = weights or {}
+        self.delay_func = delay_func
+        self.ready_func = ready_func
+
+        self._host_url_splits = {}
+        """Map of host:url split of a url of the host (see ready_func)"""
+
+        self._queues = {}
+        """Map of host:Frontier"""
+
+        self._hosts = deque()
+        """Hosts with worker inputs, in the order of their turn"""
+
+        self._credit = 0
+        """Number of worker inputs the first host can still give this turn"""
+
+        self._in_flight = {}
+        """Map of host:number of urls being crawled"""
+
+        self._next_times = {}
+        """Map of host:time before which no url of the host is returned"""
+
+        self._size = 0
+
+    def put(self, worker_input):
+        host = worker_input.url_split.netloc
+        queue = self._queues.get(host)
+        if queue is None:
+            queue = Frontier(self.score_func)
+            self._queues[host] = queue
+            self._hosts.append(host)
+            self._host_url_splits[host] = worker_input.url_split
+        queue.put(worker_input)
+        self._size += 1
+
+    def get(self):
+        for _ in range(len(self._hosts)):
+            host = self._hosts[0]
+            if self._credit <= 0:
+                self._credit = self.weights.get(host, 1)
+
+            if self.is_available(host):
+                return self._get_from_host(host)
+
+            self._hosts.rotate(-1)
+            self._credit = 0
+
+        raise IndexError("No host is available")
+
+    def is_available(self, host):
+        """Returns True if a url of this host can be crawled now."""
+        if self.max_in_flight is not None and\
+                self._in_flight.get(host, 0) >= self.max_in_flight:
+            return False
+        if self.ready_func and not self._is_ready(host):
+            return False
+        return self._next_times.get(host, 0) <= time.time()
+
+    def _is_ready(self, host):
+        return self.ready_func(self._host_url_splits[host])
+
+    def get_wait_time(self):
+        now = time.time()
+        wait_times = [self._next_times[host] - now for host in self._hosts
+                if self._next_times.get(host, 0) > now]
+        if self.ready_func and not all(self._is_ready(host) for host in
+                self._hosts):
+            wait_times.append(READY_POLL_TIME)
+        if not wait_times:
+            return None
+        return min(wait_times)
+
+    def done(self, url_split):
+        host = url_split.netloc
+        in_flight = self._in_flight.get(host, 0) - 1
+        if in_flight > 0:
+            self._in_flight[host] = in_flight
+        else:
+            self._in_flight.pop(host, None)
+
+    def drain(self):
+        for host in list(self._hosts):
+            queue = self._queues.pop(host)
+            del self._host_url_splits[host]
+            while len(queue):
+                self._size -= 1
+                yield queue.get()
+        self._hosts.clear()
+        self._credit = 0
+
+    def snapshot(self):
+        for host in self._hosts:
+            for worker_input in self._queues[host].snapshot():
+                yield worker_input
+
+    def _get_from_host(self, host):
+        queue = self._queues[host]
+        worker_input = queue.get()
+        self._size -= 1
+        self._in_flight[host] = self._in_flight.get(host, 0) + 1
+        self._credit -= 1
+
+        if self.delay_func:
+            delay = self.delay_func(worker_input.url_split)
+            if delay:
+                self._next_times[host] = time.time() + delay
+                # The host must wait: its turn ends.
+                self._credit = 0
+
+        if not len(queue):
+            del self._queues[host]
+            del self._host_url_splits[host]
+            self._hosts.popleft()
+            self._credit = 0
+        elif self._credit <= 0:
+            self._hosts.rotate(-1)
+
+        return worker_input
+
+    def __len__(self):
+        return self._size
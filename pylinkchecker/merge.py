@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the merge of the result files of the shards of a crawl (--shard and
+--shard-file) into one report.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import sys
+
+from pylinkchecker.crawler import Site, configure_logger
+from pylinkchecker.models import Config, WHEN_ALWAYS
+from pylinkchecker.reporter import report
+from pylinkchecker.state import load_checkpoint
+from pylinkchecker.urlutil import get_clean_url_split
+
+
+def merge_shard_files(paths, config, logger=None):
+    """Returns a tuple of (Site, total time) with the results of all the
+    shards. Raises ValueError if a shard is missing.
+
+    :param paths: The paths of the result files of the shards.
+    """
+    results = []
+    for path in paths:
+        result = load_checkpoint(path)
+        if result is None:
+            raise ValueError("Shard file not found: {0}".format(path))
+        results.append(result)
+    if not results:
+        raise ValueError("At least one shard file is required.")
+
+    shards = sorted(result["shard"] or (1, 1) for result in results)
+    count = shards[0][1]
+    if shards != [(index, count) for index in range(1, count + 1)]:
+        raise ValueError("The shard files of shards 1/N to N/N are required "
+                "(found: {0})".format(", ".join("{0}/{1}".format(*shard) for
+                shard in shards)))
+
+    start_url_splits = [get_clean_url_split(url) for url in
+            results[0]["start_urls"]]
+    site = Site(start_url_splits, config, logger)
+    for result in results:
+        site.add_shard_result(result["site"])
+
+    # The shards run in parallel.
+    total_time = max(result["total_time"] for result in results)
+    return (site, total_time)
+
+
+def execute_from_command_line():
+    """Merges the shard files given on the command line and writes the
+    report."""
+    try:
+        config = Config()
+        config.parser.set_usage("%prog [options] SHARD_FILE ...")
+        config.parse_cli_config()
+
+        logger = configure_logger(config)
+        (site, total_time) = merge_shard_files(config.start_urls, config,
+                logger)
+
+        if not site.is_ok or config.options.when == WHEN_ALWAYS:
+            report(site, config, total_time, logger)
+
+        if not site.is_ok:
+            sys.exit(1)
+    except Exception as e:
+        print(e)
+        sys.exit(1)
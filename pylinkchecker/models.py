@@ -12,7 +12,10 @@ from collections import namedtuple
 from optparse import OptionParser, OptionGroup
 
 from pylinkchecker.compat import get_safe_str
-from pylinkchecker.urlutil import get_clean_url_split
+from pylinkchecker.robots import (RobotsCache, DEFAULT_ROBOTS_TTL,
+        USER_AGENT)
+from pylinkchecker.urlutil import (get_clean_url_split,
+        get_canonical_url_split)
 
 
 DEFAULT_TYPES = ['a', 'img', 'script', 'link']
@@ -32,15 +35,23 @@ DEFAULT_TIMEOUT = 10
 MODE_THREAD = "thread"
 MODE_PROCESS = "process"
 MODE_GREEN = "green"
+MODE_REMOTE = "remote"
 
 
 DEFAULT_WORKERS = {
     MODE_THREAD: 1,
     MODE_PROCESS: 1,
     MODE_GREEN: 1000,
+    MODE_REMOTE: 1,
 }
 
 
+DEFAULT_LISTEN_ADDRESS = "localhost:8790"
+
+
+DEFAULT_MIN_SAMPLE_SIZE = 5
+
+
 PARSER_STDLIB = "html.parser"
 PARSER_LXML = "lxml"
 PARSER_HTML5 = "html5lib"
@@ -72,6 +83,19 @@ VERBOSE_INFO = "2"
 HTML_MIME_TYPE = "text/html"
 
 
+TRUNCATED_SIZE = "size"
+TRUNCATED_ELEMENTS = "elements"
+TRUNCATED_TIME = "parse time"
+
+
+SKIPPED_DEPTH = "max depth"
+SKIPPED_PAGES = "max pages"
+SKIPPED_DURATION = "max duration"
+SKIPPED_UNCHANGED = "unchanged"
+SKIPPED_ERRORS = "max errors"
+SKIPPED_ROBOTS = "robots.txt"
+
+
 PAGE_QUEUED = '__PAGE_QUEUED__'
 PAGE_CRAWLED = '__PAGE_CRAWLED__'
 
@@ -79,14 +103,26 @@ PAGE_CRAWLED = '__PAGE_CRAWLED__'
 # immutable and easy to pickle (as opposed to a class).
 
 WorkerInit = namedtuple("WorkerInit", ["worker_config", "input_queue",
-        "output_queue", "logger"])
+        "output_queue", "logger", "parse_pool"])
 
 
 WorkerConfig = namedtuple("WorkerConfig", ["username", "password", "types",
-        "timeout", "parser", "strict_mode"])
+        "timeout", "parser", "strict_mode", "link_blocks", "max_page_size",
+        "max_elements", "max_parse_time", "check_anchors", "sort_query",
+        "strip_tracking_params", "accepted_hosts", "test_outside",
+        "ignored_prefixes", "user_agent"])
+
 
+# depth is the number of links followed from a start url and validators are
+# the Validators of the previous crawl (incremental crawls only).
+WorkerInput = namedtuple("WorkerInput", ["url_split", "should_crawl", "depth",
+        "validators"])
+WorkerInput.__new__.__defaults__ = (None,)
 
-WorkerInput = namedtuple("WorkerInput", ["url_split", "should_crawl"])
+
+# Used to check if a page changed since the previous crawl.
+Validators = namedtuple("Validators", ["etag", "last_modified",
+        "content_hash"])
 
 
 Response = namedtuple("Response", ["content", "status", "exception",
@@ -96,20 +132,52 @@ Response = namedtuple("Response", ["content", "status", "exception",
 ExceptionStr = namedtuple("ExceptionStr", ["type_name", "message"])
 
 
+# fragment is only set if anchors are checked. In this case, the url_split
+# does not contain the fragment.
 Link = namedtuple("Link", ["type", "url_split", "original_url_split",
-        "source_str"])
+        "source_str", "fragment"])
 
 
+# link_blocks contains the LinkBlock sent for the first time by a worker and
+# block_ids contains the ids of all the blocks found on the page.
+# not_modified is True if the page did not change since the previous crawl:
+# it was not parsed and its links are empty.
 PageCrawl = namedtuple("PageCrawl", ["original_url_split", "final_url_split",
-        "status", "is_timeout", "is_redirect", "links", "exception", "is_html"])
+        "status", "is_timeout", "is_redirect", "links", "exception", "is_html",
+        "link_blocks", "block_ids", "content_hash", "truncated", "anchors",
+        "validators", "not_modified"])
+PageCrawl.__new__.__defaults__ = (None, False)
+
+
+# Link as found in a page, before it is resolved.
+RawLink = namedtuple("RawLink", ["type", "url", "source_str"])
+
+
+# raw_blocks contains a sequence of RawLink for each link block. truncated
+# is None or the limit that stopped the parsing (e.g., TRUNCATED_ELEMENTS).
+# anchors is None or a frozenset of the anchor keys (see get_anchor_key).
+PageExtract = namedtuple("PageExtract", ["base_url", "raw_links",
+        "raw_blocks", "truncated", "anchors"])
 
 
-PageStatus = namedtuple("PageStatus", ["status", "sources"])
+LinkBlock = namedtuple("LinkBlock", ["block_id", "links"])
+
+
+PageStatus = namedtuple("PageStatus", ["status", "sources", "depth"])
 
 
 PageSource = namedtuple("PageSource", ["origin", "origin_str"])
 
 
+# Estimated rate of broken urls with its 95% confidence interval (low, high).
+Estimate = namedtuple("Estimate", ["rate", "low", "high", "discovered",
+        "checked", "errors"])
+
+
+# is_index is True if url is the url of another sitemap.
+SitemapEntry = namedtuple("SitemapEntry", ["is_index", "url", "lastmod"])
+
+
 class UTF8Class(object):
     """Handles unicode string from __unicode__() in: __str__() and __repr__()
     """
@@ -120,6 +188,19 @@ class UTF8Class(object):
         return get_safe_str(self.__unicode__())
 
 
+def is_downloadable(url_split, worker_config):
+    """Returns True if the url is local or outside links are allowed and if
+    the url does not start with an ignored prefix. Used by the workers to
+    filter the links before sending them."""
+    if not worker_config.test_outside and\
+            url_split.netloc not in worker_config.accepted_hosts:
+        return False
+
+    # str.startswith accepts a tuple of prefixes.
+    return not (worker_config.ignored_prefixes and
+            url_split.geturl().startswith(worker_config.ignored_prefixes))
+
+
 class LazyLogParam(object):
     """Lazy Log Parameter that is only evaluated if the logging statement
        is printed"""
@@ -144,9 +225,24 @@ class Config(UTF8Class):
         self.accepted_hosts = []
         self.ignored_prefixes = []
         self.worker_size = 0
-
-    def should_crawl(self, url_split):
-        """Returns True if url split is local AND run_once is False"""
+        self.parse_worker_size = 0
+        self.parse_queue_size = 0
+        self.host_weights = {}
+        self.robots = None
+        self.shard = None
+
+    def get_canonical_url_split(self, url_split):
+        """Returns the canonical form of a url split. The site and the workers
+        only use canonical urls."""
+        return get_canonical_url_split(url_split, self.options.sort_query,
+                self.options.strip_tracking_params)
+
+    def should_crawl(self, url_split, depth=None):
+        """Returns True if url split is local AND run_once is False AND the
+        links of the page would not exceed the maximum depth"""
+        if self.options.max_depth is not None and depth is not None and\
+                depth >= self.options.max_depth:
+            return False
         return not self.options.run_once and self.is_local(url_split)
 
     def is_local(self, url_split):
@@ -155,19 +251,9 @@ class Config(UTF8Class):
 
     def should_download(self, url_split):
         """Returns True if the url does not start with an ignored prefix and if
-        it is local or outside links are allowed."""
-        local = self.is_local(url_split)
-
-        if not self.options.test_outside and not local:
-            return False
-
-        url = url_split.geturl()
-
-        for ignored_prefix in self.ignored_prefixes:
-            if url.startswith(ignored_prefix):
-                return False
-
-        return True
+        it is local or outside links are allowed. robots.txt is checked when
+        the url is sent to a worker."""
+        return is_downloadable(url_split, self.worker_config)
 
     def parse_cli_config(self):
         """Builds the options and args based on the command line options."""
@@ -193,18 +279,79 @@ class Config(UTF8Class):
         return options
 
     def _parse_config(self):
-        self.worker_config = self._build_worker_config(self.options)
         self.accepted_hosts = self._build_accepted_hosts(self.options,
                 self.start_urls)
 
         if self.options.ignored_prefixes:
-            self.ignored_prefixes = self.options.ignored_prefixes.split(',')
+            # The links are compared in their canonical form.
+            self.ignored_prefixes = [self._build_ignored_prefix(prefix) for
+                    prefix in self.options.ignored_prefixes.split(',')]
+
+        self.worker_config = self._build_worker_config(self.options)
 
         if self.options.workers:
             self.worker_size = self.options.workers
         else:
             self.worker_size = DEFAULT_WORKERS[self.options.mode]
 
+        if self.options.parse_workers:
+            if self.options.mode != MODE_THREAD:
+                raise ValueError("Parse workers can only be used with thread "
+                        "workers.")
+            self.parse_worker_size = self.options.parse_workers
+            if self.options.parse_queue_size:
+                self.parse_queue_size = self.options.parse_queue_size
+            else:
+                self.parse_queue_size = self.parse_worker_size * 2
+
+        if self.options.host_weights:
+            self.host_weights = self._build_host_weights(
+                    self.options.host_weights)
+
+        if self.options.sample_rate is not None and\
+                not 0 < self.options.sample_rate <= 1:
+            raise ValueError("The sample rate must be between 0 and 1.")
+
+        if (self.options.mode == MODE_REMOTE or self.options.remote_worker)\
+                and not self.options.remote_key:
+            # Unsigned messages would let anyone run code with a pickle.
+            raise ValueError("Remote mode requires --remote-key.")
+
+        if self.options.incremental and not self.options.state:
+            raise ValueError("--incremental requires --state.")
+
+        if self.options.shard:
+            self.shard = self._build_shard(self.options.shard)
+            if self.options.sample_rate:
+                raise ValueError("--sample-rate cannot be used with "
+                        "--shard.")
+
+        if self.options.fail_fast and self.options.max_errors is None:
+            self.options.max_errors = 1
+
+        if self.options.changed:
+            if not self.options.state:
+                raise ValueError("--changed requires --state.")
+            # The links of the crawled pages are stored for the next runs.
+            self.options.incremental = True
+            if self.options.max_depth is None:
+                # The links of the changed pages and of the pages linking to
+                # them are checked but not followed.
+                self.options.max_depth = 1
+
+        if self.options.resume and not self.options.checkpoint:
+            raise ValueError("--resume requires --checkpoint.")
+
+        if self.options.robots:
+            self.robots = RobotsCache(self.options.robots_cache,
+                    self.options.robots_ttl, self.options.timeout,
+                    self.options.user_agent)
+
+        if self.options.frontier_memory and (self.options.max_host_workers or
+                self.host_weights or self.robots):
+            raise ValueError("Per host queues (e.g., --robots) cannot be "
+                    "used with --frontier-memory.")
+
     def _build_worker_config(self, options):
         types = options.types.split(',')
         for element_type in types:
@@ -213,7 +360,36 @@ class Config(UTF8Class):
                         .format(element_type))
 
         return WorkerConfig(options.username, options.password, types,
-                options.timeout, options.parser, options.strict_mode)
+                options.timeout, options.parser, options.strict_mode,
+                options.link_blocks, options.max_page_size,
+                options.max_elements, options.max_parse_time,
+                options.check_anchors, options.sort_query,
+                options.strip_tracking_params, frozenset(self.accepted_hosts),
+                options.test_outside, tuple(self.ignored_prefixes),
+                options.user_agent)
+
+    def _build_ignored_prefix(self, prefix):
+        if "://" not in prefix:
+            return prefix
+        return self.get_canonical_url_split(
+                get_clean_url_split(prefix)).geturl()
+
+    def _build_host_weights(self, value):
+        host_weights = {}
+        for host_weight in value.split(','):
+            (host, _, weight) = host_weight.rpartition(':')
+            if not host or not weight.isdigit() or int(weight) < 1:
+                raise ValueError("Invalid host weight: {0}".format(
+                        host_weight))
+            host_weights[host.lower()] = int(weight)
+        return host_weights
+
+    def _build_shard(self, value):
+        (index, _, count) = value.partition('/')
+        if not index.isdigit() or not count.isdigit() or\
+                not 1 <= int(index) <= int(count):
+            raise ValueError("Invalid shard (i/N expected): {0}".format(value))
+        return (int(index), int(count))
 
     def _build_accepted_hosts(self, options, start_urls):
         hosts = set()
@@ -224,7 +400,8 @@ class Config(UTF8Class):
         urls = urls + start_urls
 
         for url in urls:
-            split_result = get_clean_url_split(url)
+            split_result = self.get_canonical_url_split(
+                    get_clean_url_split(url))
             hosts.add(split_result.netloc)
 
         return hosts
@@ -269,6 +446,10 @@ class Config(UTF8Class):
         crawler_group.add_option("-T", "--timeout", dest="timeout",
                 type="int", action="store", default=DEFAULT_TIMEOUT,
                 help="Seconds to wait before considering that a page timed out")
+        crawler_group.add_option("--user-agent", dest="user_agent",
+                action="store", default=USER_AGENT,
+                help="User-Agent header sent with each request and whose "
+                "robots.txt rules apply. Default: {0}".format(USER_AGENT))
         crawler_group.add_option("-C", "--strict", dest="strict_mode",
                 action="store_true", default=False,
                 help="Does not strip href and src attributes from whitespaces")
@@ -278,6 +459,105 @@ class Config(UTF8Class):
         crawler_group.add_option("-N", "--run-once", dest="run_once",
                 action="store_true", default=False,
                 help="Only crawl the first page.")
+        crawler_group.add_option("--max-depth", dest="max_depth",
+                action="store", default=None, type="int",
+                help="Maximum number of links to follow from a start url. "
+                "Pages at this depth are downloaded but not crawled.")
+        crawler_group.add_option("--max-pages", dest="max_pages",
+                action="store", default=None, type="int",
+                help="Maximum number of urls to download.")
+        crawler_group.add_option("--max-duration", dest="max_duration",
+                action="store", default=None, type="float",
+                help="Seconds after which no new url is downloaded. The urls "
+                "being downloaded are completed and the report is written.")
+        crawler_group.add_option("--fail-fast", dest="fail_fast",
+                action="store_true", default=False,
+                help="Stop the crawl at the first broken url (or missing "
+                "anchor with --check-anchors). The report is partial. Same as "
+                "--max-errors=1.")
+        crawler_group.add_option("--max-errors", dest="max_errors",
+                action="store", default=None, type="int",
+                help="Number of broken urls and missing anchors after which "
+                "the crawl stops. The report is partial.")
+        crawler_group.add_option("--max-per-template",
+                dest="max_per_template", action="store", default=None,
+                type="int",
+                help="Maximum number of pages crawled per url template (e.g., "
+                "/cars/<int>, /search?make&page). The other pages of a "
+                "template are downloaded but their links are not followed.")
+        crawler_group.add_option("--sample-rate", dest="sample_rate",
+                action="store", default=None, type="float",
+                help="Only check a random sample of the discovered urls "
+                "(e.g., 0.05) stratified by host, path prefix and resource "
+                "type. The report estimates the rate of broken urls.")
+        crawler_group.add_option("--sample-min", dest="sample_min",
+                action="store", default=DEFAULT_MIN_SAMPLE_SIZE, type="int",
+                help="Number of urls always checked in each stratum (the "
+                "first ones discovered). Default: {0}".format(
+                DEFAULT_MIN_SAMPLE_SIZE))
+        crawler_group.add_option("--sample-seed", dest="sample_seed",
+                action="store", default=None, type="int",
+                help="Seed of the sample. The same seed checks the same urls, "
+                "whatever the number of workers (except the --sample-min "
+                "urls of each stratum).")
+        crawler_group.add_option("--sitemap", dest="sitemaps",
+                action="append", default=[],
+                help="Crawl the urls of this sitemap or sitemap index (e.g., "
+                "http://www.example.com/sitemap.xml). Can be repeated.")
+        crawler_group.add_option("--state", dest="state", action="store",
+                default=None,
+                help="JSON file that stores the state of the crawl between "
+                "runs. Pages of the sitemap whose lastmod did not change "
+                "since the previous run are skipped.")
+        crawler_group.add_option("--incremental", dest="incremental",
+                action="store_true", default=False,
+                help="Store the links of each page in the state file. The "
+                "next runs send conditional requests and reuse the links of "
+                "the pages that did not change.")
+        crawler_group.add_option("--changed", dest="changed",
+                action="store", default=None, metavar="FILE",
+                help="Only crawl the urls listed in FILE (one url per line, "
+                "- for stdin) and the pages linking to them according to the "
+                "state of a previous --incremental crawl. The links of these "
+                "pages are checked but not followed (default --max-depth: "
+                "1). Implies --incremental.")
+        crawler_group.add_option("--robots", dest="robots",
+                action="store_true", default=False,
+                help="Do not download urls disallowed by robots.txt and wait "
+                "for the Crawl-delay of each host.")
+        crawler_group.add_option("--robots-cache", dest="robots_cache",
+                action="store", default=None,
+                help="JSON file that stores the robots.txt files between "
+                "runs.")
+        crawler_group.add_option("--robots-ttl", dest="robots_ttl",
+                action="store", default=DEFAULT_ROBOTS_TTL, type="int",
+                help="Seconds after which a cached robots.txt is fetched "
+                "again. Default: {0}".format(DEFAULT_ROBOTS_TTL))
+        crawler_group.add_option("--checkpoint", dest="checkpoint",
+                action="store", default=None,
+                help="File where the state of the crawl is periodically "
+                "saved. It is removed when the crawl is complete.")
+        crawler_group.add_option("--checkpoint-interval",
+                dest="checkpoint_interval", action="store", default=60,
+                type="float",
+                help="Seconds between two checkpoints. Default: 60")
+        crawler_group.add_option("--resume", dest="resume",
+                action="store_true", default=False,
+                help="Continue the crawl saved in the checkpoint file.")
+        crawler_group.add_option("--check-anchors", dest="check_anchors",
+                action="store_true", default=False,
+                help="Report links to anchors (page.html#anchor) that do not "
+                "exist in the crawled pages.")
+        crawler_group.add_option("--sort-query", dest="sort_query",
+                action="store_true", default=False,
+                help="Sort the query parameters by name so that urls that "
+                "only differ by the order of their parameters are crawled "
+                "once.")
+        crawler_group.add_option("--strip-tracking-params",
+                dest="strip_tracking_params", action="store_true",
+                default=False,
+                help="Remove tracking parameters (e.g., utm_source, gclid) "
+                "from the query of urls.")
         # TODO Add follow redirect option.
 
         parser.add_option_group(crawler_group)
@@ -291,15 +571,103 @@ class Config(UTF8Class):
                 help="Number of workers to spawn")
         perf_group.add_option("-m", "--mode", dest="mode", action="store",
                 default=MODE_THREAD, choices=[MODE_THREAD, MODE_PROCESS,
-                MODE_GREEN],
-                help="Types of workers: thread (default), process, or green")
+                MODE_GREEN, MODE_REMOTE],
+                help="Types of workers: thread (default), process, green or "
+                "remote (see Distributed Crawl Options)")
         perf_group.add_option("-R", "--parser", dest="parser", action="store",
                 default=PARSER_STDLIB, choices=[PARSER_STDLIB, PARSER_LXML,
                 PARSER_HTML5],
                 help="Types of HTML parse: html.parser (default), lxml, html5lib")
+        perf_group.add_option("--parse-workers", dest="parse_workers",
+                action="store", default=None, type="int",
+                help="Number of processes used to parse HTML pages while "
+                "thread workers fetch pages (thread mode only)")
+        perf_group.add_option("--parse-queue-size", dest="parse_queue_size",
+                action="store", default=None, type="int",
+                help="Maximum number of pages waiting to be parsed. Default: "
+                "twice the number of parse workers")
+        perf_group.add_option("--batch-size", dest="batch_size",
+                action="store", default=1, type="int",
+                help="Maximum number of urls sent at once to a worker. Large "
+                "batches reduce the cost of the queues (e.g., process mode). "
+                "Default: 1")
+        perf_group.add_option("--max-host-workers", dest="max_host_workers",
+                action="store", default=None, type="int",
+                help="Maximum number of urls of a host crawled at the same "
+                "time. Each host has its own queue and hosts take turns.")
+        perf_group.add_option("--host-weights", dest="host_weights",
+                action="store", default=None,
+                help="Comma-separated list of host:weight. A host with a "
+                "weight of N gets N urls crawled each turn. Default "
+                "weight: 1 (e.g., www.example.com:4,localhost:8000:2)")
+        perf_group.add_option("--frontier-memory", dest="frontier_memory",
+                action="store", default=None, type="int",
+                help="Maximum number of urls to crawl (and of seen urls) "
+                "kept in memory. Other urls are stored in temporary files. "
+                "Default: no limit")
+        perf_group.add_option("--frontier-dir", dest="frontier_dir",
+                action="store", default=None,
+                help="Directory of the temporary files used by "
+                "--frontier-memory. Default: system temporary directory")
+        perf_group.add_option("--bloom-filter-size",
+                dest="bloom_filter_size", action="store", default=None,
+                type="int",
+                help="Expected number of urls. Crawled urls are remembered in "
+                "a Bloom filter that uses less memory. Urls are very rarely "
+                "mistaken for crawled urls and not crawled.")
+        perf_group.add_option("--max-page-size", dest="max_page_size",
+                action="store", default=None, type="int",
+                help="Only parse the first MAX_PAGE_SIZE bytes of HTML pages")
+        perf_group.add_option("--max-elements", dest="max_elements",
+                action="store", default=None, type="int",
+                help="Only parse the first MAX_ELEMENTS elements of HTML "
+                "pages")
+        perf_group.add_option("--max-parse-time", dest="max_parse_time",
+                action="store", default=None, type="float",
+                help="Seconds allowed to parse an HTML page. Large pages are "
+                "partially parsed based on the time taken by previous pages")
+        perf_group.add_option("--link-blocks", dest="link_blocks",
+                action="store_true", default=False,
+                help="Only send the links of blocks shared by many pages "
+                "(e.g., header, footer, menu) once per worker")
 
         parser.add_option_group(perf_group)
 
+        remote_group = OptionGroup(parser, "Distributed Crawl Options",
+                "These options distribute the crawl across several machines: "
+                "a coordinator (--mode=remote) sends the urls to remote "
+                "workers (--remote-worker). Each remote worker crawls the "
+                "hosts it owns with --workers threads.")
+        remote_group.add_option("--listen", dest="listen", action="store",
+                default=DEFAULT_LISTEN_ADDRESS,
+                help="Address of the coordinator. Default: {0}".format(
+                DEFAULT_LISTEN_ADDRESS))
+        remote_group.add_option("--remote-workers", dest="remote_workers",
+                action="store", default=1, type="int",
+                help="Number of remote workers the coordinator waits for. "
+                "Default: 1")
+        remote_group.add_option("--remote-worker", dest="remote_worker",
+                action="store", default=None,
+                help="Run as a remote worker of the coordinator at this "
+                "address (HOST:PORT). No url is required.")
+        remote_group.add_option("--remote-key", dest="remote_key",
+                action="store", default=None,
+                help="Key shared by the coordinator and the remote workers "
+                "to sign the messages. Required in remote mode.")
+        remote_group.add_option("--shard", dest="shard", action="store",
+                default=None, metavar="i/N",
+                help="Only check the urls of shard i of N (e.g., 2/4), "
+                "selected by the hash of their canonical url. Pages are still "
+                "crawled to discover all the links. No communication between "
+                "the shards is needed.")
+        remote_group.add_option("--shard-file", dest="shard_file",
+                action="store", default=None, metavar="FILE",
+                help="Write the results of the crawl to FILE. The files of "
+                "all the shards are merged into one report with "
+                "pylinkmerge.py.")
+
+        parser.add_option_group(remote_group)
+
         output_group = OptionGroup(parser, "Output Options",
                 "These options change the output of the crawler.")
 
@@ -389,6 +757,12 @@ class SitePage(UTF8Class):
         self.is_local = is_local
         self.is_ok = status and status < 400
 
+        self.duplicate_of = None
+        """URL split of the first page with the same content"""
+
+        self.truncated = None
+        """Limit that stopped the parsing of the page (e.g., size)"""
+
     def add_sources(self, page_sources):
         self.sources.extend(page_sources)
 
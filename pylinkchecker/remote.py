@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the socket protocol between the coordinator of a distributed crawl
+and its remote workers.
+
+Each message is a pickle signed (HMAC-SHA256) with a key shared by the
+coordinator and the workers and prefixed by its size. Messages with an
+invalid signature are rejected before being unpickled.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+import hmac
+import pickle
+import struct
+import zlib
+
+from pylinkchecker.models import WorkerInput
+
+
+HEADER = struct.Struct(str("!I"))
+
+
+SIGNATURE_SIZE = 32
+
+
+compare_digest = getattr(hmac, "compare_digest", lambda a, b: a == b)
+
+
+def parse_address(address):
+    """Returns a tuple of (host, port) from a HOST:PORT string."""
+    (host, _, port) = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError("Invalid address (HOST:PORT expected): {0}".format(
+                address))
+    return (host, int(port))
+
+
+def get_shard(url_split, shard_count):
+    """Returns the index of the shard (i.e., remote worker) that owns the host
+    of a url. The index is the same in all processes."""
+    return (zlib.crc32(url_split.netloc.encode("utf-8")) & 0xffffffff) %\
+            shard_count
+
+
+def send_message(sock, message, key):
+    data = pickle.dumps(message, 2)
+    data = hmac.new(key, data, hashlib.sha256).digest() + data
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock, key):
+    """Returns the next message. Raises EOFError if the connection is
+    closed."""
+    (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    data = recv_exactly(sock, size)
+    signature = data[:SIGNATURE_SIZE]
+    data = data[SIGNATURE_SIZE:]
+    if not compare_digest(signature,
+            hmac.new(key, data, hashlib.sha256).digest()):
+        raise ValueError("Invalid message signature")
+    return pickle.loads(data)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError("Connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+class ShardedQueue(object):
+    """Input queue of a distributed crawl: each worker input is put in the
+    queue of the remote worker that owns its host.
+
+    Batches are split by shard. Other messages (e.g., WORK_DONE) are sent to
+    the remote workers in turn.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+        self._next_queue = 0
+
+    def put(self, item, block=True):
+        if isinstance(item, WorkerInput):
+            self._get_queue(item).put(item, block)
+        elif isinstance(item, list):
+            batches = {}
+            for worker_input in item:
+                batches.setdefault(self._get_index(worker_input),
+                        []).append(worker_input)
+            for (index, batch) in batches.items():
+                self.queues[index].put(batch, block)
+        else:
+            self.queues[self._next_queue].put(item, block)
+            self._next_queue = (self._next_queue + 1) % len(self.queues)
+
+    def _get_index(self, worker_input):
+        return get_shard(worker_input.url_split, len(self.queues))
+
+    def _get_queue(self, worker_input):
+        return self.queues[self._get_index(worker_input)]
@@ -12,7 +12,7 @@ from email.mime.text import MIMEText
 
 from pylinkchecker.compat import StringIO
 from pylinkchecker.models import (REPORT_TYPE_ERRORS, REPORT_TYPE_ALL,
-        FORMAT_PLAIN)
+        REPORT_TYPE_SUMMARY, FORMAT_PLAIN)
 
 
 PLAIN_TEXT = "text/plain"
@@ -70,7 +70,7 @@ def _write_plain_text_report(site, config, output_files, total_time):
         site.start_url_splits))
 
     total_urls = len(site.pages)
-    total_errors = len(site.error_pages)
+    total_errors = len(site.error_pages) + len(site.missing_anchors)
 
     if not site.is_ok:
         global_status = "ERROR"
@@ -83,6 +83,14 @@ def _write_plain_text_report(site, config, output_files, total_time):
             global_status, total_urls, error_summary, total_time),
             files=output_files)
 
+    if site.stopped:
+        oprint("Crawl stopped after {0} error(s): the report is partial."
+                .format(len(site.error_pages) + len(site.missing_anchors)),
+                files=output_files)
+
+    if site.sampler:
+        _write_sample_estimates(site.sampler, config, output_files)
+
     pages = {}
 
     if config.options.report_type == REPORT_TYPE_ERRORS:
@@ -103,6 +111,92 @@ def _write_plain_text_report(site, config, output_files, total_time):
                     oprint("      {0}".format(truncate(source.origin_str)),
                             files=output_files)
 
+    if site.missing_anchors and\
+            config.options.report_type != REPORT_TYPE_SUMMARY:
+        for ((url_split, fragment), sources) in site.missing_anchors.items():
+            oprint("\n  missing anchor: {0}#{1}".format(url_split.geturl(),
+                    fragment), files=output_files)
+            for source in sources:
+                oprint("    from {0}".format(source.origin.geturl()),
+                        files=output_files)
+                if config.options.show_source:
+                    oprint("      {0}".format(truncate(source.origin_str)),
+                            files=output_files)
+
+    if site.skipped_urls and\
+            config.options.report_type != REPORT_TYPE_SUMMARY:
+        oprint("\n  URLs skipped:\n",
+                files=output_files)
+
+        for (url_split, reason) in site.skipped_urls.items():
+            oprint("  skipped ({0}): {1}".format(reason, url_split.geturl()),
+                    files=output_files)
+            for source in site.skipped_sources.get(url_split, []):
+                oprint("    from {0}".format(source.origin.geturl()),
+                        files=output_files)
+                if config.options.show_source:
+                    oprint("      {0}".format(truncate(source.origin_str)),
+                            files=output_files)
+
+    if site.url_templates and\
+            config.options.report_type != REPORT_TYPE_SUMMARY:
+        oprint("\n  Pages per url template (crawled + only downloaded):\n",
+                files=output_files)
+
+        templates = sorted(site.url_templates.items(),
+                key=lambda item: (-sum(item[1]), item[0]))
+        for (template, (crawled, downloaded)) in templates:
+            if crawled + downloaded > 1:
+                oprint("  {0} + {1}: {2}".format(crawled, downloaded,
+                        template), files=output_files)
+
+    if site.duplicate_pages and\
+            config.options.report_type != REPORT_TYPE_SUMMARY:
+        oprint("\n  Pages with the same content as another page:",
+                files=output_files)
+
+        for page in site.duplicate_pages.values():
+            oprint("\n  duplicate: {0}".format(page.url_split.geturl()),
+                    files=output_files)
+            oprint("    of {0}".format(page.duplicate_of.geturl()),
+                    files=output_files)
+
+    if site.truncated_pages and\
+            config.options.report_type != REPORT_TYPE_SUMMARY:
+        oprint("\n  Pages only partially parsed:", files=output_files)
+
+        for page in site.truncated_pages.values():
+            oprint("\n  limit exceeded ({0}): {1}".format(page.truncated,
+                    page.url_split.geturl()), files=output_files)
+
+
+def _write_sample_estimates(sampler, config, output_files):
+    oprint("Estimated broken urls: {0}".format(
+            format_estimate(sampler.get_estimate())), files=output_files)
+
+    if config.options.report_type == REPORT_TYPE_SUMMARY:
+        return
+
+    oprint("\n  Estimated broken urls per host:\n", files=output_files)
+    for host in sampler.get_hosts():
+        oprint("  {0}: {1}".format(host,
+                format_estimate(sampler.get_estimate(host))),
+                files=output_files)
+
+    oprint("\n  Sampled urls per host, path prefix and resource type "
+            "(broken/checked/discovered):\n", files=output_files)
+    for (stratum, count) in sorted(sampler.strata.items()):
+        (host, prefix, link_type) = stratum
+        oprint("  {0}/{1}/{2}: {3}{4} ({5})".format(count.errors,
+                count.checked, count.discovered, host, prefix, link_type),
+                files=output_files)
+
+
+def format_estimate(estimate):
+    return "{0:.1f}% (95% CI {1:.1f}%-{2:.1f}%) of {3} discovered urls "\
+            "({4} checked)".format(estimate.rate * 100, estimate.low * 100,
+            estimate.high * 100, estimate.discovered, estimate.checked)
+
 
 def oprint(message, files):
     """Prints to a sequence of files."""
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the parsing and the cache of robots.txt files.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import io
+import json
+import os
+import re
+import threading
+import time
+
+from pylinkchecker.compat import get_url_open, get_url_request, HTTPError
+from pylinkchecker.state import get_temp_file
+
+
+ROBOTS_PATH = "/robots.txt"
+
+
+USER_AGENT = "pylinkchecker"
+
+
+DEFAULT_ROBOTS_TTL = 86400
+
+
+DEFAULT_ROBOTS_TIMEOUT = 10
+
+
+# Rules of a host whose robots.txt cannot be served (5xx).
+DISALLOW_ALL = "User-agent: *\nDisallow: /\n"
+
+
+class RobotRules(object):
+    """Rules of a robots.txt file that apply to pylinkchecker.
+
+    The rules are compiled once and sorted by length: the first rule that
+    matches a path is the longest one (Allow wins ties).
+    """
+
+    def __init__(self, rules=None, crawl_delay=None):
+        self.crawl_delay = crawl_delay
+        self.rules = []
+        """List of (allow, compiled pattern or prefix string)"""
+
+        sorted_rules = sorted(rules or [],
+                key=lambda rule: (-len(rule[1]), not rule[0]))
+        for (allow, path) in sorted_rules:
+            self.rules.append((allow, compile_rule(path)))
+
+    def is_allowed(self, url_split):
+        """Returns True if the path and the query of the url can be
+        crawled."""
+        path = url_split.path or "/"
+        if url_split.query:
+            path = path + "?" + url_split.query
+
+        for (allow, matcher) in self.rules:
+            if isinstance(matcher, type("")):
+                if path.startswith(matcher):
+                    return allow
+            elif matcher.match(path):
+                return allow
+        return True
+
+
+def compile_rule(path):
+    """Returns a prefix string or a compiled regular expression if the path
+    contains wildcards (* and $)."""
+    if "*" not in path and not path.endswith("$"):
+        return path
+
+    end = ""
+    if path.endswith("$"):
+        path = path[:-1]
+        end = "$"
+    return re.compile(".*".join(re.escape(part) for part in path.split("*")) +
+            end)
+
+
+def parse_robots(content, user_agent=USER_AGENT):
+    """Returns the RobotRules of a robots.txt that apply to user_agent (or to
+    all user agents if no group is specific to user_agent).
+
+    :param content: The unicode content of robots.txt
+    """
+    groups = {}
+    """Map of user agent:(list of (allow, path), list of crawl delays)"""
+
+    current_groups = []
+    in_rules = False
+    for line in content.splitlines():
+        line = line.split("#", 1)[0].strip()
+        (key, _, value) = line.partition(":")
+        key = key.strip().lower()
+        value = value.strip()
+
+        if key == "user-agent":
+            if in_rules:
+                # A new group starts.
+                current_groups = []
+                in_rules = False
+            current_groups.append(groups.setdefault(value.lower(), ([], [])))
+        elif key in ("allow", "disallow", "crawl-delay"):
+            in_rules = True
+            for (rules, delays) in current_groups:
+                if key == "crawl-delay":
+                    try:
+                        delays.append(float(value))
+                    except ValueError:
+                        pass
+                elif value:
+                    # An empty Disallow allows everything.
+                    rules.append((key == "allow", value))
+
+    (rules, delays) = groups.get(user_agent.lower(), groups.get("*",
+            ([], [])))
+    crawl_delay = None
+    if delays:
+        crawl_delay = delays[0]
+    return RobotRules(rules, crawl_delay)
+
+
+class RobotsCache(object):
+    """Cache of the robots.txt rules of each host.
+
+    robots.txt is fetched once per host with user_agent, whose rules apply.
+    If path is set, the content of the robots.txt files is stored in a JSON
+    file and reused by the next crawls until ttl seconds have passed. A
+    robots.txt that fails (5xx) disallows the whole host for this crawl and a
+    host that cannot be reached (network error) is allowed so the errors of
+    its urls are reported. Both are fetched again by the next crawl.
+
+    The crawler calls is_ready, which fetches robots.txt in the background, so
+    the rules are only looked up once they are known.
+
+    This class is thread-safe.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_ROBOTS_TTL,
+            timeout=DEFAULT_ROBOTS_TIMEOUT, user_agent=USER_AGENT):
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.user_agent = user_agent
+
+        self.rules = {}
+        """Map of scheme://host:RobotRules"""
+
+        self.contents = {}
+        """Map of scheme://host:(fetch time, content)"""
+
+        self.fetching = set()
+        """scheme://host whose robots.txt is being fetched"""
+
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def is_allowed(self, url_split):
+        return self.get_rules(url_split).is_allowed(url_split)
+
+    def get_crawl_delay(self, url_split):
+        """Returns the Crawl-delay of the host of the url or None."""
+        return self.get_rules(url_split).crawl_delay
+
+    def is_ready(self, url_split):
+        """Returns True if the rules of the host of the url are known.
+        Otherwise, starts fetching robots.txt in a background thread and
+        returns False."""
+        key = get_key(url_split)
+        if key in self.rules:
+            return True
+
+        with self._lock:
+            if key in self.rules:
+                return True
+            if key in self.fetching:
+                return False
+            if self._parse_cached(key):
+                return True
+            self.fetching.add(key)
+
+        thread = threading.Thread(target=self._fetch, args=(key,))
+        thread.daemon = True
+        thread.start()
+        return False
+
+    def get_rules(self, url_split):
+        """Returns the rules of the host of the url. Fetches robots.txt in
+        the calling thread if needed: use is_ready first to avoid blocking."""
+        key = get_key(url_split)
+        rules = self.rules.get(key)
+        if rules is not None:
+            return rules
+
+        with self._lock:
+            if self._parse_cached(key):
+                return self.rules[key]
+        self._fetch(key)
+        return self.rules[key]
+
+    def _parse_cached(self, key):
+        """Parses the cached robots.txt of a host if it did not expire.
+        Returns True if the rules are known. Must hold the lock."""
+        (fetch_time, content) = self.contents.get(key, (0, None))
+        if content is None or time.time() - fetch_time > self.ttl:
+            return False
+        self.rules[key] = parse_robots(content, self.user_agent)
+        return True
+
+    def _fetch(self, key):
+        content = fetch_robots(key + ROBOTS_PATH, self.timeout,
+                self.user_agent)
+        with self._lock:
+            if content is None:
+                # Unreachable: the requests of the urls fail and are
+                # reported.
+                self.rules[key] = RobotRules()
+            else:
+                if content != DISALLOW_ALL:
+                    self.contents[key] = (time.time(), content)
+                self.rules[key] = parse_robots(content, self.user_agent)
+            self.fetching.discard(key)
+
+    def load(self):
+        with io.open(self.path, "r", encoding="utf-8") as cache_file:
+            data = json.load(cache_file)
+        for (key, (fetch_time, content)) in data.items():
+            self.contents[key] = (fetch_time, content)
+
+    def save(self):
+        """Saves the content of the robots.txt files if path is set. The file
+        is replaced atomically."""
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps(self.contents, ensure_ascii=True)
+        (fd, temp_path) = get_temp_file(self.path)
+        with io.open(fd, "w", encoding="utf-8") as cache_file:
+            # json.dumps returns a byte string on Python 2.
+            cache_file.write(data if isinstance(data, type("")) else
+                    data.decode("utf-8"))
+        os.rename(temp_path, self.path)
+
+
+def get_key(url_split):
+    return "{0}://{1}".format(url_split.scheme, url_split.netloc)
+
+
+def fetch_robots(url, timeout, user_agent=USER_AGENT):
+    """Returns the content of a robots.txt file. Returns an empty content
+    (everything is allowed) if the file is unavailable (4xx), DISALLOW_ALL if
+    the server fails (5xx) and None if it cannot be reached (network
+    error)."""
+    try:
+        request = get_url_request()(url)
+        request.add_header("User-Agent", user_agent)
+        response = get_url_open()(request, timeout=timeout)
+        try:
+            return response.read().decode("utf-8", "replace")
+        finally:
+            response.close()
+    except HTTPError as exc:
+        if exc.code >= 500:
+            return DISALLOW_ALL
+        return ""
+    except Exception:
+        # Same as open_url: any error (e.g., IncompleteRead) is reported as
+        # an unreachable robots.txt.
+        return None
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the stratified sampling of urls used to estimate the rate of broken
+urls of huge sites.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+import math
+import random
+
+from pylinkchecker.models import Estimate, DEFAULT_MIN_SAMPLE_SIZE
+
+
+# 95% confidence
+Z_95 = 1.96
+
+
+def get_stratum(url_split, link_type):
+    """Returns the stratum of a url: (host, first path segment, resource
+    type)."""
+    segments = url_split.path.split("/")
+    prefix = "/"
+    if len(segments) > 2:
+        prefix = "/" + segments[1] + "/"
+    return (url_split.netloc, prefix, link_type)
+
+
+def get_sample_value(seed, url_id):
+    """Returns a number in [0, 1) that only depends on the seed and the
+    url."""
+    digest = hashlib.md5("{0}:{1}".format(seed, url_id).encode("utf-8"))
+    return int(digest.hexdigest()[:16], 16) / float(2 ** 64)
+
+
+def wilson_interval(errors, size, z=Z_95):
+    """Returns the (low, high) Wilson score interval of a proportion."""
+    if not size:
+        return (0.0, 1.0)
+    rate = float(errors) / size
+    denominator = 1 + z * z / size
+    center = (rate + z * z / (2 * size)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / size +
+            z * z / (4 * size * size)) / denominator
+    return (max(0.0, center - margin), min(1.0, center + margin))
+
+
+class StratumCount(object):
+    """Number of urls discovered, sampled, checked and broken in a
+    stratum."""
+
+    def __init__(self):
+        self.discovered = 0
+        self.sampled = 0
+        self.checked = 0
+        self.errors = 0
+
+    def get_estimate(self):
+        (low, high) = wilson_interval(self.errors, self.checked)
+        rate = 0.0
+        if self.checked:
+            rate = float(self.errors) / self.checked
+        return Estimate(rate, low, high, self.discovered, self.checked,
+                self.errors)
+
+
+class Sampler(object):
+    """Checks a random sample of the urls of each stratum (host, path prefix,
+    resource type).
+
+    The first min_size urls of a stratum are always sampled so small strata
+    are represented. The other urls are sampled with a probability of rate:
+    the decision only depends on the seed and the url, not on the order in
+    which the workers return the pages.
+
+    :param rate: Probability that a url is checked.
+    :param min_size: Number of urls always checked in each stratum.
+    :param seed: Seed of the sample (same sample for each run). Random if
+            None.
+    """
+
+    def __init__(self, rate, min_size=DEFAULT_MIN_SAMPLE_SIZE, seed=None):
+        self.rate = rate
+        self.min_size = min_size
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+
+        self.strata = {}
+        """Map of stratum:StratumCount"""
+
+        self.pending = {}
+        """Map of url id:stratum of the sampled urls not checked yet"""
+
+    def sample(self, url_id, url_split, link_type):
+        """Returns True if a newly discovered url must be checked."""
+        stratum = get_stratum(url_split, link_type)
+        count = self.strata.get(stratum)
+        if count is None:
+            count = StratumCount()
+            self.strata[stratum] = count
+
+        count.discovered += 1
+        if count.sampled < self.min_size or\
+                get_sample_value(self.seed, url_id) < self.rate:
+            count.sampled += 1
+            self.pending[url_id] = stratum
+            return True
+        return False
+
+    def add_result(self, url_id, is_ok):
+        """Records the result of a sampled url."""
+        stratum = self.pending.pop(url_id, None)
+        if stratum is None:
+            # Not sampled (e.g., start url)
+            return
+        count = self.strata[stratum]
+        count.checked += 1
+        if not is_ok:
+            count.errors += 1
+
+    def get_estimate(self, host=None):
+        """Returns the Estimate of the rate of broken urls of a host (or of
+        all hosts) with a 95% confidence interval.
+
+        The rates of the strata are weighted by the number of urls discovered
+        in each stratum.
+        """
+        counts = [count for (stratum, count) in self.strata.items() if
+                count.checked and (host is None or stratum[0] == host)]
+        discovered = sum(count.discovered for count in counts)
+        checked = sum(count.checked for count in counts)
+        errors = sum(count.errors for count in counts)
+        if not checked:
+            return Estimate(0.0, 0.0, 1.0, discovered, 0, 0)
+
+        rate = 0.0
+        variance = 0.0
+        for count in counts:
+            weight = float(count.discovered) / discovered
+            stratum_rate = float(count.errors) / count.checked
+            rate += weight * stratum_rate
+            # Finite population correction: a fully checked stratum is exact.
+            correction = 1.0 - float(count.checked) / count.discovered
+            variance += weight * weight * stratum_rate *\
+                    (1 - stratum_rate) / count.checked * correction
+
+        margin = Z_95 * math.sqrt(variance)
+        if errors == 0 or errors == checked:
+            # The normal approximation fails at 0% and 100%.
+            (low, high) = wilson_interval(errors, checked)
+            low = min(low, rate)
+            high = max(high, rate)
+        else:
+            (low, high) = (max(0.0, rate - margin), min(1.0, rate + margin))
+        return Estimate(rate, low, high, discovered, checked, errors)
+
+    def get_hosts(self):
+        hosts = set()
+        for stratum in self.strata:
+            hosts.add(stratum[0])
+        return sorted(hosts)
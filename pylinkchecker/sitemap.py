@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the parsing of sitemaps and sitemap indexes (sitemap.xml).
+"""
+from __future__ import unicode_literals, absolute_import
+
+from xml.etree import ElementTree
+
+from pylinkchecker.models import SitemapEntry
+
+
+TAG_URL = "url"
+TAG_SITEMAP = "sitemap"
+TAG_LOC = "loc"
+TAG_LASTMOD = "lastmod"
+
+
+def get_local_name(tag):
+    """Returns the name of a tag without its namespace ({ns}url -> url)."""
+    return tag.rpartition("}")[2]
+
+
+def parse_sitemap(content):
+    """Yields a SitemapEntry for each url of a sitemap or each sitemap of a
+    sitemap index.
+
+    The sitemap is parsed as a stream: the parsed elements are discarded so
+    large sitemaps (50,000 urls) use little memory.
+
+    :param content: A file-like object with the XML content.
+    """
+    root = None
+    loc = None
+    lastmod = None
+    for (event, element) in ElementTree.iterparse(content,
+            events=(str("start"), str("end"))):
+        if event == "start":
+            if root is None:
+                root = element
+            continue
+
+        tag = get_local_name(element.tag)
+        if tag == TAG_LOC:
+            loc = (element.text or "").strip()
+        elif tag == TAG_LASTMOD:
+            lastmod = (element.text or "").strip() or None
+        elif tag in (TAG_URL, TAG_SITEMAP):
+            if loc:
+                yield SitemapEntry(tag == TAG_SITEMAP, loc, lastmod)
+            loc = None
+            lastmod = None
+            # All the previous elements were parsed.
+            root.clear()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the state of the previous crawls stored between runs and the
+checkpoints of interrupted crawls.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import gzip
+import io
+import itertools
+import json
+import os
+import pickle
+import tempfile
+
+
+STATE_VERSION = 1
+
+
+CHECKPOINT_VERSION = 1
+
+
+# Number of items of a checkpoint stream pickled together.
+CHECKPOINT_CHUNK_SIZE = 1000
+
+
+class CrawlState(object):
+    """Information about the urls of the previous crawls (e.g., lastmod of the
+    sitemap), stored in a JSON file.
+
+    :param path: The path of the JSON file. It is created on save if it does
+            not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self.pages = {}
+        """Map of url:dict of property:value"""
+
+    def load(self):
+        """Loads the state from the file if it exists."""
+        if not os.path.exists(self.path):
+            return
+        with io.open(self.path, "r", encoding="utf-8") as state_file:
+            data = json.load(state_file)
+        if data.get("version") != STATE_VERSION:
+            raise ValueError("Unsupported state file version: {0}".format(
+                    data.get("version")))
+        self.pages = data["pages"]
+
+    def save(self):
+        """Saves the state. The file is replaced atomically so a crawl that
+        is interrupted does not corrupt the state."""
+        (fd, temp_path) = get_temp_file(self.path)
+        with io.open(fd, "w", encoding="utf-8") as state_file:
+            data = json.dumps({"version": STATE_VERSION,
+                    "pages": self.pages}, ensure_ascii=True)
+            # json.dumps returns a byte string on Python 2.
+            state_file.write(data if isinstance(data, type("")) else
+                    data.decode("utf-8"))
+        os.rename(temp_path, self.path)
+
+    def get(self, url, name, default=None):
+        """Returns a property of a url stored by a previous crawl."""
+        return self.pages.get(url, {}).get(name, default)
+
+    def get_referrers(self):
+        """Returns a map of url:list of the urls of the pages linking to it.
+        Only the links stored by incremental crawls are known."""
+        referrers = {}
+        for (url, properties) in self.pages.items():
+            for link in properties.get("links", []):
+                referrers.setdefault(link[1], []).append(url)
+        return referrers
+
+    def set(self, url, name, value):
+        """Sets a property of a url. A None value removes the property."""
+        if value is None:
+            properties = self.pages.get(url)
+            if properties:
+                properties.pop(name, None)
+                if not properties:
+                    del self.pages[url]
+        else:
+            self.pages.setdefault(url, {})[name] = value
+
+
+def get_temp_file(path):
+    """Returns a tuple of (file descriptor, path) of a temporary file in the
+    directory of path. The temporary file can then replace path
+    atomically."""
+    directory = os.path.dirname(os.path.abspath(path))
+    return tempfile.mkstemp(prefix=".pylinkchecker-", dir=directory)
+
+
+def save_checkpoint(path, data, streams=()):
+    """Saves a checkpoint (a gzip-compressed pickle) of a crawl. The file is
+    replaced atomically so a crash during the save keeps the previous
+    checkpoint.
+
+    :param streams: A sequence of (name, iterable). The items are written
+            in chunks so large collections are never fully in memory.
+    """
+    (fd, temp_path) = get_temp_file(path)
+    with io.open(fd, "wb") as checkpoint_file:
+        gzip_file = gzip.GzipFile(fileobj=checkpoint_file, mode="wb",
+                compresslevel=1)
+        try:
+            pickle.dump((CHECKPOINT_VERSION, data,
+                    [name for (name, _) in streams]), gzip_file, 2)
+            for (_, iterable) in streams:
+                iterator = iter(iterable)
+                while True:
+                    chunk = list(itertools.islice(iterator,
+                            CHECKPOINT_CHUNK_SIZE))
+                    # An empty chunk ends the stream.
+                    pickle.dump(chunk, gzip_file, 2)
+                    if not chunk:
+                        break
+        finally:
+            gzip_file.close()
+    os.rename(temp_path, path)
+
+
+def load_checkpoint(path, stream_funcs=None):
+    """Returns the data of a checkpoint or None if there is no checkpoint.
+
+    :param stream_funcs: A map of stream name:function called with each item
+            of the stream. The other streams are added to the data as lists.
+    """
+    if not os.path.exists(path):
+        return None
+    stream_funcs = stream_funcs or {}
+    gzip_file = gzip.GzipFile(path, "rb")
+    try:
+        (version, data, names) = pickle.load(gzip_file)
+        if version != CHECKPOINT_VERSION:
+            raise ValueError("Unsupported checkpoint version: {0}".format(
+                    version))
+        for name in names:
+            func = stream_funcs.get(name)
+            if func is None:
+                data[name] = []
+                func = data[name].append
+            chunk = pickle.load(gzip_file)
+            while chunk:
+                for item in chunk:
+                    func(item)
+                chunk = pickle.load(gzip_file)
+    finally:
+        gzip_file.close()
+    return data
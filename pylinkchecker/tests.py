@@ -4,22 +4,40 @@ Unit and integration tests for pylinkchecker
 """
 from __future__ import unicode_literals, absolute_import
 
+import io
 import os
 import logging
+import shutil
 import sys
+import tempfile
 import time
 import threading
 import unittest
 
 from pylinkchecker import api
 import pylinkchecker.compat as compat
+import pylinkchecker.crawler as crawler_module
 from pylinkchecker.compat import (SocketServer, SimpleHTTPServer, get_url_open,
         get_url_request)
-from pylinkchecker.crawler import (open_url, PageCrawler, WORK_DONE,
-        ThreadSiteCrawler, ProcessSiteCrawler, get_logger)
+from pylinkchecker.crawler import (open_url, PageCrawler, ParsePool, WORK_DONE,
+        ThreadSiteCrawler, ProcessSiteCrawler, RemoteSiteCrawler, get_logger,
+        get_unicode_markup, truncate_markup, run_remote_worker,
+        receive_remote_inputs, Site, ParseCost)
 from pylinkchecker.models import (Config, WorkerInit, WorkerConfig, WorkerInput,
-        PARSER_STDLIB)
-from pylinkchecker.urlutil import get_clean_url_split, get_absolute_url_split, is_link
+        PARSER_STDLIB, TRUNCATED_SIZE, TRUNCATED_ELEMENTS, TRUNCATED_TIME,
+        SKIPPED_UNCHANGED, SKIPPED_ROBOTS, SKIPPED_DEPTH, SitemapEntry, Link,
+        PageCrawl)
+from pylinkchecker.merge import merge_shard_files
+from pylinkchecker.robots import parse_robots, RobotsCache, USER_AGENT
+from pylinkchecker.state import load_checkpoint
+from pylinkchecker.sampling import Sampler, wilson_interval
+from pylinkchecker.remote import ShardedQueue, get_shard, send_message
+from pylinkchecker.sitemap import parse_sitemap
+from pylinkchecker.frontier import (Frontier, SpillingFrontier, HostFrontier,
+        SpillingDict)
+from pylinkchecker.urlutil import (get_clean_url_split, get_absolute_url_split,
+        is_link, URLCache, get_canonical_url_split, get_url_id, BloomFilter,
+        get_url_template, absolute_url_cache)
 
 
 TEST_FILES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
@@ -102,6 +120,20 @@ class ConfigTest(unittest.TestCase):
         self.assertTrue('foo.com' in config.accepted_hosts)
         self.assertTrue('baz.com' in config.accepted_hosts)
 
+    def test_ignored_prefixes(self):
+        sys.argv = ['pylinkchecker', '-i',
+                'HTTP://WWW.Example.com:80/%7Euser/,www.example.com/a/',
+                'http://www.example.com/']
+        config = Config()
+        config.parse_cli_config()
+        self.assertEqual(('http://www.example.com/~user/',
+                'www.example.com/a/'), config.worker_config.ignored_prefixes)
+
+    def test_remote_key_required(self):
+        for option in ["--mode=remote", "--remote-worker=localhost:8790"]:
+            sys.argv = ['pylinkchecker', option, 'http://www.example.com/']
+            self.assertRaises(ValueError, Config().parse_cli_config)
+
 
 class URLUtilTest(unittest.TestCase):
 
@@ -120,6 +152,54 @@ class URLUtilTest(unittest.TestCase):
         self.assertEqual("http://www.example.com/",
             get_clean_url_split("http://www.example.com/").geturl())
 
+    def test_canonical_url_split(self):
+        def canonical(url, sort_query=False, strip_tracking_params=False):
+            return get_canonical_url_split(get_clean_url_split(url),
+                    sort_query, strip_tracking_params).geturl()
+
+        self.assertEqual("http://example.com/a",
+                canonical("HTTP://Example.COM:80/a"))
+        self.assertEqual("https://example.com:8443/a",
+                canonical("https://example.com:8443/a#x"))
+        self.assertEqual("http://example.com/",
+                canonical("http://example.com"))
+        self.assertEqual("http://example.com/~a%2F%C3%A9",
+                canonical("http://example.com/%7ea%2f%c3%a9"))
+        self.assertEqual("http://example.com/a?b=1&a=2",
+                canonical("http://example.com/a?b=1&a=2"))
+        self.assertEqual("http://example.com/a?a=2&b=1&b=0",
+                canonical("http://example.com/a?b=1&a=2&b=0", True))
+        self.assertEqual("http://example.com/a?b=1",
+                canonical("http://example.com/a?utm_source=x&b=1&gclid=y",
+                False, True))
+
+    def test_url_template(self):
+        def template(url):
+            return get_url_template(get_clean_url_split(url))
+
+        self.assertEqual("www.example.com/cars/<int>",
+                template("http://www.example.com/cars/1234"))
+        self.assertEqual("www.example.com/search?make&page",
+                template("http://www.example.com/search?page=2&make=a&make=b"))
+        self.assertEqual("www.example.com/<date>/<slug-id>",
+                template("http://www.example.com/2013-10-28/post-12.html"))
+        self.assertEqual("www.example.com/about.html",
+                template("http://www.example.com/about.html"))
+
+    def test_bloom_filter(self):
+        url_ids = [get_url_id(get_clean_url_split(
+                "http://www.example.com/{0}.html".format(i)))
+                for i in range(1000)]
+        bloom_filter = BloomFilter(1000)
+        for url_id in url_ids[:500]:
+            bloom_filter.add(url_id)
+
+        for url_id in url_ids[:500]:
+            self.assertTrue(url_id in bloom_filter)
+        false_positives = [url_id for url_id in url_ids[500:] if
+                url_id in bloom_filter]
+        self.assertTrue(len(false_positives) < 5)
+
     def test_get_absolute_url(self):
         base_url_split = get_clean_url_split(
                 "https://www.example.com/hello/index.html")
@@ -147,6 +227,334 @@ class URLUtilTest(unittest.TestCase):
         for url, value in urls:
             self.assertEqual(is_link(url), value)
 
+    def test_url_cache(self):
+        cache = URLCache(max_size=4)
+        for i in range(4):
+            cache.put(i, i)
+        self.assertEqual(0, cache.get(0))
+        self.assertEqual(None, cache.get(10))
+        self.assertEqual(0.5, cache.hit_rate)
+
+        # 1 is the least recently used entry
+        cache.put(4, 4)
+        self.assertEqual(None, cache.get(1))
+        self.assertEqual(0, cache.get(0))
+        self.assertEqual(4, cache.get(4))
+
+    def test_absolute_url_cache(self):
+        absolute_url_cache.clear()
+        for page in ["/a/1.html", "/a/2.html", "/b/3.html?page=2"]:
+            base_url_split = get_clean_url_split("http://www.example.com" +
+                    page)
+            for url in ["http://www.example2.com/", "//www.example2.com/",
+                    "/about.html", "../contact.html"]:
+                get_absolute_url_split(url, base_url_split)
+        # The relative link is resolved once per directory.
+        self.assertEqual(5, absolute_url_cache.misses)
+        self.assertEqual(7, absolute_url_cache.hits)
+
+    def test_interned_url_split(self):
+        base_url_split = get_clean_url_split("http://www.example.com/a/")
+        url_split = get_absolute_url_split("b.html", base_url_split)
+        self.assertTrue(url_split is
+                get_absolute_url_split("b.html", base_url_split))
+        self.assertTrue(url_split is
+                get_clean_url_split("http://www.example.com/a/b.html"))
+
+
+class FrontierTest(unittest.TestCase):
+
+    def test_priority(self):
+        frontier = Frontier()
+        url_split = get_clean_url_split("http://www.example.com/")
+        frontier.put(WorkerInput(url_split, False, 1))
+        frontier.put(WorkerInput(url_split, True, 2))
+        frontier.put(WorkerInput(url_split, True, 1))
+        frontier.put(WorkerInput(url_split, False, 0))
+
+        self.assertEqual(4, len(frontier))
+        self.assertEqual([(True, 1), (True, 2), (False, 0), (False, 1)],
+                [(worker_input.should_crawl, worker_input.depth) for
+                worker_input in [frontier.get() for _ in range(4)]])
+
+    def test_score_func(self):
+        frontier = Frontier(lambda worker_input: -worker_input.depth)
+        url_split = get_clean_url_split("http://www.example.com/")
+        frontier.put(WorkerInput(url_split, True, 1))
+        frontier.put(WorkerInput(url_split, True, 2))
+        self.assertEqual(2, frontier.get().depth)
+
+    def test_host_frontier(self):
+        frontier = HostFrontier(max_in_flight=2, weights={"b.com": 2})
+        for host in ["a.com", "a.com", "a.com", "b.com", "b.com", "b.com",
+                "c.com"]:
+            frontier.put(WorkerInput(get_clean_url_split(
+                    "http://{0}/".format(host)), True, 0))
+
+        hosts = [frontier.get().url_split.netloc for _ in range(5)]
+        self.assertEqual(["a.com", "b.com", "b.com", "c.com", "a.com"],
+                hosts)
+        # a.com and b.com have two urls being crawled.
+        self.assertRaises(IndexError, frontier.get)
+        self.assertEqual(2, len(frontier))
+
+        frontier.done(get_clean_url_split("http://b.com/"))
+        self.assertEqual("b.com", frontier.get().url_split.netloc)
+        self.assertEqual(1, len(list(frontier.drain())))
+        self.assertEqual(0, len(frontier))
+
+    def test_host_frontier_delay(self):
+        frontier = HostFrontier(delay_func=lambda url_split: 0.05)
+        for path in ["/a.html", "/b.html"]:
+            frontier.put(WorkerInput(get_clean_url_split(
+                    "http://a.com" + path), True, 0))
+
+        frontier.get()
+        self.assertRaises(IndexError, frontier.get)
+        wait_time = frontier.get_wait_time()
+        self.assertTrue(0 < wait_time <= 0.05)
+        time.sleep(wait_time)
+        self.assertEqual("/b.html", frontier.get().url_split.path)
+
+    def test_spilling_frontier(self):
+        frontier = SpillingFrontier(4)
+        url_split = get_clean_url_split("http://www.example.com/")
+        depths = [5, 3, 8, 1, 3, 9, 0, 2, 7, 3, 6, 4, 1]
+        for (index, depth) in enumerate(depths):
+            frontier.put(WorkerInput(url_split._replace(path=str(index)),
+                    True, depth))
+        self.assertEqual(len(depths), len(frontier))
+        self.assertTrue(len(frontier._heap) <= 4)
+
+        worker_inputs = [frontier.get() for _ in range(5)]
+        frontier.put(WorkerInput(url_split._replace(path="new"), True, 0))
+        # The snapshot does not remove the worker inputs.
+        self.assertEqual([0, 3, 3, 4, 5, 6, 7, 8, 9], [worker_input.depth
+                for worker_input in frontier.snapshot()])
+        self.assertEqual(9, len(frontier))
+        while len(frontier):
+            worker_inputs.append(frontier.get())
+        # The rows are deleted when their worker inputs are returned.
+        self.assertEqual(0, frontier.connection.execute(
+                "SELECT COUNT(*) FROM entries").fetchone()[0])
+        frontier.close()
+
+        self.assertEqual([0, 1, 1, 2, 3, 0, 3, 3, 4, 5, 6, 7, 8, 9],
+                [worker_input.depth for worker_input in worker_inputs])
+        # FIFO order is kept for equal scores
+        self.assertEqual(["3", "12"],
+                [worker_input.url_split.path for worker_input in
+                worker_inputs[1:3]])
+        self.assertEqual(["4", "9"],
+                [worker_input.url_split.path for worker_input in
+                worker_inputs[6:8]])
+
+    def test_spilling_dict(self):
+        statuses = SpillingDict(4)
+        # Url ids use the full unsigned 64-bit range.
+        keys = [2 ** 64 - 1, 0] + list(range(1, 9))
+        for key in keys:
+            statuses[key] = [key]
+        self.assertEqual(len(keys), len(statuses))
+        self.assertTrue(len(statuses._items) <= 4)
+        self.assertTrue(statuses.path and os.path.exists(statuses.path))
+
+        self.assertTrue(2 ** 64 - 1 in statuses)
+        self.assertEqual([0], statuses[0])
+        self.assertEqual(None, statuses.get(10))
+        statuses[0] = [0, "source"]
+        self.assertEqual([0, "source"], statuses[0])
+        self.assertEqual([1], statuses.pop(1))
+        self.assertEqual(None, statuses.pop(1, None))
+        del statuses[2 ** 64 - 1]
+        self.assertFalse(2 ** 64 - 1 in statuses)
+        self.assertEqual(len(keys) - 2, len(statuses))
+        self.assertEqual(len(keys) - 2, len(list(statuses.items())))
+
+        statuses.close()
+        self.assertFalse(os.path.exists(statuses.path))
+
+
+class RobotsTest(unittest.TestCase):
+
+    def test_parse_robots(self):
+        rules = parse_robots("""User-agent: otherbot
+User-agent: *
+Disallow: /private/
+Allow: /private/public.html
+Disallow: /*.pdf$
+Disallow: /search?  # comments are ignored
+Crawl-delay: 2
+
+User-agent: pylinkchecker
+Disallow:
+""")
+        self.assertEqual(None, rules.crawl_delay)
+        self.assertTrue(rules.is_allowed(get_clean_url_split(
+                "http://www.example.com/private/")))
+
+        rules = parse_robots("""User-agent: otherbot
+User-agent: *
+Disallow: /private/
+Allow: /private/public.html
+Disallow: /*.pdf$
+Disallow: /search?
+Crawl-delay: 2
+""")
+        self.assertEqual(2.0, rules.crawl_delay)
+
+        def is_allowed(path):
+            return rules.is_allowed(get_clean_url_split(
+                    "http://www.example.com" + path))
+
+        self.assertTrue(is_allowed("/"))
+        self.assertFalse(is_allowed("/private/index.html"))
+        self.assertTrue(is_allowed("/private/public.html"))
+        self.assertFalse(is_allowed("/doc/file.pdf"))
+        self.assertTrue(is_allowed("/doc/file.pdf.html"))
+        self.assertFalse(is_allowed("/search?q=test"))
+        self.assertTrue(is_allowed("/search"))
+
+    def test_unreachable_robots(self):
+        cache = RobotsCache(timeout=1)
+        url_split = get_clean_url_split("http://localhost:1/index.html")
+        # Nothing listens on port 1: the host is allowed so the errors of
+        # its urls are reported.
+        self.assertTrue(cache.is_allowed(url_split))
+        self.assertEqual({}, cache.contents)
+
+
+class RemoteTest(unittest.TestCase):
+
+    def test_receive_invalid_signature(self):
+        import socket
+        (coordinator_sock, worker_sock) = socket.socketpair()
+        try:
+            send_message(coordinator_sock, WORK_DONE, b"other key")
+            output_queue = compat.Queue.Queue()
+            receive_remote_inputs(worker_sock, b"key", compat.Queue.Queue(),
+                    output_queue, [], get_logger())
+            # The remote worker stops instead of waiting forever.
+            self.assertEqual(WORK_DONE, output_queue.get(False))
+        finally:
+            coordinator_sock.close()
+            worker_sock.close()
+
+    def test_sharded_queue(self):
+        queues = [compat.Queue.Queue(), compat.Queue.Queue()]
+        sharded_queue = ShardedQueue(queues)
+        worker_inputs = [WorkerInput(get_clean_url_split(
+                "http://{0}.example.com/".format(i)), True, 0) for i in
+                range(10)]
+        sharded_queue.put(worker_inputs)
+        sharded_queue.put(WORK_DONE)
+        sharded_queue.put(WORK_DONE)
+
+        for (index, queue) in enumerate(queues):
+            batch = queue.get()
+            self.assertTrue(batch)
+            for worker_input in batch:
+                self.assertEqual(index, get_shard(worker_input.url_split, 2))
+            self.assertEqual(WORK_DONE, queue.get())
+
+
+class SitemapTest(unittest.TestCase):
+
+    def test_parse_sitemap(self):
+        content = io.BytesIO("""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc> http://www.example.com/</loc><lastmod>2013-10-01</lastmod></url>
+  <url><loc>http://www.example.com/été.html</loc></url>
+</urlset>""".encode("utf-8"))
+        self.assertEqual([
+                SitemapEntry(False, "http://www.example.com/", "2013-10-01"),
+                SitemapEntry(False, "http://www.example.com/été.html", None)],
+                list(parse_sitemap(content)))
+
+    def test_parse_sitemap_index(self):
+        content = io.BytesIO(b"""<sitemapindex>
+  <sitemap><loc>http://www.example.com/sitemap1.xml</loc></sitemap>
+</sitemapindex>""")
+        self.assertEqual([
+                SitemapEntry(True, "http://www.example.com/sitemap1.xml",
+                None)], list(parse_sitemap(content)))
+
+
+class SamplingTest(unittest.TestCase):
+
+    def test_wilson_interval(self):
+        (low, high) = wilson_interval(0, 10)
+        self.assertEqual(0.0, low)
+        self.assertAlmostEqual(0.278, high, 3)
+        (low, high) = wilson_interval(5, 10)
+        self.assertTrue(low < 0.5 < high)
+
+    def test_sampler(self):
+        sampler = Sampler(0.0, min_size=2, seed=1)
+        for i in range(4):
+            url_split = get_clean_url_split(
+                    "http://www.example.com/a/{0}.html".format(i))
+            self.assertEqual(i < 2, sampler.sample(i, url_split, "a"))
+        self.assertTrue(sampler.sample(4, get_clean_url_split(
+                "http://www.example.com/b/1.html"), "a"))
+        sampler.add_result(0, True)
+        sampler.add_result(1, False)
+        sampler.add_result(4, True)
+
+        estimate = sampler.get_estimate()
+        self.assertEqual((5, 3, 1), (estimate.discovered, estimate.checked,
+                estimate.errors))
+        # The stratum /a/ has 4 of the 5 urls and a rate of 50%.
+        self.assertAlmostEqual(0.4, estimate.rate)
+        self.assertTrue(estimate.low < 0.4 < estimate.high)
+
+    def test_sampler_seed(self):
+        url_split = get_clean_url_split("http://www.example.com/")
+        url_ids = list(range(100))
+        samples = []
+        for ordered_ids in (url_ids, list(reversed(url_ids))):
+            sampler = Sampler(0.5, min_size=0, seed=1)
+            samples.append(sorted(url_id for url_id in ordered_ids if
+                    sampler.sample(url_id, url_split, "a")))
+        # The decision does not depend on the order of the urls.
+        self.assertEqual(samples[0], samples[1])
+        self.assertTrue(0 < len(samples[0]) < 100)
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_http_charset(self):
+        content = "<html>été</html>".encode("latin-1")
+        self.assertEqual("<html>été</html>",
+                get_unicode_markup(content, "iso-8859-1"))
+
+    def test_utf8(self):
+        content = "\ufeff<html>été</html>".encode("utf-8")
+        self.assertEqual("<html>été</html>", get_unicode_markup(content))
+        self.assertEqual("<html>été</html>",
+                get_unicode_markup(content, "bad-charset"))
+
+    def test_meta_charset(self):
+        content = '<html><meta charset="windows-1252">été</html>'.encode(
+                "cp1252")
+        self.assertEqual('<html><meta charset="windows-1252">été</html>',
+                get_unicode_markup(content))
+
+        content = '<meta http-equiv="Content-Type" content="text/html; '\
+                'charset=ISO-8859-1"><p>été</p>'.encode("latin-1")
+        self.assertTrue("été" in get_unicode_markup(content))
+
+    def test_truncate_markup(self):
+        markup = "<html><body><p>Hello</p><a href='a.html'>A</a></body></html>"
+        self.assertEqual((markup, 4, False), truncate_markup(markup))
+        self.assertEqual(("<html><body>", 2, True),
+                truncate_markup(markup, 2))
+        self.assertEqual((b"<html>", 1, True),
+                truncate_markup(markup.encode("utf-8"), 1))
+
+    def test_unknown_encoding(self):
+        content = "<html>été</html>".encode("latin-1")
+        self.assertEqual(content, get_unicode_markup(content))
 
 
 class CrawlerTest(unittest.TestCase):
@@ -184,7 +592,10 @@ class CrawlerTest(unittest.TestCase):
     def get_url(self, test_url):
         return "http://{0}:{1}{2}".format(self.ip, self.port, test_url)
 
-    def get_page_crawler(self, url):
+    def get_page_crawler(self, url, link_blocks=False, max_page_size=None,
+            max_elements=None, max_parse_time=None, check_anchors=False,
+            sort_query=False, strip_tracking_params=False, test_outside=True,
+            ignored_prefixes=()):
         url = self.get_url(url)
         url_split = get_clean_url_split(url)
         input_queue = compat.Queue.Queue()
@@ -192,11 +603,18 @@ class CrawlerTest(unittest.TestCase):
 
         worker_config = WorkerConfig(username=None, password=None, types=['a',
                 'img', 'link', 'script'], timeout=5, parser=PARSER_STDLIB,
-                strict_mode=False)
+                strict_mode=False, link_blocks=link_blocks,
+                max_page_size=max_page_size, max_elements=max_elements,
+                max_parse_time=max_parse_time, check_anchors=check_anchors,
+                sort_query=sort_query,
+                strip_tracking_params=strip_tracking_params,
+                accepted_hosts=frozenset([url_split.netloc]),
+                test_outside=test_outside, ignored_prefixes=ignored_prefixes,
+                user_agent=USER_AGENT)
 
         worker_init = WorkerInit(worker_config=worker_config,
                 input_queue=input_queue, output_queue=output_queue,
-                logger=get_logger())
+                logger=get_logger(), parse_pool=None)
 
         page_crawler = PageCrawler(worker_init)
 
@@ -222,6 +640,20 @@ class CrawlerTest(unittest.TestCase):
         self.assertEqual(200, response.status)
         self.assertTrue(response.exception is None)
 
+    def test_user_agent(self):
+        requests = []
+
+        def urlopen(request, timeout):
+            requests.append(request)
+            raise ValueError("Not sent")
+
+        import socket
+        url = self.get_url("/index.html")
+        response = open_url(urlopen, get_url_request(), url, 5,
+                socket.timeout, user_agent=USER_AGENT)
+        self.assertTrue(response.exception is not None)
+        self.assertEqual(USER_AGENT, requests[0].get_header("User-agent"))
+
     def test_301(self):
         urlopen = get_url_open()
         import socket
@@ -233,7 +665,7 @@ class CrawlerTest(unittest.TestCase):
 
     def test_crawl_page(self):
         page_crawler, url_split = self.get_page_crawler("/index.html")
-        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True))
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
 
         self.assertEqual(200, page_crawl.status)
         self.assertTrue(page_crawl.is_html)
@@ -251,9 +683,92 @@ class CrawlerTest(unittest.TestCase):
         self.assertEqual(1, len(script_links))
         self.assertEqual(1, len(link_links))
 
+    def test_crawl_page_filtered_links(self):
+        page_crawler, url_split = self.get_page_crawler("/index.html",
+                test_outside=False,
+                ignored_prefixes=(self.get_url("/sub/"),))
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+
+        # a.html, c.html and d.html (sub/b.html is ignored)
+        self.assertEqual(3, len(page_crawl.links))
+
+    def test_crawl_page_link_types(self):
+        page_crawler, url_split = self.get_page_crawler("/types.html")
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+
+        # The same url is kept once per link type.
+        self.assertEqual(["a", "img"], [link.type for link in
+                page_crawl.links])
+
+    def test_crawl_page_link_blocks(self):
+        page_crawler, url_split = self.get_page_crawler("/blocks.html", True)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+
+        # The menu has a relative link so it is not a shared block.
+        self.assertEqual(2, len(page_crawl.links))
+        self.assertEqual(2, len(page_crawl.link_blocks))
+        self.assertEqual(2, len(page_crawl.block_ids))
+        self.assertEqual(2, len(page_crawl.link_blocks[0].links))
+
+        # Blocks are only sent once per worker
+        page_crawler.put_output(page_crawl)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertEqual(2, len(page_crawl.links))
+        self.assertEqual(0, len(page_crawl.link_blocks))
+        self.assertEqual(2, len(page_crawl.block_ids))
+
+    def test_crawl_page_limits(self):
+        page_crawler, url_split = self.get_page_crawler("/index.html",
+                max_elements=6)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+
+        # html, head, link, body, a (#), a (name)
+        self.assertEqual(TRUNCATED_ELEMENTS, page_crawl.truncated)
+        self.assertEqual(1, len(page_crawl.links))
+
+        page_crawler, url_split = self.get_page_crawler("/index.html",
+                max_page_size=200)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertEqual(TRUNCATED_SIZE, page_crawl.truncated)
+        self.assertEqual(200, page_crawl.status)
+
+        page_crawler, url_split = self.get_page_crawler("/index.html",
+                max_page_size=10000, max_elements=100, max_parse_time=10)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertEqual(None, page_crawl.truncated)
+        self.assertEqual(8, len(page_crawl.links))
+
+    def test_max_parse_time(self):
+        parse_cost = crawler_module.parse_cost
+        crawler_module.parse_cost = ParseCost()
+        try:
+            page_crawler, url_split = self.get_page_crawler("/index.html",
+                    max_parse_time=1)
+            # The page is parsed completely within the default budget.
+            page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True,
+                    0))
+            self.assertEqual(None, page_crawl.truncated)
+            self.assertEqual(8, len(page_crawl.links))
+
+            page_crawler, url_split = self.get_page_crawler("/a.html",
+                    max_parse_time=0.000001)
+            page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True,
+                    0))
+            self.assertEqual(TRUNCATED_TIME, page_crawl.truncated)
+
+            # The parse cost is unknown: the default cost applies.
+            crawler_module.parse_cost = ParseCost()
+            page_crawler, url_split = self.get_page_crawler("/index.html",
+                    max_parse_time=0.000001)
+            page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True,
+                    0))
+            self.assertEqual(TRUNCATED_TIME, page_crawl.truncated)
+        finally:
+            crawler_module.parse_cost = parse_cost
+
     def test_crawl_resource(self):
         page_crawler, url_split = self.get_page_crawler("/sub/small_image.gif")
-        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True))
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
 
         self.assertEqual(200, page_crawl.status)
         self.assertFalse(page_crawl.links)
@@ -264,7 +779,7 @@ class CrawlerTest(unittest.TestCase):
 
     def test_base_url(self):
         page_crawler, url_split = self.get_page_crawler("/alone.html")
-        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True))
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
 
         self.assertEqual(1, len(page_crawl.links))
         self.assertEqual('http://www.example.com/test.html',
@@ -272,7 +787,7 @@ class CrawlerTest(unittest.TestCase):
 
     def test_crawl_404(self):
         page_crawler, url_split = self.get_page_crawler("/sub/small_image_bad.gif")
-        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True))
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
 
         self.assertEqual(404, page_crawl.status)
         self.assertFalse(page_crawl.links)
@@ -285,7 +800,7 @@ class CrawlerTest(unittest.TestCase):
         input_queue = page_crawler.input_queue
         output_queue = page_crawler.output_queue
 
-        input_queue.put(WorkerInput(url_split, True))
+        input_queue.put(WorkerInput(url_split, True, 0))
         input_queue.put(WORK_DONE)
         page_crawler.crawl_page_forever()
 
@@ -294,8 +809,9 @@ class CrawlerTest(unittest.TestCase):
         self.assertEqual(200, page_crawl.status)
         self.assertTrue(len(page_crawl.links) > 0)
 
-    def _run_crawler_plain(self, crawler_class, other_options=None):
-        url = self.get_url("/index.html")
+    def _run_crawler_plain(self, crawler_class, other_options=None,
+            start_url="/index.html"):
+        url = self.get_url(start_url)
         sys.argv = ['pylinkchecker', "-m", "process", url]
         if not other_options:
             other_options = []
@@ -320,6 +836,328 @@ class CrawlerTest(unittest.TestCase):
         self.assertEqual(11, len(site.pages))
         self.assertEqual(1, len(site.error_pages))
 
+    def test_bloom_filter_size(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--bloom-filter-size=100"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+        self.assertEqual(0, len(site.page_statuses))
+        page = site.get_page(get_clean_url_split(self.get_url("/a.html")))
+        self.assertEqual(200, page.status)
+
+    def test_max_host_workers(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--max-host-workers=1", "--host-weights=localhost:2"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+
+    def test_sitemap_state(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            options = ["--sitemap=" + self.get_url("/sitemap_index.xml"),
+                    "--state=" + os.path.join(temp_dir, "state.json")]
+            site = self._run_crawler_plain(ThreadSiteCrawler, options,
+                    "/c.html")
+            # c, a, f, d and nothing (404)
+            self.assertEqual(5, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+
+            # a did not change. f did not change but links to a broken url:
+            # it is crawled again.
+            site = self._run_crawler_plain(ThreadSiteCrawler, options,
+                    "/c.html")
+            self.assertEqual(4, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+            self.assertEqual([SKIPPED_UNCHANGED],
+                    list(site.skipped_urls.values()))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_robots(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            cache_path = os.path.join(temp_dir, "robots.json")
+            site = self._run_crawler_plain(ThreadSiteCrawler, ["--robots",
+                    "--robots-cache=" + cache_path])
+            # /sub/ is disallowed except /sub/b.html
+            self.assertEqual(7, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+            self.assertEqual(4, list(site.skipped_urls.values()).count(
+                    SKIPPED_ROBOTS))
+            self.assertTrue(os.path.exists(cache_path))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_resume(self):
+        self._test_resume([])
+
+    def test_resume_frontier_memory(self):
+        self._test_resume(["--frontier-memory=2"])
+
+    def _test_resume(self, options):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            checkpoint_path = os.path.join(temp_dir, "checkpoint")
+            options = options + ["--checkpoint=" + checkpoint_path]
+            sys.argv = ['pylinkchecker', self.get_url("/index.html")] +\
+                    options
+            config = Config()
+            config.parse_cli_config()
+            crawler = ThreadSiteCrawler(config, get_logger())
+            # The start url was being crawled when the crawl was interrupted.
+            url_split = crawler.start_url_splits[0]
+            crawler.in_flight_inputs[url_split] = WorkerInput(url_split, True,
+                    0)
+            crawler.save_checkpoint()
+            crawler.site.close()
+
+            site = self._run_crawler_plain(ThreadSiteCrawler,
+                    options + ["--resume"], "/does_not_exist.html")
+            self.assertEqual(11, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+            self.assertFalse(os.path.exists(checkpoint_path))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_interrupt_checkpoint(self):
+        class InterruptedCrawler(ThreadSiteCrawler):
+            interrupt_in_page = True
+
+            def process_page_crawl(self, page_crawl):
+                worker_inputs = super(InterruptedCrawler,
+                        self).process_page_crawl(page_crawl)
+                if self.interrupt_in_page:
+                    # The page is crawled but its links are not queued.
+                    raise KeyboardInterrupt()
+                return worker_inputs
+
+            def wait_page_crawls(self, in_flight):
+                if len(self.site.pages) >= 2:
+                    raise KeyboardInterrupt()
+                return super(InterruptedCrawler, self).wait_page_crawls(
+                        in_flight)
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            checkpoint_path = os.path.join(temp_dir, "checkpoint")
+            sys.argv = ['pylinkchecker', self.get_url("/index.html"),
+                    "--checkpoint=" + checkpoint_path]
+            config = Config()
+            config.parse_cli_config()
+            crawler = InterruptedCrawler(config, get_logger())
+            self.assertRaises(KeyboardInterrupt, crawler.crawl)
+            self.assertFalse(os.path.exists(checkpoint_path))
+
+            # Interrupted while waiting for the workers.
+            crawler = InterruptedCrawler(config, get_logger())
+            crawler.interrupt_in_page = False
+            self.assertRaises(KeyboardInterrupt, crawler.crawl)
+            self.assertTrue(os.path.exists(checkpoint_path))
+
+            site = self._run_crawler_plain(ThreadSiteCrawler,
+                    ["--checkpoint=" + checkpoint_path, "--resume"])
+            self.assertEqual(11, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_remote_crawler(self):
+        if not has_multiprocessing():
+            return
+        import multiprocessing
+        sys.argv = ['pylinkchecker', self.get_url("/index.html"),
+                "--mode=remote", "--listen=localhost:0", "--remote-workers=2",
+                "--remote-key=secret", "--batch-size=2"]
+        config = Config()
+        config.parse_cli_config()
+        crawler = RemoteSiteCrawler(config, get_logger())
+
+        processes = []
+        for _ in range(2):
+            sys.argv = ['pylinkchecker', "--remote-worker=localhost:{0}"
+                    .format(crawler.address[1]), "--remote-key=secret",
+                    "--workers=2"]
+            worker_config = Config()
+            worker_config.parse_cli_config()
+            process = multiprocessing.Process(target=run_remote_worker,
+                    args=(worker_config,))
+            process.start()
+            processes.append(process)
+
+        crawler.crawl()
+        for process in processes:
+            process.join(5)
+
+        self.assertEqual(11, len(crawler.site.pages))
+        self.assertEqual(1, len(crawler.site.error_pages))
+
+    def test_page_crawler_not_modified(self):
+        page_crawler, url_split = self.get_page_crawler("/f.html")
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertFalse(page_crawl.not_modified)
+        self.assertEqual(2, len(page_crawl.links))
+
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0,
+                page_crawl.validators))
+        self.assertTrue(page_crawl.not_modified)
+        self.assertEqual(0, len(page_crawl.links))
+
+    def test_incremental(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            options = ["--incremental",
+                    "--state=" + os.path.join(temp_dir, "state.json")]
+            self._run_crawler_plain(ThreadSiteCrawler, options)
+
+            # The links of the pages that did not change are reused.
+            site = self._run_crawler_plain(ThreadSiteCrawler, options)
+            self.assertEqual(11, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+            error_page = list(site.error_pages.values())[0]
+            self.assertEqual(self.get_url("/f.html"),
+                    error_page.sources[0].origin.geturl())
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_changed(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            state_option = "--state=" + os.path.join(temp_dir, "state.json")
+            self._run_crawler_plain(ThreadSiteCrawler, ["--incremental",
+                    state_option])
+
+            changed_path = os.path.join(temp_dir, "changed.txt")
+            with io.open(changed_path, "w", encoding="utf-8") as changed_file:
+                changed_file.write(self.get_url("/f.html") + "\n")
+            site = self._run_crawler_plain(ThreadSiteCrawler,
+                    ["--changed=" + changed_path, state_option])
+            # f.html, sub/b.html linking to it and their links.
+            self.assertEqual(5, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+
+            # The --max-depth of the user is kept.
+            site = self._run_crawler_plain(ThreadSiteCrawler,
+                    ["--changed=" + changed_path, "--max-depth=0",
+                    state_option])
+            self.assertEqual(2, len(site.pages))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_max_errors(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler, [],
+                "/broken.html")
+        self.assertEqual(4, len(site.error_pages))
+
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--fail-fast"],
+                "/broken.html")
+        self.assertEqual(1, len(site.error_pages))
+        self.assertEqual(3, len(site.skipped_urls))
+        self.assertTrue(site.stopped)
+
+        # The crawl is complete: it did not stop.
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--max-errors=4"],
+                "/broken.html")
+        self.assertEqual(4, len(site.error_pages))
+        self.assertFalse(site.stopped)
+
+        # Missing anchors are errors.
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--check-anchors",
+                "--fail-fast"], "/anchors.html")
+        self.assertTrue(site.stopped)
+        self.assertEqual(0, len(site.error_pages))
+        self.assertTrue(site.missing_anchors)
+
+    def test_shards(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            page_count = 0
+            for index in (1, 2):
+                path = os.path.join(temp_dir, "shard{0}".format(index))
+                site = self._run_crawler_plain(ThreadSiteCrawler,
+                        ["--shard={0}/2".format(index), "--shard-file=" +
+                        path])
+                paths.append(path)
+                page_count += len(site.pages)
+            self.assertEqual(11, page_count)
+
+            (site, _) = merge_shard_files(paths, site.config)
+            self.assertEqual(11, len(site.pages))
+            self.assertEqual(1, len(site.error_pages))
+            self.assertEqual(2, len(site.get_page(get_clean_url_split(
+                    self.get_url("/a.html"))).sources))
+
+            self.assertRaises(ValueError, merge_shard_files, paths[:1],
+                    site.config)
+
+            # A page reached from two shards (e.g., redirects to the same
+            # url) keeps the sources of both shards.
+            merged_site = Site([], site.config)
+            data = load_checkpoint(paths[0])["site"]
+            (url_id, page) = [(url_id, page) for (url_id, page) in
+                    data["pages"].items() if page.sources][0]
+            source_count = len(page.sources)
+            merged_site.add_shard_result(data)
+            merged_site.add_shard_result(load_checkpoint(paths[0])["site"])
+            self.assertEqual(2 * source_count,
+                    len(merged_site.pages[url_id].sources))
+        finally:
+            shutil.rmtree(temp_dir)
+
+    def test_max_per_template(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler, [], "/items.html")
+        self.assertEqual(7, len(site.pages))
+
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--max-per-template=2"], "/items.html")
+        # The links of items/3.html are not followed.
+        self.assertEqual(5, len(site.pages))
+        template = get_url_template(get_clean_url_split(
+                self.get_url("/items/3.html")))
+        self.assertEqual([2, 1], site.url_templates[template])
+
+    def test_sample_rate(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--sample-rate=0.01", "--sample-min=1", "--sample-seed=1"])
+        self.assertTrue(len(site.pages) < 11)
+        estimate = site.sampler.get_estimate()
+        self.assertEqual(len(site.pages) - 1, estimate.checked)
+        self.assertTrue(estimate.discovered > estimate.checked)
+
+    def test_batch_size(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--batch-size=4"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+
+    def test_site_process_crawler_batch_size(self):
+        if not has_multiprocessing():
+            return
+        site = self._run_crawler_plain(ProcessSiteCrawler, ["--batch-size=4",
+                "--workers=2"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+
+    def test_canonical_links(self):
+        page_crawler, url_split = self.get_page_crawler("/canonical.html",
+                sort_query=True, strip_tracking_params=True)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+
+        urls = set([link.url_split.geturl() for link in page_crawl.links])
+        self.assertEqual(set([self.get_url("/a.html"),
+                self.get_url("/b.html?x=2&y=1")]), urls)
+
+    def test_page_crawler_batch(self):
+        page_crawler, url_split = self.get_page_crawler("/index.html")
+        url_split2 = get_clean_url_split(self.get_url("/a.html"))
+        page_crawler.input_queue.put([WorkerInput(url_split, True, 0),
+                WorkerInput(url_split2, True, 0)])
+        page_crawler.input_queue.put(WORK_DONE)
+        page_crawler.crawl_page_forever()
+
+        page_crawls = page_crawler.output_queue.get()
+        self.assertEqual(2, len(page_crawls))
+        self.assertEqual(200, page_crawls[1].status)
+
     def test_run_once(self):
         site = self._run_crawler_plain(ThreadSiteCrawler, ["--run-once"])
 
@@ -327,6 +1165,55 @@ class CrawlerTest(unittest.TestCase):
         self.assertEqual(8, len(site.pages))
         self.assertEqual(0, len(site.error_pages))
 
+    def test_max_depth(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--max-depth=1"])
+        self.assertEqual(8, len(site.pages))
+        self.assertEqual(0, len(site.error_pages))
+        self.assertEqual(0, len(site.skipped_urls))
+
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--max-depth=0"])
+        self.assertEqual(1, len(site.pages))
+        self.assertEqual(7, len(site.skipped_urls))
+
+    def test_skipped_url_found_again(self):
+        sys.argv = ["pylinkchecker", "--max-depth=1",
+                self.get_url("/index.html")]
+        config = Config()
+        config.parse_cli_config()
+        site = Site([], config, get_logger())
+
+        url_split = get_clean_url_split(self.get_url("/c.html"))
+        link = Link("a", url_split, url_split, "<a href=\"c.html\">", None)
+        deep_page = get_clean_url_split(self.get_url("/sub/b.html"))
+        site.process_links(PageCrawl(deep_page, None, 200, False, False,
+                [link], None, True, [], [], None, None, None), 1)
+        self.assertEqual(SKIPPED_DEPTH, site.skipped_urls[url_split])
+        self.assertEqual([deep_page], [source.origin for source in
+                site.skipped_sources[url_split]])
+
+        # Found again at a smaller depth: queued with both sources.
+        page = get_clean_url_split(self.get_url("/index.html"))
+        worker_inputs = site.process_links(PageCrawl(page, None, 200, False,
+                False, [link], None, True, [], [], None, None, None), 0)
+        self.assertEqual([url_split], [worker_input.url_split for
+                worker_input in worker_inputs])
+        self.assertFalse(site.skipped_urls)
+        self.assertFalse(site.skipped_sources)
+        self.assertEqual(2, len(site.page_statuses[get_url_id(
+                url_split)].sources))
+
+    def test_max_pages(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--max-pages=3"])
+        self.assertEqual(3, len(site.pages))
+        # 5 urls from index.html and 2 from sub/b.html
+        self.assertEqual(7, len(site.skipped_urls))
+
+    def test_max_duration(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--max-duration=0"])
+        self.assertEqual(1, len(site.pages))
+        self.assertEqual(7, len(site.skipped_urls))
+
     def test_strict_mode(self):
         site = self._run_crawler_plain(ThreadSiteCrawler, ["--strict"])
 
@@ -345,12 +1232,103 @@ class CrawlerTest(unittest.TestCase):
         # TODO test gevent. Cannot use threaded simple http server :-(
         self.assertTrue(True)
 
+    def test_duplicate_pages(self):
+        page_crawler, url_split = self.get_page_crawler("/a.html")
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertTrue(page_crawl.content_hash)
+
+        url_split = get_clean_url_split(self.get_url("/c.html"))
+        page_crawl2 = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertEqual(page_crawl.content_hash, page_crawl2.content_hash)
+
+        site = self._run_crawler_plain(ThreadSiteCrawler)
+        # a.html, c.html, d.html and sub/e.html are identical.
+        self.assertEqual(3, len(site.duplicate_pages))
+        for page in site.duplicate_pages.values():
+            self.assertEqual(self.get_url("/a.html"),
+                    page.duplicate_of.geturl())
+
+    def test_parse_workers(self):
+        if not has_multiprocessing():
+            return
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--mode=thread", "--workers=2", "--parse-workers=2"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+
+    def test_parse_pool_error(self):
+        if not has_multiprocessing():
+            return
+        results = compat.Queue.Queue()
+        (page_crawler, _) = self.get_page_crawler("/index.html")
+        parse_pool = ParsePool(1, 1)
+        try:
+            # The charset cannot be sent to the pool.
+            parse_pool.parse(b"<html></html>", lambda: None,
+                    page_crawler.worker_config, results.put)
+            (page_extract, exception) = results.get(True, 10)
+            self.assertEqual(None, page_extract)
+            self.assertTrue(exception is not None)
+            # The slot was released.
+            self.assertTrue(parse_pool.slots.acquire(False))
+            parse_pool.slots.release()
+
+            # The page cannot be parsed by the pool process.
+            parse_pool.parse(None, None, page_crawler.worker_config,
+                    results.put)
+            (page_extract, exception) = results.get(True, 10)
+            self.assertEqual(None, page_extract)
+            self.assertTrue(exception is not None)
+            self.assertTrue(parse_pool.slots.acquire(False))
+        finally:
+            parse_pool.close()
+
+    def test_check_anchors(self):
+        page_crawler, url_split = self.get_page_crawler("/anchors.html",
+                check_anchors=True)
+        page_crawl = page_crawler._crawl_page(WorkerInput(url_split, True, 0))
+        self.assertEqual(3, len(page_crawl.anchors))
+        self.assertEqual(["title", "old-style", "top", "missing", "nothing",
+                "end", "absent"], [link.fragment for link in page_crawl.links])
+        self.assertEqual(self.get_url("/anchors.html"),
+                page_crawl.links[0].url_split.geturl())
+        # #end is resolved against the page url.
+        self.assertEqual(self.get_url("/anchors.html"),
+                page_crawl.links[5].url_split.geturl())
+
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--check-anchors"],
+                "/anchors.html")
+        self.assertEqual(2, len(site.pages))
+        self.assertEqual(0, len(site.error_pages))
+        self.assertEqual(3, len(site.missing_anchors))
+        self.assertFalse(site.is_ok)
+        missing = sorted(fragment for (_, fragment) in site.missing_anchors)
+        self.assertEqual(["absent", "missing", "nothing"], missing)
+
+    def test_frontier_memory(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler,
+                ["--frontier-memory=2"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+        # The seen urls were spilled and the temporary file removed.
+        self.assertTrue(site.page_statuses.path)
+        self.assertFalse(os.path.exists(site.page_statuses.path))
+
+    def test_link_blocks(self):
+        site = self._run_crawler_plain(ThreadSiteCrawler, ["--link-blocks"])
+        self.assertEqual(11, len(site.pages))
+        self.assertEqual(1, len(site.error_pages))
+
     def test_api(self):
         url = self.get_url("/index.html")
 
         site = api.crawl(url)
         self.assertEqual(11, len(site.pages))
         self.assertEqual(1, len(site.error_pages))
+        # The api keeps the pages indexed by url.
+        url_split = get_clean_url_split(url)
+        self.assertEqual(url_split, site.pages[url_split].url_split)
+        self.assertTrue(site.get_page(url_split))
 
     def test_api_with_options(self):
         url = self.get_url("/index.html")
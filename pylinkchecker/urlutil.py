@@ -4,7 +4,14 @@ Contains the crawling logic.
 """
 from __future__ import unicode_literals, absolute_import
 
-from pylinkchecker.compat import urlparse
+import array
+import hashlib
+import math
+import re
+import threading
+import zlib
+
+from pylinkchecker.compat import urlparse, unquote
 
 
 SCHEME_HTTP = "http"
@@ -12,6 +19,50 @@ SCHEME_HTTPS = "https"
 SUPPORTED_SCHEMES = (SCHEME_HTTP, SCHEME_HTTPS)
 
 
+DEFAULT_CACHE_SIZE = 10000
+
+
+DEFAULT_PORTS = {
+    SCHEME_HTTP: 80,
+    SCHEME_HTTPS: 443,
+}
+
+
+TRACKING_PARAMS = (
+    "fbclid",
+    "gclid",
+    "mc_cid",
+    "mc_eid",
+    "utm_campaign",
+    "utm_content",
+    "utm_medium",
+    "utm_source",
+    "utm_term",
+)
+
+
+UNRESERVED_CHARS = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+        "0123456789-._~")
+
+
+PERCENT_ENCODED = re.compile(r"%[0-9a-fA-F]{2}")
+
+
+# Urls that do not depend on the base url.
+ABSOLUTE_URL = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://")
+
+
+# Patterns of the path segments replaced in url templates, in order.
+SEGMENT_PATTERNS = (
+    (re.compile(r"^\d+$"), "<int>"),
+    (re.compile(r"^\d{4}-\d{2}-\d{2}$"), "<date>"),
+    (re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-"
+            r"[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"), "<uuid>"),
+    (re.compile(r"^(?=.*\d)[0-9a-fA-F]{8,}$"), "<hex>"),
+    (re.compile(r"^(?=.*\d)[\w.~-]*\d[\w.~-]*$", re.UNICODE), "<slug-id>"),
+)
+
+
 NOT_LINK = [
     'data',
     '#',
@@ -19,6 +70,93 @@ NOT_LINK = [
 ]
 
 
+class URLCache(object):
+    """Bounded cache that evicts the least recently used entries.
+
+    This class is thread-safe. Each process has its own caches.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        """Map of key:[value, last access]"""
+
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    @property
+    def hit_rate(self):
+        """Returns the ratio of lookups that were found in the cache."""
+        total = self.hits + self.misses
+        if not total:
+            return 0.0
+        return float(self.hits) / float(total)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._clock += 1
+            entry[1] = self._clock
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._clock += 1
+            self._entries[key] = [value, self._clock]
+            if len(self._entries) > self.max_size:
+                self._evict()
+
+    def setdefault(self, key, value):
+        """Returns the cached value or caches and returns value. Does not
+        count as a hit or a miss."""
+        with self._lock:
+            self._clock += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [value, self._clock]
+                self._entries[key] = entry
+                if len(self._entries) > self.max_size:
+                    self._evict()
+            else:
+                entry[1] = self._clock
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        # Evicting a quarter of the entries at once keeps the cost of
+        # sorting low for each insertion.
+        keys = sorted(self._entries, key=lambda k: self._entries[k][1])
+        for key in keys[:max(1, len(keys) // 4)]:
+            del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+absolute_url_cache = URLCache()
+"""Cache of url key (see get_absolute_url_key):absolute url split"""
+
+
+interned_url_splits = URLCache()
+"""Cache of url split:url split so that equal urls share the same object"""
+
+
+canonical_url_cache = URLCache()
+"""Cache of (url split, sort query, strip tracking params):canonical url
+split"""
+
+
 def is_link(url):
     """Return True if the url is not base 64 data or a local ref (#)"""
     for prefix in NOT_LINK:
@@ -27,6 +165,12 @@ def is_link(url):
     return True
 
 
+def is_fragment_link(url):
+    """Returns True if the url is a link to an anchor of the same page
+    (#anchor)"""
+    return len(url) > 1 and url.startswith("#")
+
+
 def get_clean_url_split(url):
     """Returns a clean SplitResult with a scheme and a valid path
 
@@ -44,7 +188,171 @@ def get_clean_url_split(url):
             url = SCHEME_HTTP + "://" + url
         split_result = urlparse.urlsplit(url)
 
-    return split_result
+    return interned_url_splits.setdefault(split_result, split_result)
+
+
+def split_fragment(url_split):
+    """Returns a tuple of (SplitResult without the fragment, unquoted
+    fragment or None)."""
+    if not url_split.fragment:
+        return (url_split, None)
+
+    fragment = unquote(url_split.fragment)
+    url_split = url_split._replace(fragment="")
+    return (interned_url_splits.setdefault(url_split, url_split), fragment)
+
+
+def get_canonical_url_split(url_split, sort_query=False,
+        strip_tracking_params=False):
+    """Returns the canonical form of a SplitResult so that equivalent urls are
+    only crawled once.
+
+    The scheme and the host are lowercased, the default port, the fragment
+    and the percent-encoding of unreserved characters are removed.
+
+    :param url_split: The SplitResult to canonicalize.
+    :param sort_query: If True, the query parameters are sorted by name.
+    :param strip_tracking_params: If True, the tracking parameters (e.g.,
+            utm_source) are removed from the query.
+    :rtype: A SplitResult
+    """
+    key = (url_split, sort_query, strip_tracking_params)
+    canonical_url_split = canonical_url_cache.get(key)
+
+    if canonical_url_split is None:
+        canonical_url_split = _canonicalize(url_split, sort_query,
+                strip_tracking_params)
+        canonical_url_split = interned_url_splits.setdefault(
+                canonical_url_split, canonical_url_split)
+        canonical_url_cache.put(key, canonical_url_split)
+
+    return canonical_url_split
+
+
+def _canonicalize(url_split, sort_query, strip_tracking_params):
+    scheme = url_split.scheme.lower()
+    path = _normalize_percent_encoding(url_split.path)
+    if not path and url_split.netloc:
+        path = "/"
+    query = _normalize_percent_encoding(url_split.query)
+    if query and (sort_query or strip_tracking_params):
+        query = _canonicalize_query(query, sort_query, strip_tracking_params)
+
+    return urlparse.SplitResult(scheme,
+            _canonicalize_netloc(scheme, url_split.netloc), path, query, "")
+
+
+def _canonicalize_netloc(scheme, netloc):
+    (userinfo, at, hostport) = netloc.rpartition("@")
+    host = hostport
+    port = ""
+    # Do not split IPv6 addresses ([::1]).
+    if ":" in hostport and not hostport.endswith("]"):
+        (host, _, port) = hostport.rpartition(":")
+
+    host = host.lower()
+    if not port or port == str(DEFAULT_PORTS.get(scheme)):
+        return userinfo + at + host
+    return userinfo + at + host + ":" + port
+
+
+def _canonicalize_query(query, sort_query, strip_tracking_params):
+    params = query.split("&")
+    if strip_tracking_params:
+        params = [param for param in params if
+                unquote(param.partition("=")[0]) not in TRACKING_PARAMS]
+    if sort_query:
+        # The sort is stable: parameters with the same name keep their order.
+        params.sort(key=lambda param: param.partition("=")[0])
+    return "&".join(params)
+
+
+def _normalize_percent_encoding(value):
+    if "%" not in value:
+        return value
+    return PERCENT_ENCODED.sub(_normalize_percent_match, value)
+
+
+def _normalize_percent_match(match):
+    char = chr(int(match.group(0)[1:], 16))
+    if char in UNRESERVED_CHARS:
+        return char
+    return match.group(0).upper()
+
+
+def get_url_id(url_split):
+    """Returns a compact id (a 64-bit integer) for a canonical url split.
+
+    The id is a hash of the url: collisions are possible but extremely
+    unlikely for the size of a crawl.
+    """
+    digest = hashlib.md5(url_split.geturl().encode("utf-8")).hexdigest()
+    return int(digest[:16], 16)
+
+
+class BloomFilter(object):
+    """Set of url ids that may report false positives but that only uses a
+    few bits per url.
+
+    :param capacity: Expected number of url ids.
+    :param error_rate: Probability of a false positive when the filter
+            contains capacity url ids.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.bit_size = int(math.ceil(-capacity * math.log(error_rate) /
+                (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(
+                self.bit_size * math.log(2) / capacity)))
+        self.bits = array.array(str("B"), [0]) * (self.bit_size // 8 + 1)
+
+    def add(self, url_id):
+        for position in self._get_positions(url_id):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def _get_positions(self, url_id):
+        # Double hashing: the id is already a good 64-bit hash.
+        hash1 = url_id & 0xffffffff
+        hash2 = url_id >> 32
+        for i in range(self.hash_count):
+            yield (hash1 + i * hash2) % self.bit_size
+
+    def __contains__(self, url_id):
+        for position in self._get_positions(url_id):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+def get_url_template(url_split):
+    """Returns the template of a url: path segments that look like ids are
+    replaced by their type and the query only keeps the names of its
+    parameters (e.g., example.com/cars/<int>?make&page).
+
+    Urls with the same template are usually pages with the same structure
+    (e.g., catalog pages or search results).
+    """
+    segments = []
+    for segment in url_split.path.split("/"):
+        for (pattern, name) in SEGMENT_PATTERNS:
+            if pattern.match(segment):
+                segment = name
+                break
+        segments.append(segment)
+    template = url_split.netloc + "/".join(segments)
+
+    if url_split.query:
+        names = set()
+        for param in url_split.query.split("&"):
+            names.add(param.partition("=")[0])
+        template += "?" + "&".join(sorted(names))
+    return template
+
+
+def get_anchor_key(anchor):
+    """Returns a compact key (an integer) for an anchor name or id."""
+    return zlib.crc32(anchor.encode("utf-8")) & 0xffffffff
 
 
 def get_absolute_url_split(url, base_url_split):
@@ -54,6 +362,30 @@ def get_absolute_url_split(url, base_url_split):
     :param base_url_split: THe SplitResult of the base URL.
     :rtype: A SplitResult
     """
-    new_url = urlparse.urljoin(base_url_split.geturl(), url)
+    key = get_absolute_url_key(url, base_url_split)
+    url_split = absolute_url_cache.get(key)
+
+    if url_split is None:
+        new_url = urlparse.urljoin(base_url_split.geturl(), url)
+        url_split = get_clean_url_split(new_url)
+        absolute_url_cache.put(key, url_split)
+
+    return url_split
 
-    return get_clean_url_split(new_url)
\ No newline at end of file
+
+def get_absolute_url_key(url, base_url_split):
+    """Returns the key of a url in the absolute_url_cache: only the parts of
+    the base url used to resolve the url are kept, so the links shared by
+    many pages (e.g., menus) are resolved once.
+    """
+    if ABSOLUTE_URL.match(url):
+        return url
+    elif url.startswith("//"):
+        return (base_url_split.scheme, url)
+    elif url.startswith("/"):
+        return (base_url_split.scheme, base_url_split.netloc, url)
+    elif url and url[0] not in "?#":
+        # Relative paths only depend on the directory of the base url.
+        return (base_url_split.scheme, base_url_split.netloc,
+                base_url_split.path.rpartition("/")[0], url)
+    return (base_url_split, url)
@@ -29,7 +29,8 @@ resources like images.
     license='BSD License',
     url='https://github.com/auto123/pylinkchecker',
     packages=['pylinkchecker', 'pylinkchecker.bs4', 'pylinkchecker.bs4.builder'],
-    scripts = ['pylinkchecker/bin/pylinkcheck.py'],
+    scripts = ['pylinkchecker/bin/pylinkcheck.py',
+        'pylinkchecker/bin/pylinkmerge.py'],
     classifiers=[
         'Environment :: Console',
         'Intended Audience :: Developers',